@@ -0,0 +1,94 @@
+"""
+Admission control - per-client token buckets and per-route-class concurrency
+limits, so overload turns into fast 429/503 responses instead of timeouts
+"""
+
+from collections import OrderedDict
+from typing import Dict, Optional
+import threading
+import time
+
+
+class RateLimiter:
+    """Token bucket per client key; least recently seen clients are evicted past max_clients"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key: str) -> float:
+        """Take one token; returns 0 when allowed, else seconds until a token is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else (1.0 - tokens) / self.rate
+
+
+class ConcurrencyLimiter:
+    """
+    Bounded in-flight slots with a bounded wait queue.
+
+    A request waits at most `max_wait` seconds for a slot (the latency
+    target); when the queue is already full it is rejected immediately.
+    """
+
+    def __init__(self, limit: int, max_queue: int, max_wait: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.inflight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> bool:
+        with self._cond:
+            if self.inflight < self.limit:
+                self.inflight += 1
+                return True
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            admitted = self._cond.wait_for(lambda: self.inflight < self.limit, timeout=self.max_wait)
+            self.waiting -= 1
+            if admitted:
+                self.inflight += 1
+            else:
+                self.rejected += 1
+            return admitted
+
+    def release(self) -> None:
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, int]:
+        return {'limit': self.limit, 'inflight': self.inflight, 'waiting': self.waiting, 'rejected': self.rejected}
+
+
+class AdmissionController:
+    """Rate limiting plus one ConcurrencyLimiter per route class"""
+
+    def __init__(self, rate: float, burst: float, limits: Dict[str, int], max_wait: float):
+        self.rate_limiter = RateLimiter(rate, burst) if rate > 0 else None
+        self.classes = {
+            name: ConcurrencyLimiter(limit, max_queue=2 * limit, max_wait=max_wait)
+            for name, limit in limits.items()
+        }
+
+    def limiter(self, route_class: str) -> Optional[ConcurrencyLimiter]:
+        return self.classes.get(route_class)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: limiter.stats() for name, limiter in self.classes.items()}
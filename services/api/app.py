@@ -3,20 +3,149 @@ Canada Map POI Demo - Flask Application
 Demonstrates how to use the self-hosted TileServer GL with Python
 """
 
-from flask import Flask, jsonify, render_template_string
-from dataclasses import dataclass
-from typing import List
+from flask import Flask, Response, g, jsonify, render_template_string, request
+from dataclasses import asdict, dataclass, fields
+from contextlib import nullcontext
+from functools import wraps
+from typing import List, Optional
+import hmac
+import math
 import os
 import json
+import re
+import threading
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from admission import AdmissionController
+from colocation import parent_map
+from corridor import corridor, decode_polyline, route_pieces
+from declutter import LabelIndex
+from density import DensityIndex
+from footprints import FootprintIndex, geometry_polygons
+from hilbert import HilbertIndex, record_json
+from layers import LayerRegistry
+from offline import fit_max_zoom, style_assets, tile_count, tile_urls
+from poi_store import AttributeIndex, PoiStore, read_pois_json
+from profiling import PhaseTimer, SlowRequestLog, collapsed_text, sample_stacks
+from shared_cache import MemoryStore, SharedCache, open_shard
+from snapshot import is_snapshot, open_snapshot
+from spatial import SpatialIndex, mercator_to_lonlat
+from style_proxy import StyleProxy
 
 app = Flask(__name__)
 
+# Pooled keep-alive connections for every call to the tileserver
+UPSTREAM = requests.Session()
+UPSTREAM.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+UPSTREAM.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
 # TileServer GL URLs
 # TILESERVER_URL is for internal container-to-container communication
 # TILESERVER_PUBLIC_URL is for browser/client access (served in HTML)
 TILESERVER_URL = os.environ.get("TILESERVER_URL", "http://localhost:8080")
 TILESERVER_PUBLIC_URL = os.environ.get("TILESERVER_PUBLIC_URL", "http://localhost:8080")
 
+# Seconds a proxied style stays cached before it is re-fetched from the tileserver
+STYLE_CACHE_SECONDS = float(os.environ.get("STYLE_CACHE_SECONDS", "300"))
+
+# Vector tile URL template for region packs (must match the style's tile source)
+TILE_URL_TEMPLATE = os.environ.get("TILE_URL_TEMPLATE", f"{TILESERVER_PUBLIC_URL}/data/canada/{{z}}/{{x}}/{{y}}.pbf")
+
+# Shared cache for tiles and styles fetched from the tileserver. CACHE_PEERS lists
+# every shard: API replicas (http://host:port) or Redis-protocol servers (redis://host:port).
+# CACHE_SELF_URL is this replica's own entry, served from its memory. Empty = local only
+CACHE_PEERS = [u.strip().rstrip('/') for u in os.environ.get("CACHE_PEERS", "").split(',') if u.strip()]
+CACHE_SELF_URL = os.environ.get("CACHE_SELF_URL", "").rstrip('/')
+CACHE_PEER_TOKEN = os.environ.get("CACHE_PEER_TOKEN", "")  # Required by the peer routes; disabled when unset
+CACHE_MEMORY_MB = float(os.environ.get("CACHE_MEMORY_MB", "256"))
+CACHE_L1_MB = float(os.environ.get("CACHE_L1_MB", "32"))
+CACHE_L1_SECONDS = float(os.environ.get("CACHE_L1_SECONDS", "30"))
+CACHE_LEASE_SECONDS = float(os.environ.get("CACHE_LEASE_SECONDS", "10"))
+TILE_PROXY_CACHE_SECONDS = float(os.environ.get("TILE_PROXY_CACHE_SECONDS", "86400"))
+
+# Region packs: tile budget per pack and the zoom range it may cover
+REGION_PACK_MAX_TILES = int(os.environ.get("REGION_PACK_MAX_TILES", "20000"))
+REGION_PACK_MIN_ZOOM = int(os.environ.get("REGION_PACK_MIN_ZOOM", "0"))
+REGION_PACK_MAX_ZOOM = int(os.environ.get("REGION_PACK_MAX_ZOOM", "12"))
+
+# Entries kept in the browser's LRU tile/glyph/sprite cache (region packs are not counted)
+TILE_CACHE_MAX_ENTRIES = int(os.environ.get("TILE_CACHE_MAX_ENTRIES", "3000"))
+
+# Bearer token for write/admin endpoints; writes are disabled when unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# SSE keep-alive interval in seconds (keeps proxies from closing idle streams)
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+
+# Admission control: per-client token bucket and in-flight limits per route class
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1") == "1"
+RATE_LIMIT_RPS = float(os.environ.get("RATE_LIMIT_RPS", "20"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "40"))
+ADMISSION_MAX_WAIT_MS = float(os.environ.get("ADMISSION_MAX_WAIT_MS", "250"))
+ADMISSION_LIMITS = {
+    'cheap': int(os.environ.get("ADMISSION_LIMIT_CHEAP", "64")),  # In-memory POI reads
+    'heavy': int(os.environ.get("ADMISSION_LIMIT_HEAVY", "4")),  # Batch computations
+    'upstream': int(os.environ.get("ADMISSION_LIMIT_UPSTREAM", "16")),  # Calls the tileserver
+    'stream': int(os.environ.get("ADMISSION_LIMIT_STREAM", "200")),  # Long-lived SSE connections
+}
+# Proxies in front of the app whose X-Forwarded-For entries are trusted (0 = use the socket peer).
+# Defaults to the Container Apps ingress of the documented deployment; with 0 behind a proxy,
+# every client would share the proxy's bucket
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "1"))
+
+# Requests slower than this are kept (with per-phase timings) for /api/admin/slow-requests
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_LOG_SIZE = int(os.environ.get("SLOW_REQUEST_LOG_SIZE", "200"))
+PROFILE_MAX_SECONDS = 60
+PROFILE_MAX_INTERVAL_MS = 1000
+
+# Optional compiled dataset (python snapshot.py build-snapshot); replaces POIS when set.
+# The payload checksum reads the whole file, so it is only checked at startup when asked for
+POI_SNAPSHOT = os.environ.get("POI_SNAPSHOT", "")
+POI_SNAPSHOT_VERIFY = os.environ.get("POI_SNAPSHOT_VERIFY", "0") == "1"
+
+# Extra POI layers as comma-separated name=path pairs (JSON in /api/pois format or snapshots),
+# e.g. "airfields=/data/airfields.json,ports=/data/ports.snap"; the built-in dataset is layer "bases"
+POI_LAYERS = os.environ.get("POI_LAYERS", "")
+LAYER_MEMORY_BUDGET_MB = float(os.environ.get("LAYER_MEMORY_BUDGET_MB", "512"))
+LAYER_IDLE_SECONDS = float(os.environ.get("LAYER_IDLE_SECONDS", "900"))
+
+# POIs closer than this are grouped under a parent for ?collapse=1 (0 disables); stored parent_id links come first
+COLOCATION_KM = float(os.environ.get("COLOCATION_KM", "3"))
+# The map hides co-located units below this zoom, leaving their parent's marker
+COLLAPSE_MAX_ZOOM = float(os.environ.get("COLLAPSE_MAX_ZOOM", "9"))
+
+# Label thinning for /api/pois/visible: allowed collision spacings (px) and the default,
+# plus categories in priority order (co-located sub-units always yield to their main base)
+LABEL_SPACINGS = (16, 24, 32, 48, 64)
+LABEL_SPACING_PX = int(os.environ.get("LABEL_SPACING_PX", "32"))
+LABEL_CATEGORY_PRIORITY = [c.strip().lower() for c in os.environ.get("LABEL_CATEGORY_PRIORITY", "").split(',') if c.strip()]
+
+# Settings the derived indexes in a snapshot depend on; stored ones are only reused when these match
+DERIVED_SETTINGS = {'colocation_km': COLOCATION_KM, 'label_category_priority': LABEL_CATEGORY_PRIORITY}
+
+# Batch geofence limits
+GEOFENCE_MAX_POINTS = int(os.environ.get("GEOFENCE_MAX_POINTS", "1000000"))
+GEOFENCE_MAX_RADIUS_KM = float(os.environ.get("GEOFENCE_MAX_RADIUS_KM", "1000"))
+GEOFENCE_CHUNK = 65536  # Query points per vectorized pass, bounds pair-array memory
+
+# Route corridor limits
+CORRIDOR_MAX_VERTICES = int(os.environ.get("CORRIDOR_MAX_VERTICES", "100000"))
+CORRIDOR_MAX_BUFFER_KM = float(os.environ.get("CORRIDOR_MAX_BUFFER_KM", "500"))
+# Route pieces sampled per query (about route length / buffer); bounds memory for tiny buffers
+CORRIDOR_MAX_PIECES = int(os.environ.get("CORRIDOR_MAX_PIECES", "250000"))
+
+# Named bounding boxes for /api/pois/region/<region> and offline region packs
+REGIONS = {
+    'ontario': {'min_lat': 41.0, 'max_lat': 57.0, 'min_lon': -95.0, 'max_lon': -74.0},
+    'bc': {'min_lat': 48.0, 'max_lat': 60.0, 'min_lon': -139.0, 'max_lon': -114.0},
+    'alberta': {'min_lat': 49.0, 'max_lat': 60.0, 'min_lon': -120.0, 'max_lon': -110.0},
+    'arctic': {'min_lat': 66.0, 'max_lat': 84.0, 'min_lon': -141.0, 'max_lon': -52.0},
+}
+
 
 @dataclass
 class POI:
@@ -29,6 +158,20 @@ class POI:
     country: str
     country_code: str = ""  # ISO 2-letter country code for flag images
     category: str = "army"  # army, navy, air, special
+    id: str = ""  # Stable slug, derived from name when not given
+    footprint: Optional[dict] = None  # GeoJSON Polygon/MultiPolygon outline, served per zoom
+    parent_id: str = ""  # Installation this one is folded into (colocation.py --merge); else COLOCATION_KM decides
+
+    def __post_init__(self):
+        if not self.id:
+            self.id = re.sub(r'[^a-z0-9]+', '-', self.name.lower()).strip('-')
+
+
+def poi_to_dict(poi: POI) -> dict:
+    """Serialize a POI for the JSON API (footprints only go out simplified, per zoom)"""
+    data = asdict(poi)
+    del data['footprint']
+    return data
 
 
 # Comprehensive military installations data
@@ -717,6 +860,156 @@ POIS: List[POI] = [
     ),
 ]
 
+ADMISSION = AdmissionController(
+    RATE_LIMIT_RPS, RATE_LIMIT_BURST, ADMISSION_LIMITS, max_wait=ADMISSION_MAX_WAIT_MS / 1000,
+)
+
+SLOW_REQUESTS = SlowRequestLog(SLOW_REQUEST_MS, SLOW_REQUEST_LOG_SIZE)
+PROFILE_LOCK = threading.Lock()
+
+# Short timeouts: a slow peer should cost less than the upstream fetch it saves
+PEERS = requests.Session()
+PEERS.mount('http://', HTTPAdapter(pool_connections=8, pool_maxsize=32))
+PEERS.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=32))
+
+CACHE_SHARD = MemoryStore(int(CACHE_MEMORY_MB * 2 ** 20))
+SHARED_CACHE = SharedCache(
+    {
+        url: CACHE_SHARD if url == CACHE_SELF_URL else open_shard(url, PEERS, CACHE_PEER_TOKEN)
+        for url in CACHE_PEERS
+    } or {'local': CACHE_SHARD},
+    # Only worth a second copy when most keys live on another shard
+    l1=MemoryStore(int(CACHE_L1_MB * 2 ** 20)) if CACHE_PEERS else None,
+    l1_ttl=CACHE_L1_SECONDS,
+    lease_seconds=CACHE_LEASE_SECONDS,
+)
+
+STYLES = StyleProxy(UPSTREAM, TILESERVER_URL, TILESERVER_PUBLIC_URL, ttl=STYLE_CACHE_SECONDS, shared=SHARED_CACHE)
+
+def open_store(path: str) -> PoiStore:
+    """PoiStore for a snapshot or a JSON file in /api/pois format"""
+    if not is_snapshot(path):
+        return PoiStore(read_pois_json(path, POI), serialize=poi_to_dict)
+    snapshot = open_snapshot(path, verify=POI_SNAPSHOT_VERIFY)
+    ids = snapshot.strings('id')
+    records = snapshot.lazy_records(POI)
+    store = PoiStore(records, ids=ids, serialize=poi_to_dict)
+    # Indexes come prebuilt in the snapshot as views over the mapped file
+    store.seed('spatial', snapshot.spatial_index(ids))
+    store.seed('attributes', snapshot.attribute_index(records))
+    hilbert = snapshot.hilbert_index()
+    if hilbert is not None:
+        store.seed('hilbert', hilbert)
+    if snapshot.header.get('derived_settings') == DERIVED_SETTINGS:
+        for name, value in snapshot.derived_indexes(ids).items():
+            store.seed(name, value)
+    return store
+
+
+# Versioned view of POIS; all endpoints read through the store
+POI_STORE = open_store(POI_SNAPSHOT) if POI_SNAPSHOT else PoiStore(POIS, serialize=poi_to_dict)
+
+# Layers load on first access; "bases" is the dataset above and is never evicted
+LAYERS = LayerRegistry(int(LAYER_MEMORY_BUDGET_MB * 2 ** 20), idle_seconds=LAYER_IDLE_SECONDS)
+LAYERS.register('bases', lambda: POI_STORE, title='Military installations', pinned=True)
+for _entry in filter(None, (e.strip() for e in POI_LAYERS.split(','))):
+    _name, _, _path = _entry.partition('=')
+    LAYERS.register(_name.strip(), lambda path=_path.strip(): open_store(path))
+LAYERS.start_sweeper()
+
+
+def density_index() -> DensityIndex:
+    """Hex density bins for the current dataset version"""
+    return POI_STORE.derived('density', DensityIndex.from_pois)
+
+
+def spatial_index() -> SpatialIndex:
+    """Shared latitude-band index over the current dataset version"""
+    return POI_STORE.derived('spatial', SpatialIndex.from_pois)
+
+
+def attribute_index() -> AttributeIndex:
+    """Country/category posting lists for the current dataset version"""
+    return POI_STORE.derived('attributes', AttributeIndex.from_pois)
+
+
+def hilbert_index() -> HilbertIndex:
+    """Curve-ordered POIs with pre-encoded JSON for viewport queries"""
+    return POI_STORE.derived('hilbert', lambda pois: HilbertIndex.from_pois(pois, encode=record_json))
+
+
+def footprint_index() -> FootprintIndex:
+    """Per-zoom simplified footprints for the current dataset version"""
+    previous = POI_STORE.cached().get('footprints')
+    return POI_STORE.derived('footprints', lambda pois: FootprintIndex.from_pois(pois, previous=previous))
+
+
+def label_rank(pois: List[POI], children: dict) -> np.ndarray:
+    """
+    Placement rank, lower first: main bases (not in `children`, the
+    co-location child to parent map), then LABEL_CATEGORY_PRIORITY order, then
+    dataset order
+    """
+    categories = {category: i for i, category in enumerate(LABEL_CATEGORY_PRIORITY)}
+    is_child = np.array([poi.id in children for poi in pois], dtype=np.int64)
+    category = np.array([categories.get(poi.category.lower(), len(categories)) for poi in pois], dtype=np.int64)
+    rank = np.empty(len(pois), dtype=np.int64)
+    rank[np.lexsort((np.arange(len(pois)), category, is_child))] = np.arange(len(pois))
+    return rank
+
+
+def label_index(spacing_px: int) -> LabelIndex:
+    """Per-zoom label placements for one collision spacing"""
+    return POI_STORE.derived(
+        f'labels:{spacing_px}',
+        lambda pois: LabelIndex.from_pois(pois, label_rank(pois, colocation_parents()), spacing_px),
+    )
+
+
+def group_parents(pois: List[POI]) -> dict:
+    """
+    Child id to parent id: stored parent_id links, then COLOCATION_KM groups
+    among the POIs those links leave out
+    """
+    ids = {poi.id for poi in pois}
+    stored = {poi.id: poi.parent_id for poi in pois if poi.parent_id in ids and poi.parent_id != poi.id}
+    computed = parent_map(pois, COLOCATION_KM) if COLOCATION_KM > 0 else {}
+    parents = {child: parent for child, parent in computed.items() if child not in stored and parent not in stored}
+    parents.update(stored)
+    return parents
+
+
+def colocation_parents() -> dict:
+    """Child id to parent id for co-located POIs in the current dataset version"""
+    return POI_STORE.derived('colocation', group_parents)
+
+
+def derived_indexes(pois: List[POI]) -> dict:
+    """
+    The indexes above that depend on DERIVED_SETTINGS, built for `pois` and
+    keyed by their cache name; build-snapshot stores them in the snapshot
+    """
+    parents = group_parents(pois)
+    rank = label_rank(pois, parents)
+    indexes = {
+        'density': DensityIndex.from_pois(pois),
+        'colocation': parents,
+        'footprints': FootprintIndex.from_pois(pois),
+    }
+    indexes.update({f'labels:{px}': LabelIndex.from_pois(pois, rank, px) for px in LABEL_SPACINGS})
+    return indexes
+
+
+# Precompute aggregates at startup rather than on the first request
+density_index()
+spatial_index()
+attribute_index()
+hilbert_index()
+footprint_index()
+colocation_parents()
+for _px in LABEL_SPACINGS:  # Every allowed ?px=, so no request builds a placement (seconds on large datasets)
+    label_index(_px)
+
 
 # HTML template with MapLibre GL JS
 MAP_TEMPLATE = """
@@ -780,10 +1073,15 @@ MAP_TEMPLATE = """
         
         .stats { font-size: 11px; color: #666; margin-bottom: 8px; padding: 6px 10px; background: #f0f0f0; border-radius: 4px; }
         
-        .poi-list { list-style: none; max-height: 300px; overflow-y: auto; }
+        .poi-list { list-style: none; max-height: 300px; overflow-y: auto; position: relative; }
+        .poi-spacer { width: 1px; }
         .poi-item {
+            position: absolute;
+            left: 0;
+            right: 0;
+            height: 32px;
             padding: 8px;
-            margin: 4px 0;
+            margin: 2px 0;
             background: #f5f5f5;
             border-radius: 5px;
             cursor: pointer;
@@ -793,7 +1091,6 @@ MAP_TEMPLATE = """
             align-items: center;
         }
         .poi-item:hover { background: #e0e0e0; }
-        .poi-item.hidden { display: none; }
         .poi-flag { width: 20px; height: 15px; margin-right: 8px; border-radius: 2px; object-fit: cover; }
         .poi-name { font-weight: 600; flex: 1; }
         .poi-category { 
@@ -829,6 +1126,16 @@ MAP_TEMPLATE = """
         .popup-cat { font-size: 10px; padding: 2px 6px; border-radius: 3px; text-transform: uppercase; font-weight: 600; }
         .popup-desc { font-size: 13px; line-height: 1.4; color: #333; }
         .popup-coords { font-size: 11px; color: #999; margin-top: 8px; }
+        
+        /* Below DENSITY_MAX_ZOOM markers give way to the hex density layer */
+        .low-zoom .marker { visibility: hidden; }
+        /* Below COLLAPSE_MAX_ZOOM co-located units are left to their parent's marker */
+        .collapsed .marker.colocated { visibility: hidden; }
+        
+        .offline { margin-top: 12px; padding-top: 12px; border-top: 1px solid #ddd; font-size: 11px; }
+        .offline h3 { font-size: 12px; margin-bottom: 6px; }
+        .offline select, .offline button { font-size: 11px; padding: 3px 6px; }
+        .offline-status { color: #666; margin-top: 4px; min-height: 14px; }
     </style>
 </head>
 <body>
@@ -899,10 +1206,22 @@ MAP_TEMPLATE = """
                 <span class="poi-category cat-special">Special</span>
             </div>
         </div>
+        
+        <div class="offline" id="offline" hidden>
+            <h3>📦 Offline Regions</h3>
+            <select id="offline-region">
+                {% for name in regions %}<option value="{{ name }}">{{ name }}</option>{% endfor %}
+            </select>
+            <button id="offline-save">Save for offline</button>
+            <div class="offline-status" id="offline-status"></div>
+        </div>
     </div>
 
     <script>
         const TILESERVER_URL = '{{ tileserver_public_url }}';
+        const DENSITY_MAX_ZOOM = 6;
+        const FOOTPRINT_MIN_ZOOM = 7;
+        const COLLAPSE_MAX_ZOOM = {{ collapse_max_zoom }};
         let allPois = [];
         let markers = [];
         let activeFilters = {
@@ -913,7 +1232,7 @@ MAP_TEMPLATE = """
         // Initialize map centered on Canada with good detail level
         const map = new maplibregl.Map({
             container: 'map',
-            style: TILESERVER_URL + '/styles/osm-bright/style.json',
+            style: '/styles/osm-bright.json',
             center: [-96.0, 56.0],
             zoom: 3.5
         });
@@ -921,6 +1240,13 @@ MAP_TEMPLATE = """
         map.addControl(new maplibregl.NavigationControl());
         map.addControl(new maplibregl.ScaleControl());
         
+        // Filter state: one bitset per country and category, built once in loadPOIs().
+        // Bit i of a set is POI i; the visible set is OR(countries) AND OR(categories).
+        let countryBits = {};
+        let categoryBits = {};
+        let visibleBits = new Uint32Array(0);
+        let visibleIndices = new Int32Array(0);
+        
         // Setup filter event listeners
         document.querySelectorAll('.filter-option').forEach(option => {
             option.addEventListener('click', function() {
@@ -943,29 +1269,226 @@ MAP_TEMPLATE = """
             });
         });
         
+        function buildBitsets() {
+            const words = (allPois.length + 31) >>> 5;
+            countryBits = {};
+            categoryBits = {};
+            allPois.forEach((poi, index) => {
+                const bit = 1 << (index & 31);
+                (countryBits[poi.country_code] ||= new Uint32Array(words))[index >>> 5] |= bit;
+                (categoryBits[poi.category] ||= new Uint32Array(words))[index >>> 5] |= bit;
+            });
+            visibleBits = new Uint32Array(words);
+        }
+        
+        function unionOf(sets, keys, words) {
+            const out = new Uint32Array(words);
+            keys.forEach(key => {
+                const bits = sets[key];
+                if (!bits) return;
+                for (let w = 0; w < words; w++) out[w] |= bits[w];
+            });
+            return out;
+        }
+        
+        function popcount(x) {
+            x -= (x >>> 1) & 0x55555555;
+            x = (x & 0x33333333) + ((x >>> 2) & 0x33333333);
+            return (((x + (x >>> 4)) & 0x0f0f0f0f) * 0x01010101) >>> 24;
+        }
+        
         function applyFilters() {
-            let visibleCount = 0;
+            const words = visibleBits.length;
+            const next = unionOf(countryBits, activeFilters.country, words);
+            const categories = unionOf(categoryBits, activeFilters.category, words);
             
-            markers.forEach((item, index) => {
-                const poi = allPois[index];
-                const countryMatch = activeFilters.country.includes(poi.country_code);
-                const categoryMatch = activeFilters.category.includes(poi.category);
-                const visible = countryMatch && categoryMatch;
-                
-                // Toggle marker visibility
-                item.marker.getElement().style.display = visible ? 'block' : 'none';
+            let visibleCount = 0;
+            for (let w = 0; w < words; w++) {
+                next[w] &= categories[w];
+                visibleCount += popcount(next[w]);
                 
-                // Toggle list item visibility
-                const listItem = document.querySelector(`[data-poi-index="${index}"]`);
-                if (listItem) {
-                    listItem.classList.toggle('hidden', !visible);
+                // Touch only markers whose visibility actually changed
+                let changed = (next[w] ^ visibleBits[w]) >>> 0;
+                while (changed) {
+                    const low = changed & -changed;
+                    const index = (w << 5) + 31 - Math.clz32(low);
+                    markers[index].marker.getElement().style.display = (next[w] & low) ? 'block' : 'none';
+                    changed = (changed ^ low) >>> 0;
                 }
-                
-                if (visible) visibleCount++;
-            });
+            }
+            visibleBits = next;
+            
+            visibleIndices = new Int32Array(visibleCount);
+            let k = 0;
+            for (let w = 0; w < words; w++) {
+                let bits = visibleBits[w];
+                while (bits) {
+                    const low = bits & -bits;
+                    visibleIndices[k++] = (w << 5) + 31 - Math.clz32(low);
+                    bits = (bits ^ low) >>> 0;
+                }
+            }
             
             // Update stats
             document.getElementById('stats').textContent = `Showing ${visibleCount} of ${allPois.length} installations`;
+            
+            renderList(true);
+            refreshDensity();
+        }
+        
+        // Virtualized sidebar: only rows inside the scroll viewport exist in the DOM
+        const ROW_HEIGHT = 36;
+        const LIST_MAX_HEIGHT = 300;
+        const OVERSCAN = 6;
+        const poiList = document.getElementById('poi-list');
+        const poiSpacer = document.createElement('li');
+        poiSpacer.className = 'poi-spacer';
+        poiList.appendChild(poiSpacer);
+        let renderedRange = [0, 0];
+        
+        function renderList(force) {
+            const total = visibleIndices.length;
+            poiSpacer.style.height = `${total * ROW_HEIGHT}px`;
+            poiList.style.height = `${Math.min(total * ROW_HEIGHT, LIST_MAX_HEIGHT)}px`;
+            
+            const first = Math.max(0, Math.floor(poiList.scrollTop / ROW_HEIGHT) - OVERSCAN);
+            const last = Math.min(total, Math.ceil((poiList.scrollTop + LIST_MAX_HEIGHT) / ROW_HEIGHT) + OVERSCAN);
+            if (!force && first === renderedRange[0] && last === renderedRange[1]) return;
+            renderedRange = [first, last];
+            
+            const rows = document.createDocumentFragment();
+            for (let i = first; i < last; i++) {
+                const index = visibleIndices[i];
+                const poi = allPois[index];
+                const li = document.createElement('li');
+                li.className = 'poi-item';
+                li.dataset.poiIndex = index;
+                li.style.top = `${i * ROW_HEIGHT}px`;
+                li.innerHTML = `
+                    <img class="poi-flag" src="${getFlagUrl(poi.country_code)}">
+                    <span class="poi-name">${poi.name}</span>
+                    <span class="poi-category cat-${poi.category}">${poi.category}</span>
+                `;
+                rows.appendChild(li);
+            }
+            poiList.replaceChildren(poiSpacer, rows);
+        }
+        
+        poiList.addEventListener('scroll', () => requestAnimationFrame(() => renderList(false)));
+        
+        // One delegated handler instead of a closure per row
+        poiList.addEventListener('click', event => {
+            const li = event.target.closest('.poi-item');
+            if (!li) return;
+            const { marker, poi } = markers[Number(li.dataset.poiIndex)];
+            map.flyTo({
+                center: [poi.longitude, poi.latitude],
+                zoom: 8,
+                duration: 1500
+            });
+            marker.togglePopup();
+        });
+        
+        // Hex density layer for zoomed-out views
+        function setupDensityLayer() {
+            map.addSource('poi-density', {
+                type: 'geojson',
+                data: { type: 'FeatureCollection', features: [] }
+            });
+            map.addLayer({
+                id: 'poi-density-fill',
+                type: 'fill',
+                source: 'poi-density',
+                maxzoom: DENSITY_MAX_ZOOM,
+                paint: {
+                    'fill-color': ['interpolate', ['linear'], ['get', 'count'],
+                        1, '#ffe0b2', 5, '#fb8c00', 20, '#bf360c'],
+                    'fill-opacity': 0.7,
+                    'fill-outline-color': '#ffffff'
+                }
+            });
+            map.on('moveend', refreshDensity);
+        }
+        
+        async function refreshDensity() {
+            const lowZoom = map.getZoom() < DENSITY_MAX_ZOOM;
+            map.getContainer().classList.toggle('low-zoom', lowZoom);
+            if (!lowZoom || !map.getSource('poi-density')) return;
+            
+            const b = map.getBounds();
+            const params = new URLSearchParams({
+                z: Math.floor(map.getZoom()),
+                bbox: [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].join(','),
+                country: activeFilters.country.join(','),
+                category: activeFilters.category.join(',')
+            });
+            try {
+                const response = await fetch(`/api/pois/density?${params}`);
+                map.getSource('poi-density').setData(await response.json());
+            } catch (error) {
+                console.error('Error loading density:', error);
+            }
+        }
+        
+        // Installation outlines, fetched per viewport at the detail of the current zoom
+        function setupFootprintLayer() {
+            map.addSource('poi-footprints', {
+                type: 'geojson',
+                data: { type: 'FeatureCollection', features: [] }
+            });
+            map.addLayer({
+                id: 'poi-footprints-fill',
+                type: 'fill',
+                source: 'poi-footprints',
+                minzoom: FOOTPRINT_MIN_ZOOM,
+                paint: { 'fill-color': '#d32f2f', 'fill-opacity': 0.15, 'fill-outline-color': '#b71c1c' }
+            });
+            map.on('moveend', refreshFootprints);
+        }
+        
+        function decodePolyline(encoded, precision) {
+            const factor = Math.pow(10, precision);
+            const coords = [];
+            let index = 0, lat = 0, lon = 0;
+            while (index < encoded.length) {
+                for (const axis of [0, 1]) {
+                    let shift = 0, value = 0, byte;
+                    do {
+                        byte = encoded.charCodeAt(index++) - 63;
+                        value |= (byte & 0x1f) << shift;
+                        shift += 5;
+                    } while (byte >= 0x20);
+                    const delta = value & 1 ? ~(value >> 1) : value >> 1;
+                    if (axis === 0) lat += delta; else lon += delta;
+                }
+                coords.push([lon / factor, lat / factor]);
+            }
+            return coords;
+        }
+        
+        async function refreshFootprints() {
+            const source = map.getSource('poi-footprints');
+            if (!source || map.getZoom() < FOOTPRINT_MIN_ZOOM) return;
+            const b = map.getBounds();
+            const params = new URLSearchParams({
+                z: Math.floor(map.getZoom()),
+                bbox: [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].join(',')
+            });
+            try {
+                const response = await fetch(`/api/pois/viewport?${params}`);
+                const features = (await response.json()).filter(poi => poi.footprint).map(poi => {
+                    const { type, precision, coordinates } = poi.footprint;
+                    const rings = polygon => polygon.map(ring => decodePolyline(ring, precision));
+                    return {
+                        type: 'Feature',
+                        properties: { id: poi.id, name: poi.name },
+                        geometry: { type, coordinates: type === 'Polygon' ? rings(coordinates) : coordinates.map(rings) }
+                    };
+                });
+                source.setData({ type: 'FeatureCollection', features });
+            } catch (error) {
+                console.error('Error loading footprints:', error);
+            }
         }
         
         function getFlagUrl(countryCode) {
@@ -978,15 +1501,18 @@ MAP_TEMPLATE = """
         // Fetch POIs from API
         async function loadPOIs() {
             try {
-                const response = await fetch('/api/pois');
+                // The collapsed list only supplies which POIs fold into a parent; without it nothing collapses
+                const [response, collapsed] = await Promise.all([
+                    fetch('/api/pois'),
+                    fetch('/api/pois?collapse=1').then(r => r.ok ? r.json() : []).catch(() => [])
+                ]);
                 allPois = await response.json();
-                
-                const poiList = document.getElementById('poi-list');
+                const colocated = new Set(collapsed.flatMap(poi => poi.children || []));
                 
                 allPois.forEach((poi, index) => {
                     // Create custom marker element with flag image
                     const el = document.createElement('div');
-                    el.className = 'marker';
+                    el.className = colocated.has(poi.id) ? 'marker colocated' : 'marker';
                     el.style.width = '28px';
                     el.style.height = '21px';
                     el.style.cursor = 'pointer';
@@ -997,6 +1523,7 @@ MAP_TEMPLATE = """
                     el.style.backgroundImage = `url(${getFlagUrl(poi.country_code)})`;
                     el.style.backgroundSize = 'cover';
                     el.style.backgroundPosition = 'center';
+                    el.style.display = 'none';  // applyFilters() reveals visible markers
                     
                     // Create popup
                     const popup = new maplibregl.Popup({ offset: 25 })
@@ -1021,28 +1548,10 @@ MAP_TEMPLATE = """
                     
                     // Store marker reference for filtering
                     markers.push({ marker, poi });
-                    
-                    // Add to sidebar list
-                    const li = document.createElement('li');
-                    li.className = 'poi-item';
-                    li.dataset.poiIndex = index;
-                    li.innerHTML = `
-                        <img class="poi-flag" src="${getFlagUrl(poi.country_code)}">
-                        <span class="poi-name">${poi.name}</span>
-                        <span class="poi-category cat-${poi.category}">${poi.category}</span>
-                    `;
-                    li.onclick = () => {
-                        map.flyTo({
-                            center: [poi.longitude, poi.latitude],
-                            zoom: 8,
-                            duration: 1500
-                        });
-                        marker.togglePopup();
-                    };
-                    poiList.appendChild(li);
                 });
                 
-                // Apply initial filters and update stats
+                // Build filter bitsets, then apply initial filters and render the list
+                buildBitsets();
                 applyFilters();
                 
             } catch (error) {
@@ -1050,54 +1559,724 @@ MAP_TEMPLATE = """
             }
         }
 
-        map.on('load', loadPOIs);
+        function updateCollapse() {
+            map.getContainer().classList.toggle('collapsed', map.getZoom() < COLLAPSE_MAX_ZOOM);
+        }
+        
+        map.on('zoom', updateCollapse);
+        
+        map.on('load', () => {
+            updateCollapse();
+            setupDensityLayer();
+            setupFootprintLayer();
+            loadPOIs();
+        });
+        
+        // Service worker: cache-first tiles/glyphs/sprites, cached POIs and region packs
+        if ('serviceWorker' in navigator) {
+            navigator.serviceWorker.register('/sw.js').then(() => {
+                document.getElementById('offline').hidden = false;
+            }).catch(error => console.error('Service worker registration failed:', error));
+            
+            const status = document.getElementById('offline-status');
+            document.getElementById('offline-save').addEventListener('click', async () => {
+                const registration = await navigator.serviceWorker.ready;
+                const region = document.getElementById('offline-region').value;
+                status.textContent = `Preparing ${region}...`;
+                registration.active.postMessage({ type: 'prefetch-region', region });
+            });
+            navigator.serviceWorker.addEventListener('message', event => {
+                const { type, region, done, total, failed, error } = event.data || {};
+                if (type === 'pack-progress') {
+                    status.textContent = `${region}: ${done} / ${total}` + (failed ? ` (${failed} failed)` : '');
+                } else if (type === 'pack-complete') {
+                    status.textContent = `${region} saved` + (failed ? ` (${failed} failed)` : '');
+                } else if (type === 'pack-error') {
+                    status.textContent = `${region}: ${error}`;
+                }
+            });
+        }
     </script>
 </body>
 </html>
 """
 
 
+# Service worker for the map page, served from /sw.js so its scope covers /
+SERVICE_WORKER_JS = """
+const VERSION = 'v1';
+const SHELL_CACHE = `poi-map-shell-${VERSION}`;
+const TILE_CACHE = `poi-map-tiles-${VERSION}`;
+const PACK_PREFIX = 'poi-map-pack-';
+const TILE_CACHE_MAX = {{ tile_cache_max }};
+const PREFETCH_CONCURRENCY = 6;
+const SHELL = ['/', '/api/pois', '/api/pois?collapse=1', '/styles/osm-bright.json'];
+// Versioned third-party assets that never change at a given URL
+const IMMUTABLE_HOSTS = ['unpkg.com', 'flagcdn.com', 'upload.wikimedia.org'];
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.addAll(SHELL))
+            .catch(() => {})  // Populated on first use instead
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys().then(names => Promise.all(names
+            .filter(name => name.startsWith('poi-map-') && !name.startsWith(PACK_PREFIX))
+            .filter(name => name !== SHELL_CACHE && name !== TILE_CACHE)
+            .map(name => caches.delete(name))
+        )).then(() => self.clients.claim())
+    );
+});
+
+function isTileAsset(url) {
+    return /\\.(pbf|mvt)$/.test(url.pathname)
+        || url.pathname.includes('/fonts/')
+        || /\\/sprite(@2x)?\\.(json|png)$/.test(url.pathname)
+        || IMMUTABLE_HOSTS.includes(url.hostname);
+}
+
+function isShell(url) {
+    if (/^\\/data\\/[^/]+\\.json$/.test(url.pathname)) return true;  // TileJSON on the tileserver
+    return url.origin === self.location.origin && (
+        url.pathname === '/'
+        || url.pathname === '/api/pois'
+        || url.pathname.startsWith('/api/pois/region/')
+        || url.pathname.startsWith('/styles/')
+    );
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+    if (isTileAsset(url)) {
+        event.respondWith(cacheFirst(event, request));
+    } else if (isShell(url)) {
+        event.respondWith(staleWhileRevalidate(event, request));
+    }
+});
+
+// LRU bookkeeping: Cache.keys() is in insertion order, so re-putting an entry on
+// a hit moves it to the back and trimming deletes from the front. Each URL is
+// refreshed at most once per worker lifetime to keep hits cheap.
+let tileCount = null;
+const touched = new Set();
+
+async function cacheFirst(event, request) {
+    const cache = await caches.open(TILE_CACHE);
+    const hit = await cache.match(request);
+    if (hit) {
+        if (!touched.has(request.url)) {
+            touched.add(request.url);
+            event.waitUntil(cache.put(request, hit.clone()));
+        }
+        return hit;
+    }
+    const packed = await caches.match(request);  // Pinned region packs
+    if (packed) return packed;
+    const response = await fetch(request);
+    if (response.ok || response.type === 'opaque') {
+        touched.add(request.url);
+        event.waitUntil(cache.put(request, response.clone()).then(() => trim(cache)));
+    }
+    return response;
+}
+
+async function trim(cache) {
+    if (tileCount === null) tileCount = (await cache.keys()).length;
+    if (++tileCount <= TILE_CACHE_MAX) return;
+    const keys = await cache.keys();
+    // Trim to 90% so the next few inserts do not each trigger a scan
+    const excess = keys.length - Math.floor(TILE_CACHE_MAX * 0.9);
+    await Promise.all(keys.slice(0, Math.max(excess, 0)).map(key => cache.delete(key)));
+    tileCount = keys.length - Math.max(excess, 0);
+}
+
+async function staleWhileRevalidate(event, request) {
+    const cached = await caches.match(request);
+    const network = fetch(request).then(async response => {
+        if (response.ok) {
+            const cache = await caches.open(SHELL_CACHE);
+            await cache.put(request, response.clone());
+        }
+        return response;
+    });
+    if (cached) {
+        event.waitUntil(network.catch(() => {}));
+        return cached;
+    }
+    return network;
+}
+
+self.addEventListener('message', event => {
+    const data = event.data || {};
+    if (data.type === 'prefetch-region') {
+        event.waitUntil(prefetchRegion(data.region, event.source));
+    }
+});
+
+async function prefetchRegion(region, client) {
+    const notify = message => client && client.postMessage({ region, ...message });
+    let pack;
+    try {
+        const response = await fetch(`/api/regions/${encodeURIComponent(region)}/pack`);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        pack = await response.json();
+    } catch (error) {
+        notify({ type: 'pack-error', error: String(error.message || error) });
+        return;
+    }
+
+    const cache = await caches.open(PACK_PREFIX + region);
+    await cache.put(`/api/pois/region/${region}`, new Response(JSON.stringify(pack.pois), {
+        headers: { 'Content-Type': 'application/json' }
+    }));
+
+    const urls = [...pack.assets, ...pack.tiles];
+    let next = 0, done = 0, failed = 0;
+    async function worker() {
+        while (next < urls.length) {
+            const url = urls[next++];
+            if (!(await cache.match(url))) {
+                try {
+                    const response = await fetch(url);
+                    if (response.ok) await cache.put(url, response);
+                    else if (response.status !== 204 && response.status !== 404) failed++;  // Empty tiles
+                } catch (error) {
+                    failed++;
+                }
+            }
+            if (++done % 100 === 0) notify({ type: 'pack-progress', done, total: urls.length, failed });
+        }
+    }
+    await Promise.all(Array.from({ length: PREFETCH_CONCURRENCY }, worker));
+    notify({ type: 'pack-complete', total: urls.length, failed });
+}
+"""
+
+
+def parse_bbox(value: str):
+    """Parse 'min_lon,min_lat,max_lon,max_lat' into a tuple of floats, or None"""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if not all(math.isfinite(v) for v in (min_lon, min_lat, max_lon, max_lat)):
+        return None
+    if min_lon > max_lon or min_lat > max_lat:
+        return None
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def is_number(value) -> bool:
+    """Finite JSON number (bools are ints in Python, so they are excluded explicitly)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def validate_poi(data) -> Optional[str]:
+    """Why a PUT body is not a valid POI, or None if it is"""
+    if not isinstance(data, dict):
+        return 'Body must be a JSON object'
+    unknown = sorted(set(data) - {field.name for field in fields(POI)})
+    if unknown:
+        return f'Unknown fields: {unknown}'
+    missing = [key for key in ('name', 'description', 'latitude', 'longitude', 'flag', 'country') if key not in data]
+    if missing:
+        return f'Missing fields: {missing}'
+    for key, limit in (('latitude', 90), ('longitude', 180)):
+        if not is_number(data[key]) or abs(data[key]) > limit:
+            return f'{key} must be a number between -{limit} and {limit}'
+    for key in ('name', 'flag', 'country', 'category'):
+        if key in data and not (isinstance(data[key], str) and data[key].strip()):
+            return f'{key} must be a non-empty string'
+    for key in ('description', 'country_code', 'id', 'parent_id'):
+        if key in data and not isinstance(data[key], str):
+            return f'{key} must be a string'
+    if data.get('footprint') is not None:
+        try:
+            geometry_polygons(data['footprint'])
+        except ValueError as e:
+            return str(e)
+    return None
+
+
+def parse_list(value: str):
+    """Parse a comma-separated query parameter into a set, or None when absent"""
+    if value is None:
+        return None
+    return {v.strip().lower() for v in value.split(',') if v.strip()}
+
+
+def require_admin(view):
+    """Reject requests without the ADMIN_TOKEN bearer token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not ADMIN_TOKEN or not hmac.compare_digest(supplied, ADMIN_TOKEN):
+            return jsonify({'error': 'Admin token required'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def require_peer(view):
+    """Reject requests without the CACHE_PEER_TOKEN bearer token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not CACHE_PEER_TOKEN or not hmac.compare_digest(supplied, CACHE_PEER_TOKEN):
+            return jsonify({'error': 'Peer token required'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def route_class(name: str):
+    """Tag a view with its admission class (default 'cheap', 'internal' skips admission)"""
+    def decorator(view):
+        view.route_class = name
+        return view
+    return decorator
+
+
+def client_key() -> str:
+    """Client address used for rate limiting"""
+    if TRUSTED_PROXY_HOPS and len(request.access_route) >= TRUSTED_PROXY_HOPS:
+        return request.access_route[-TRUSTED_PROXY_HOPS]
+    return request.remote_addr or 'unknown'
+
+
+def reject(status: int, message: str, retry_after: float):
+    response = jsonify({'error': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def timed(phase: str):
+    """Context manager adding elapsed time to the current request's phase timings"""
+    timer = g.get('timer')
+    return timer.phase(phase) if timer is not None else nullcontext()
+
+
+@app.before_request
+def start_timer():
+    g.timer = PhaseTimer()
+
+
+@app.before_request
+def admit_request():
+    """Rate-limit the client, then take an in-flight slot for the route class"""
+    view = app.view_functions.get(request.endpoint)
+    # Peer cache traffic comes from a handful of replica addresses; limiting it would split the cache
+    if not ADMISSION_ENABLED or getattr(view, 'route_class', 'cheap') == 'internal':
+        return None
+    if ADMISSION.rate_limiter:
+        wait = ADMISSION.rate_limiter.check(client_key())
+        if wait:
+            return reject(429, 'Rate limit exceeded', wait)
+    limiter = ADMISSION.limiter(getattr(view, 'route_class', 'cheap'))
+    if limiter is None:
+        return None
+    if not limiter.acquire():
+        return reject(503, 'Server busy, retry shortly', 1)
+    g.admission_slot = limiter
+    return None
+
+
+@app.after_request
+def record_slow_request(response):
+    """Keep slow, non-streaming requests in the ring buffer"""
+    timer = g.get('timer')
+    view = app.view_functions.get(request.endpoint)
+    if timer is not None and getattr(view, 'route_class', 'cheap') != 'stream':
+        SLOW_REQUESTS.record(request.method, request.full_path.rstrip('?'), response.status_code, timer)
+    return response
+
+
+@app.after_request
+def release_on_close(response):
+    """Hold the slot until the body is sent (streams included)"""
+    slot = g.pop('admission_slot', None)
+    if slot is not None:
+        response.call_on_close(slot.release)
+    return response
+
+
+@app.teardown_request
+def release_slot(error=None):
+    """Release a slot that never reached after_request"""
+    slot = g.pop('admission_slot', None)
+    if slot is not None:
+        slot.release()
+
+
 @app.route('/')
 def index():
     """Serve the main map page"""
-    return render_template_string(MAP_TEMPLATE, tileserver_public_url=TILESERVER_PUBLIC_URL)
+    return render_template_string(MAP_TEMPLATE, tileserver_public_url=TILESERVER_PUBLIC_URL, regions=REGIONS,
+                                  collapse_max_zoom=COLLAPSE_MAX_ZOOM)
+
+
+@app.route('/sw.js')
+def service_worker():
+    """Service worker for offline tiles, POIs and region packs"""
+    body = render_template_string(SERVICE_WORKER_JS, tile_cache_max=TILE_CACHE_MAX_ENTRIES)
+    return Response(body, mimetype='application/javascript', headers={'Cache-Control': 'no-cache'})
+
+
+def collapse_colocated(pois: List[POI]) -> List[dict]:
+    """Drop co-located children, listing their ids on the parent instead"""
+    parents = colocation_parents()
+    children = {}
+    for child_id, parent_id in parents.items():
+        children.setdefault(parent_id, []).append(child_id)
+    collapsed = []
+    for poi in pois:
+        if poi.id in parents:
+            continue
+        data = poi_to_dict(poi)
+        if poi.id in children:
+            data['children'] = children[poi.id]
+        collapsed.append(data)
+    return collapsed
 
 
 @app.route('/api/pois')
 def get_pois():
-    """API endpoint to get all POIs as JSON"""
-    return jsonify([
-        {
-            'name': poi.name,
-            'description': poi.description,
-            'latitude': poi.latitude,
-            'longitude': poi.longitude,
-            'flag': poi.flag,
-            'country': poi.country,
-            'country_code': poi.country_code,
-            'category': poi.category
-        }
-        for poi in POIS
-    ])
+    """
+    API endpoint to get all POIs as JSON
+    ?collapse=1 folds co-located units into their parent installation
+    """
+    version, pois = POI_STORE.snapshot()
+    with timed('serialize'):
+        if request.args.get('collapse') in ('1', 'true'):
+            response = jsonify(collapse_colocated(pois))
+        else:
+            response = jsonify([poi_to_dict(poi) for poi in pois])
+    response.headers['X-POI-Version'] = POI_STORE.token(version)
+    return response
+
+
+@app.route('/api/pois/changes')
+def get_poi_changes():
+    """
+    API endpoint for delta sync
+    Returns adds, updates and deletes after ?since=<version token>
+    A token from another process (e.g. before a restart) gets reset: true
+    """
+    since = request.args.get('since')
+    if not since:
+        return jsonify({'error': 'Query parameter "since" (X-POI-Version token) is required'}), 400
+    version, reset, changes = POI_STORE.changes_since(POI_STORE.parse_token(since))
+    return jsonify({'version': POI_STORE.token(version), 'reset': reset, 'changes': [
+        dict(change, version=POI_STORE.token(change['version'])) for change in changes
+    ]})
+
+
+@app.route('/api/pois/stream')
+@route_class('stream')
+def stream_poi_changes():
+    """
+    Server-sent events stream of POI changes
+    Resumes from ?since=<version token> or the Last-Event-ID header sent on reconnect
+    """
+    token = request.headers.get('Last-Event-ID') or request.args.get('since')
+    since = POI_STORE.version if token is None else POI_STORE.parse_token(token)
+
+    def events(since: Optional[int]):
+        if since is None:  # Token from another process: its version numbers mean nothing here
+            since = POI_STORE.version
+            yield f"id: {POI_STORE.token(since)}\nevent: reset\ndata: {json.dumps({'version': POI_STORE.token(since)})}\n\n"
+        yield f"retry: 3000\nid: {POI_STORE.token(since)}\nevent: hello\ndata: {json.dumps({'version': POI_STORE.token(since)})}\n\n"
+        while True:
+            if not POI_STORE.wait_for_change(since, SSE_HEARTBEAT_SECONDS):
+                yield ": heartbeat\n\n"
+                continue
+            version, reset, changes = POI_STORE.changes_since(since)
+            if reset:
+                yield f"id: {POI_STORE.token(version)}\nevent: reset\ndata: {json.dumps({'version': POI_STORE.token(version)})}\n\n"
+            else:
+                for change in changes:
+                    change = dict(change, version=POI_STORE.token(change['version']))
+                    yield f"id: {change['version']}\nevent: change\ndata: {json.dumps(change)}\n\n"
+            since = version
+
+    return Response(events(since), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@app.route('/api/pois/density')
+def get_poi_density():
+    """
+    API endpoint for hexagonal density bins (GeoJSON)
+    Query: z=<zoom>&bbox=min_lon,min_lat,max_lon,max_lat[&country=ca,us][&category=army]
+    """
+    zoom = request.args.get('z', type=float)
+    bbox = parse_bbox(request.args.get('bbox', '-180,-85,180,85'))
+    if zoom is None or not math.isfinite(zoom) or bbox is None:
+        return jsonify({'error': 'Expected z=<zoom> and bbox=min_lon,min_lat,max_lon,max_lat'}), 400
+    with timed('filter'):
+        bins = density_index().query(
+            zoom, bbox,
+            countries=parse_list(request.args.get('country')),
+            categories=parse_list(request.args.get('category')),
+        )
+    with timed('serialize'):
+        return jsonify(bins)
+
+
+@app.route('/api/pois/visible')
+def get_visible_pois():
+    """
+    Decluttered POIs for ?z=<zoom> inside ?bbox=min_lon,min_lat,max_lon,max_lat
+    ?px= sets the collision spacing (one of LABEL_SPACINGS); every returned POI is
+    at least that far from the others in screen space. min_zoom is the zoom it
+    first appears at
+    """
+    zoom = request.args.get('z', type=float)
+    if zoom is None or not math.isfinite(zoom) or zoom < 0:
+        return jsonify({'error': 'z must be a zoom level >= 0'}), 400
+    px = request.args.get('px', LABEL_SPACING_PX, type=int)
+    if px not in LABEL_SPACINGS:
+        return jsonify({'error': f'px must be one of {list(LABEL_SPACINGS)}'}), 400
+    bbox = None
+    if request.args.get('bbox') is not None:
+        bbox = parse_bbox(request.args['bbox'])
+        if bbox is None:
+            return jsonify({'error': 'bbox must be min_lon,min_lat,max_lon,max_lat'}), 400
+
+    with timed('filter'):
+        ids, min_zoom = label_index(px).visible(zoom, bbox)
+        pois = POI_STORE.get_many(ids)
+    with timed('serialize'):
+        return jsonify([
+            {**poi_to_dict(poi), 'min_zoom': z}
+            for poi, z in zip(pois, min_zoom.tolist()) if poi is not None
+        ])
+
+
+@app.route('/api/pois/geofence', methods=['POST'])
+@route_class('heavy')
+def post_geofence():
+    """
+    Batch geofence: POIs within radius_km of each point
+    JSON body: {"radius_km": 25, "points": [[lon, lat], ...]}
+    Binary body (application/octet-stream): little-endian lon,lat pairs,
+    float64 by default or float32 with ?dtype=f4; radius via ?radius_km=
+    Response is CSR-encoded: matches for point i are offsets[i]:offsets[i+1]
+    """
+    if request.mimetype == 'application/octet-stream':
+        dtype = {'f4': '<f4', 'f8': '<f8'}.get(request.args.get('dtype', 'f8'))
+        radius_km = request.args.get('radius_km', type=float)
+        raw = request.get_data()
+        if dtype is None or len(raw) % (2 * np.dtype(dtype).itemsize):
+            return jsonify({'error': 'Body must be lon,lat pairs of float32 (dtype=f4) or float64 (dtype=f8)'}), 400
+        points = np.frombuffer(raw, dtype=dtype).astype(np.float64).reshape(-1, 2)
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Body must be a JSON object'}), 400
+        radius_km = data.get('radius_km')
+        try:
+            points = np.asarray(data.get('points', []), dtype=np.float64)
+        except (TypeError, ValueError):
+            points = None
+        if points is not None and points.size == 0:
+            points = points.reshape(0, 2)
+        # Anything but [[lon, lat], ...] would shift point i away from offsets[i]
+        if points is None or points.ndim != 2 or points.shape[1] != 2:
+            return jsonify({'error': 'points must be an array of [lon, lat] pairs'}), 400
+
+    if not is_number(radius_km) or not 0 < radius_km <= GEOFENCE_MAX_RADIUS_KM:
+        return jsonify({'error': f'radius_km must be in (0, {GEOFENCE_MAX_RADIUS_KM}]'}), 400
+    if len(points) > GEOFENCE_MAX_POINTS:
+        return jsonify({'error': f'At most {GEOFENCE_MAX_POINTS} points per batch'}), 413
+    if not (np.all(np.abs(points[:, 0]) <= 180) and np.all(np.abs(points[:, 1]) <= 90)):
+        return jsonify({'error': 'Coordinates out of range'}), 400
+
+    with timed('filter'):
+        index = spatial_index()
+        counts = np.zeros(len(points), dtype=np.int64)
+        entries, distances = [], []
+        for start in range(0, len(points), GEOFENCE_CHUNK):
+            chunk = points[start:start + GEOFENCE_CHUNK]
+            owner, entry, dist = index.within(chunk[:, 0], chunk[:, 1], radius_km)
+            counts[start:start + len(chunk)] = np.bincount(owner, minlength=len(chunk))
+            entries.append(entry)
+            distances.append(dist)
+        entry = np.concatenate(entries) if entries else np.empty(0, dtype=np.int64)
+        dist = np.concatenate(distances) if distances else np.empty(0)
+
+    with timed('serialize'):
+        return jsonify({
+            'radius_km': radius_km,
+            'count': len(points),
+            'offsets': np.concatenate(([0], np.cumsum(counts))).tolist(),
+            'poi_ids': index.ids[entry].tolist(),
+            'distances_km': np.round(dist, 3).tolist(),
+        })
+
+
+@app.route('/api/pois/corridor', methods=['POST'])
+@route_class('heavy')
+def post_corridor():
+    """
+    POIs within buffer_km of a route, ordered along it
+    JSON body: {"polyline": "<encoded polyline>", "buffer_km": 50, "precision": 5}
+    cross_track_km is negative left of the direction of travel, positive right
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Body must be a JSON object'}), 400
+    buffer_km = data.get('buffer_km')
+    precision = data.get('precision', 5)
+    if not isinstance(data.get('polyline'), str) or precision not in (5, 6):
+        return jsonify({'error': 'polyline must be an encoded polyline string (precision 5 or 6)'}), 400
+    if not is_number(buffer_km) or not 0 < buffer_km <= CORRIDOR_MAX_BUFFER_KM:
+        return jsonify({'error': f'buffer_km must be in (0, {CORRIDOR_MAX_BUFFER_KM}]'}), 400
+    try:
+        lon, lat = decode_polyline(data['polyline'], precision)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid polyline: {e}'}), 400
+    if not len(lon):
+        return jsonify({'error': 'Polyline has no vertices'}), 400
+    if len(lon) > CORRIDOR_MAX_VERTICES:
+        return jsonify({'error': f'At most {CORRIDOR_MAX_VERTICES} vertices per route'}), 413
+    if not (np.all(np.abs(lon) <= 180) and np.all(np.abs(lat) <= 90)):
+        return jsonify({'error': 'Coordinates out of range'}), 400
+    if route_pieces(lon, lat, buffer_km) > CORRIDOR_MAX_PIECES:
+        return jsonify({'error': f'Route too long for buffer_km={buffer_km}; use a larger buffer or split the route'}), 413
+
+    with timed('filter'):
+        index = spatial_index()
+        entry, along, cross, length_km = corridor(index, lon, lat, buffer_km)
+        pois = POI_STORE.get_many(index.ids[entry])
+
+    with timed('serialize'):
+        return jsonify({
+            'buffer_km': buffer_km,
+            'vertices': len(lon),
+            'length_km': round(length_km, 3),
+            'pois': [
+                {**poi_to_dict(poi), 'along_track_km': a, 'cross_track_km': c}
+                for poi, a, c in zip(pois, np.round(along, 3).tolist(), np.round(cross, 3).tolist())
+                if poi is not None
+            ],
+        })
+
+
+@app.route('/api/pois/id/<poi_id>', methods=['PUT'])
+@require_admin
+def put_poi(poi_id: str):
+    """Admin endpoint to add or replace a POI"""
+    data = request.get_json(silent=True)
+    error = validate_poi(data)
+    if error:
+        return jsonify({'error': f'Invalid POI: {error}'}), 400
+    poi = POI(**{
+        **data, 'id': poi_id, 'latitude': float(data['latitude']), 'longitude': float(data['longitude']),
+    })
+    version = POI_STORE.upsert(poi)
+    return jsonify({'version': POI_STORE.token(version), 'poi': poi_to_dict(poi)})
+
+
+@app.route('/api/pois/id/<poi_id>', methods=['DELETE'])
+@require_admin
+def delete_poi(poi_id: str):
+    """Admin endpoint to remove a POI"""
+    version = POI_STORE.delete(poi_id)
+    if version is None:
+        return jsonify({'error': f'Unknown POI: {poi_id}'}), 404
+    return jsonify({'version': POI_STORE.token(version)})
 
 
 @app.route('/api/pois/<country>')
 def get_pois_by_country(country: str):
     """API endpoint to get POIs filtered by country"""
-    filtered = [poi for poi in POIS if poi.country.lower() == country.lower()]
-    return jsonify([
-        {
-            'name': poi.name,
-            'description': poi.description,
-            'latitude': poi.latitude,
-            'longitude': poi.longitude,
-            'flag': poi.flag,
-            'country': poi.country,
-            'country_code': poi.country_code,
-            'category': poi.category
-        }
-        for poi in filtered
-    ])
+    with timed('filter'):
+        filtered = attribute_index().select('country', country)
+    with timed('serialize'):
+        return jsonify([poi_to_dict(poi) for poi in filtered])
+
+
+def layer_pois(store: PoiStore, bbox=None, categories=None) -> List[POI]:
+    """A layer's POIs in dataset order, optionally limited to a bbox and categories"""
+    if bbox is None:
+        pois = store.all()
+    else:
+        index = store.derived('spatial', SpatialIndex.from_pois)
+        min_lon, min_lat, max_lon, max_lat = bbox
+        inside = (
+            (index.lon >= min_lon) & (index.lon <= max_lon)
+            & (index.lat >= min_lat) & (index.lat <= max_lat)
+        )
+        rows = np.flatnonzero(inside)
+        rows = rows[np.argsort(index.order[rows], kind='stable')]
+        pois = [poi for poi in store.get_many(index.ids[rows]) if poi is not None]
+    if categories is not None:
+        pois = [poi for poi in pois if poi.category.lower() in categories]
+    return pois
+
+
+def parse_layer_query():
+    """bbox/category query parameters shared by the layer endpoints, or an error response"""
+    bbox = None
+    if request.args.get('bbox') is not None:
+        bbox = parse_bbox(request.args['bbox'])
+        if bbox is None:
+            return None, None, (jsonify({'error': 'bbox must be min_lon,min_lat,max_lon,max_lat'}), 400)
+    return bbox, parse_list(request.args.get('category')), None
+
+
+@app.route('/api/layers')
+def get_layers():
+    """Registered layers, whether they are loaded, and their estimated memory use"""
+    return jsonify({'budget_bytes': LAYERS.budget_bytes, 'layers': LAYERS.stats()})
+
+
+@app.route('/api/layers/<layer>/pois')
+def get_layer_pois(layer: str):
+    """
+    POIs of one layer, loading it on first access
+    Optional ?bbox=min_lon,min_lat,max_lon,max_lat and ?category=a,b
+    """
+    if layer not in LAYERS:
+        return jsonify({'error': f'Unknown layer. Valid: {LAYERS.names()}'}), 404
+    bbox, categories, error = parse_layer_query()
+    if error:
+        return error
+    with timed('filter'):
+        filtered = layer_pois(LAYERS.store(layer), bbox, categories)
+    with timed('serialize'):
+        return jsonify([poi_to_dict(poi) for poi in filtered])
+
+
+@app.route('/api/layers/pois')
+@route_class('heavy')
+def get_multi_layer_pois():
+    """
+    POIs from several layers at once, queried in parallel
+    ?layers=bases,airfields plus the same bbox/category filters as a single layer
+    """
+    names = [name.strip() for name in request.args.get('layers', '').split(',') if name.strip()]
+    if not names:
+        return jsonify({'error': f'layers is required. Valid: {LAYERS.names()}'}), 400
+    unknown = [name for name in names if name not in LAYERS]
+    if unknown:
+        return jsonify({'error': f'Unknown layers {unknown}. Valid: {LAYERS.names()}'}), 404
+    bbox, categories, error = parse_layer_query()
+    if error:
+        return error
+    with timed('filter'):
+        results = LAYERS.fan_out(names, lambda name, store: layer_pois(store, bbox, categories))
+    with timed('serialize'):
+        return jsonify({name: [poi_to_dict(poi) for poi in pois] for name, pois in results.items()})
 
 
 @app.route('/api/pois/region/<region>')
@@ -1106,52 +2285,241 @@ def get_pois_by_region(region: str):
     API endpoint to get POIs by region (bounding box)
     Regions: ontario, bc, alberta, arctic
     """
-    regions = {
-        'ontario': {'min_lat': 41.0, 'max_lat': 57.0, 'min_lon': -95.0, 'max_lon': -74.0},
-        'bc': {'min_lat': 48.0, 'max_lat': 60.0, 'min_lon': -139.0, 'max_lon': -114.0},
-        'alberta': {'min_lat': 49.0, 'max_lat': 60.0, 'min_lon': -120.0, 'max_lon': -110.0},
-        'arctic': {'min_lat': 66.0, 'max_lat': 84.0, 'min_lon': -141.0, 'max_lon': -52.0},
-    }
+    if region.lower() not in REGIONS:
+        return jsonify({'error': f'Unknown region. Valid: {list(REGIONS.keys())}'}), 400
     
-    if region.lower() not in regions:
-        return jsonify({'error': f'Unknown region. Valid: {list(regions.keys())}'}), 400
+    # Dataset order and full records like /api/pois; the spatial index avoids a scan of every POI
+    bounds = REGIONS[region.lower()]
+    with timed('filter'):
+        filtered = layer_pois(POI_STORE, (bounds['min_lon'], bounds['min_lat'], bounds['max_lon'], bounds['max_lat']))
     
-    bounds = regions[region.lower()]
-    filtered = [
-        poi for poi in POIS
+    with timed('serialize'):
+        return jsonify([poi_to_dict(poi) for poi in filtered])
+
+
+def viewport_response(bbox, zoom=None) -> Response:
+    """
+    POIs in bbox, in Hilbert curve order, assembled from pre-encoded JSON slices
+    With a zoom, POIs with a footprint carry its outline simplified for that zoom
+    """
+    index = hilbert_index()
+    with timed('filter'):
+        lo, hi = index.ranges(bbox)
+    with timed('serialize'):
+        extra = footprint_index().fragments(lo, hi, zoom) if zoom is not None else None
+        body = index.json_array(lo, hi, extra)
+    return Response(body, mimetype='application/json')
+
+
+@app.route('/api/pois/viewport')
+def get_pois_in_viewport():
+    """
+    POIs inside ?bbox=min_lon,min_lat,max_lon,max_lat (Hilbert curve order)
+    ?z= adds footprints simplified for that zoom
+    """
+    bbox = parse_bbox(request.args.get('bbox'))
+    if bbox is None:
+        return jsonify({'error': 'bbox must be min_lon,min_lat,max_lon,max_lat'}), 400
+    zoom = request.args.get('z', type=float)
+    if zoom is None and request.args.get('z') is not None or zoom is not None and not 0 <= zoom <= 24:
+        return jsonify({'error': 'z must be a zoom level between 0 and 24'}), 400
+    return viewport_response(bbox, zoom)
+
+
+@app.route('/api/pois/tile/<int:z>/<int:x>/<int:y>')
+def get_pois_in_tile(z: int, x: int, y: int):
+    """POIs inside an XYZ web mercator tile (Hilbert curve order), footprints simplified for z"""
+    if not 0 <= z <= 24 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Tile out of range'}), 400
+    lon, lat = mercator_to_lonlat(np.array([x, x + 1]) / 2 ** z, np.array([y + 1, y]) / 2 ** z)
+    # Tiles in the top and bottom rows extend to the poles beyond the mercator limit
+    lat[0] = -90.0 if y == 2 ** z - 1 else lat[0]
+    lat[1] = 90.0 if y == 0 else lat[1]
+    return viewport_response((lon[0], lat[0], lon[1], lat[1]), z)
+
+
+def pois_in_bounds(pois: List[POI], bounds: dict) -> List[POI]:
+    return [
+        poi for poi in pois
         if bounds['min_lat'] <= poi.latitude <= bounds['max_lat']
         and bounds['min_lon'] <= poi.longitude <= bounds['max_lon']
     ]
-    
-    return jsonify([
-        {
-            'name': poi.name,
-            'description': poi.description,
-            'latitude': poi.latitude,
-            'longitude': poi.longitude,
-            'flag': poi.flag,
-            'country': poi.country,
-            'country_code': poi.country_code,
-            'category': poi.category
-        }
-        for poi in filtered
-    ])
+
+
+@app.route('/api/regions/<region>/pack')
+@route_class('upstream')
+def get_region_pack(region: str):
+    """
+    Everything a client needs to view a region offline: tile URLs, style sprite
+    and glyph URLs, and the region's POIs. ?max_zoom= caps the tile zoom;
+    otherwise the deepest zoom within REGION_PACK_MAX_TILES is used
+    """
+    bounds = REGIONS.get(region.lower())
+    if bounds is None:
+        return jsonify({'error': f'Unknown region. Valid: {list(REGIONS.keys())}'}), 400
+    max_zoom = min(request.args.get('max_zoom', REGION_PACK_MAX_ZOOM, type=int), REGION_PACK_MAX_ZOOM)
+    max_zoom = max(max_zoom, REGION_PACK_MIN_ZOOM)
+    max_zoom = min(max_zoom, fit_max_zoom(bounds, REGION_PACK_MIN_ZOOM, max_zoom, REGION_PACK_MAX_TILES))
+    if tile_count(bounds, REGION_PACK_MIN_ZOOM, max_zoom) > REGION_PACK_MAX_TILES:
+        return jsonify({'error': 'Region is too large for a pack'}), 400
+
+    assets = ['/styles/osm-bright.json']
+    try:
+        with timed('upstream'):
+            style = STYLES.get('osm-bright')
+        if style is not None:
+            assets += style_assets(json.loads(style[0]))
+    except requests.RequestException:
+        pass  # Pack still covers tiles and POIs; the worker caches glyphs on first use
+
+    with timed('filter'):
+        version, pois = POI_STORE.snapshot()
+        filtered = pois_in_bounds(pois, bounds)
+    with timed('serialize'):
+        return jsonify({
+            'region': region.lower(),
+            'bounds': bounds,
+            'version': POI_STORE.token(version),
+            'min_zoom': REGION_PACK_MIN_ZOOM,
+            'max_zoom': max_zoom,
+            'assets': assets,
+            'tiles': list(tile_urls(TILE_URL_TEMPLATE, bounds, REGION_PACK_MIN_ZOOM, max_zoom)),
+            'pois': [poi_to_dict(poi) for poi in filtered],
+        })
+
+
+@app.route('/styles/<name>.json')
+@route_class('upstream')
+def get_style(name: str):
+    """
+    Tileserver style with source/sprite/glyph URLs rewritten to TILESERVER_PUBLIC_URL
+    Cached in memory and revalidated with a content-hash ETag
+    """
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', name):
+        return jsonify({'error': 'Invalid style name'}), 400
+    try:
+        with timed('upstream'):
+            style = STYLES.get(name)
+    except requests.RequestException as e:
+        return jsonify({'error': f'Tileserver unavailable: {e.__class__.__name__}'}), 502
+    if style is None:
+        return jsonify({'error': f'Unknown style: {name}'}), 404
+    body, etag = style
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='application/json', headers=headers)
+
+
+@app.route('/tiles/<source>/<int:z>/<int:x>/<int:y>.pbf')
+@route_class('upstream')
+def get_tile(source: str, z: int, x: int, y: int):
+    """
+    Vector tile from the tileserver, through the shared cache
+    Point TILE_URL_TEMPLATE here so replicas fetch each tile upstream once
+    """
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', source):
+        return jsonify({'error': 'Invalid tile source'}), 400
+    if not 0 <= z <= 24 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Tile out of range'}), 400
+
+    def fetch():
+        resp = UPSTREAM.get(f'{TILESERVER_URL}/data/{source}/{z}/{x}/{y}.pbf', timeout=10)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.content  # Empty for 204 (no data here), cached like any tile
+
+    try:
+        with timed('upstream'):
+            body = SHARED_CACHE.get_or_fill(f'tile:{source}/{z}/{x}/{y}', fetch, TILE_PROXY_CACHE_SECONDS)
+    except requests.RequestException as e:
+        return jsonify({'error': f'Tileserver unavailable: {e.__class__.__name__}'}), 502
+    if body is None:
+        return jsonify({'error': f'Unknown tile source: {source}'}), 404
+    headers = {'Cache-Control': f'public, max-age={int(TILE_PROXY_CACHE_SECONDS)}'}
+    if not body:
+        return Response(status=204, headers=headers)
+    return Response(body, mimetype='application/x-protobuf', headers=headers)
+
+
+@app.route('/api/internal/cache/entries/<path:key>', methods=['GET', 'PUT'])
+@route_class('internal')
+@require_peer
+def cache_entry(key: str):
+    """This replica's shard of the shared cache, read and written by peer replicas"""
+    if request.method == 'PUT':
+        ttl = request.args.get('ttl', type=float)
+        if ttl is None or ttl <= 0:
+            return jsonify({'error': 'ttl is required'}), 400
+        CACHE_SHARD.set(key, request.get_data(), min(ttl, max(TILE_PROXY_CACHE_SECONDS, STYLE_CACHE_SECONDS)))
+        return Response(status=204)
+    value = CACHE_SHARD.get(key)
+    if value is None:
+        return Response(status=404)
+    return Response(value, mimetype='application/octet-stream')
+
+
+@app.route('/api/internal/cache/leases/<path:key>', methods=['POST', 'DELETE'])
+@route_class('internal')
+@require_peer
+def cache_lease(key: str):
+    """Fill lease for a key this replica's shard owns (409 while another peer holds it)"""
+    if request.method == 'DELETE':
+        CACHE_SHARD.release(key)
+        return Response(status=204)
+    ttl = min(request.args.get('ttl', CACHE_LEASE_SECONDS, type=float), CACHE_LEASE_SECONDS)
+    return Response(status=200 if CACHE_SHARD.lease(key, ttl) else 409)
+
+
+@app.route('/api/admin/profile')
+@route_class('heavy')
+@require_admin
+def admin_profile():
+    """
+    Sample all threads for ?seconds=N (default 10) at ?interval_ms= (default 5)
+    Returns collapsed stacks for flamegraph.pl / speedscope
+    """
+    seconds = request.args.get('seconds', 10.0, type=float)
+    interval_ms = request.args.get('interval_ms', 5.0, type=float)
+    if not is_number(seconds) or not is_number(interval_ms) or seconds <= 0:
+        return jsonify({'error': 'seconds and interval_ms must be finite numbers, seconds > 0'}), 400
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    # At least one sample per profile, and never a sleep longer than a second
+    interval = min(max(interval_ms, 1.0), PROFILE_MAX_INTERVAL_MS, max(seconds * 1000, 1.0)) / 1000
+    if not PROFILE_LOCK.acquire(blocking=False):
+        return jsonify({'error': 'A profile is already running'}), 409
+    try:
+        stacks = sample_stacks(seconds, interval)
+    finally:
+        PROFILE_LOCK.release()
+    return Response(collapsed_text(stacks), mimetype='text/plain')
+
+
+@app.route('/api/admin/slow-requests')
+@require_admin
+def admin_slow_requests():
+    """Recent requests slower than SLOW_REQUEST_MS with per-phase timings"""
+    return jsonify({'threshold_ms': SLOW_REQUESTS.threshold_ms, 'requests': SLOW_REQUESTS.entries()})
 
 
 @app.route('/api/health')
+@route_class('upstream')
 def health():
     """Health check endpoint"""
-    import requests
     try:
-        resp = requests.get(f"{TILESERVER_URL}/health", timeout=5)
+        with timed('upstream'):
+            resp = UPSTREAM.get(f"{TILESERVER_URL}/health", timeout=5)
         tileserver_ok = resp.status_code == 200
-    except:
+    except requests.RequestException:
         tileserver_ok = False
     return jsonify({
         'status': 'ok' if tileserver_ok else 'degraded',
         'tileserver_internal': TILESERVER_URL,
         'tileserver_public': TILESERVER_PUBLIC_URL,
-        'tileserver_healthy': tileserver_ok
+        'tileserver_healthy': tileserver_ok,
+        'admission': ADMISSION.stats(),
+        'cache': SHARED_CACHE.stats(),
     })
 
 
@@ -0,0 +1,143 @@
+"""
+Co-location analysis - find POIs that sit within a distance threshold of each other
+Usable as a library (colocated_groups, parent_map) or from the command line:
+
+    python colocation.py --threshold-km 3
+    python colocation.py --input pois.json --json
+    python colocation.py --merge merged.json
+"""
+
+from dataclasses import asdict
+from typing import Any, Dict, List
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from poi_store import load_pois
+from spatial import SpatialIndex, haversine_km, poi_columns
+
+DEFAULT_THRESHOLD_KM = 3.0
+CHUNK = 65536  # Query points per self-join pass
+
+
+def component_labels(lon: np.ndarray, lat: np.ndarray, threshold_km: float) -> np.ndarray:
+    """
+    Label each point with the smallest index in its co-located group.
+
+    Pairs come from an indexed self-join (band search + haversine), and
+    groups are the connected components of that pair graph, resolved with
+    vectorized min-label propagation plus pointer jumping.
+    """
+    index = SpatialIndex(lon, lat)
+    left, right = [], []
+    for start in range(0, len(lon), CHUNK):
+        owner, entry, _ = index.within(lon[start:start + CHUNK], lat[start:start + CHUNK], threshold_km)
+        left.append(owner + start)
+        right.append(index.order[entry])
+    i = np.concatenate(left) if left else np.empty(0, dtype=np.int64)
+    j = np.concatenate(right) if right else np.empty(0, dtype=np.int64)
+    keep = i < j
+    i, j = i[keep], j[keep]
+
+    labels = np.arange(len(lon))
+    while True:
+        previous = labels.copy()
+        low = np.minimum(labels[i], labels[j])
+        np.minimum.at(labels, i, low)
+        np.minimum.at(labels, j, low)
+        labels = labels[labels]  # Pointer jumping shortens long chains
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def colocated_groups(pois: List[Any], threshold_km: float = DEFAULT_THRESHOLD_KM) -> List[List[int]]:
+    """
+    Groups of POI indices with more than one member.
+
+    The first member of each group is its parent: the POI that comes first in
+    dataset order, which is how the source lists main bases ahead of their
+    lodger units. Children follow, nearest to the parent first.
+    """
+    if not pois:
+        return []
+    lon, lat = poi_columns(pois)
+    labels = component_labels(lon, lat, threshold_km)
+    order = np.argsort(labels, kind='stable')
+    bounds = np.flatnonzero(np.diff(labels[order])) + 1
+    groups = []
+    for members in np.split(order, bounds):
+        if len(members) < 2:
+            continue
+        parent, children = members[0], members[1:]
+        dist = haversine_km(lon[parent], lat[parent], lon[children], lat[children])
+        groups.append([int(parent)] + children[np.argsort(dist, kind='stable')].tolist())
+    return groups
+
+
+def parent_map(pois: List[Any], threshold_km: float = DEFAULT_THRESHOLD_KM) -> Dict[str, str]:
+    """Map of child POI id to parent POI id"""
+    return {
+        pois[child].id: pois[group[0]].id
+        for group in colocated_groups(pois, threshold_km)
+        for child in group[1:]
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Report co-located POIs")
+    parser.add_argument('--threshold-km', type=float, default=DEFAULT_THRESHOLD_KM,
+                        help=f"Maximum distance between co-located POIs (default {DEFAULT_THRESHOLD_KM})")
+    parser.add_argument('--input', default='', help="POI JSON file in /api/pois format (default: built-in dataset)")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    parser.add_argument('--merge', metavar='OUTPUT', help="Write the dataset with parent_id set on co-located records "
+                             "(loadable as a dataset; children lists are informational)")
+    args = parser.parse_args(argv)
+
+    pois = load_pois(args.input)
+    groups = colocated_groups(pois, args.threshold_km)
+    lon, lat = poi_columns(pois)
+
+    report = []
+    for group in groups:
+        parent = group[0]
+        report.append({
+            'parent': pois[parent].id,
+            'name': pois[parent].name,
+            'children': [
+                {
+                    'id': pois[child].id,
+                    'name': pois[child].name,
+                    'distance_km': round(float(haversine_km(lon[parent], lat[parent], lon[child], lat[child])), 3),
+                }
+                for child in group[1:]
+            ],
+        })
+
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        merged = sum(len(group['children']) for group in report)
+        print(f"{len(pois)} POIs, {len(report)} co-located groups within {args.threshold_km} km, "
+              f"{merged} mergeable records")
+        for group in report:
+            print(f"\n  {group['name']} ({group['parent']})")
+            for child in group['children']:
+                print(f"    └─ {child['name']} ({child['id']}) {child['distance_km']:.2f} km")
+
+    if args.merge:
+        records = [asdict(poi) for poi in pois]
+        for group in groups:
+            records[group[0]]['children'] = [pois[child].id for child in group[1:]]
+            for child in group[1:]:
+                records[child]['parent_id'] = pois[group[0]].id
+        with open(args.merge, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+        print(f"\nWrote {len(records)} merged records to {args.merge}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
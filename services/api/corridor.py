@@ -0,0 +1,175 @@
+"""
+Corridor queries - POIs within a buffer distance of a route polyline
+Candidates come from the spatial index; distances are to great-circle segments
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+from spatial import EARTH_RADIUS_KM, SpatialIndex, haversine_km
+
+
+def decode_polyline(encoded: str, precision: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decode a Google encoded polyline into (lon, lat) arrays.
+
+    Vectorized: every varint chunk is located at once, so routes with many
+    thousands of vertices decode without a per-character Python loop.
+    """
+    try:
+        raw = encoded.encode('ascii')
+    except UnicodeEncodeError:
+        raise ValueError("Invalid polyline character") from None
+    data = np.frombuffer(raw, dtype=np.uint8).astype(np.int64) - 63
+    if len(data) == 0:
+        empty = np.empty(0)
+        return empty, empty
+    if data.min() < 0 or data.max() > 63:
+        raise ValueError("Invalid polyline character")
+    last = (data & 0x20) == 0
+    if not last[-1]:
+        raise ValueError("Truncated polyline")
+    # Position of each 5-bit chunk within its value, then sum the shifted chunks per value
+    starts = np.concatenate(([0], np.flatnonzero(last)[:-1] + 1))
+    position = np.arange(len(data)) - np.repeat(starts, np.diff(np.append(starts, len(data))))
+    if position.max() > 6:
+        raise ValueError("Invalid polyline value")
+    values = np.add.reduceat((data & 0x1F) << (5 * position), starts)
+    deltas = (values >> 1) ^ -(values & 1)
+    if len(deltas) % 2:
+        raise ValueError("Polyline has an odd number of values")
+    coords = np.cumsum(deltas.reshape(-1, 2), axis=0) / 10.0 ** precision
+    return coords[:, 1], coords[:, 0]
+
+
+def encode_polyline(lon: np.ndarray, lat: np.ndarray, precision: int = 5) -> str:
+    """Encode (lon, lat) arrays as a Google encoded polyline (inverse of decode_polyline)"""
+    points = np.round(np.stack([lat, lon], axis=1) * 10.0 ** precision).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    out = []
+    for value in ((deltas << 1) ^ (deltas >> 63)).tolist():
+        while value >= 0x20:
+            out.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        out.append(chr(value + 63))
+    return ''.join(out)
+
+
+def to_vectors(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Unit vectors on the sphere, shape [n, 3]"""
+    lon, lat = np.radians(lon), np.radians(lat)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def to_lonlat(v: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return np.degrees(np.arctan2(v[:, 1], v[:, 0])), np.degrees(np.arctan2(v[:, 2], np.hypot(v[:, 0], v[:, 1])))
+
+
+def _angle(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """Angle between unit vectors, accurate for tiny and near-antipodal angles"""
+    return np.arctan2(np.linalg.norm(np.cross(u, v), axis=-1), np.einsum('ij,ij->i', u, v))
+
+
+def _sample_segments(a: np.ndarray, b: np.ndarray, length: np.ndarray,
+                     step: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Midpoints of pieces at most `step` radians long along each segment, with
+    their segment numbers and half piece lengths
+    """
+    pieces = np.maximum(np.ceil(length / step), 1).astype(np.int64)
+    segment = np.repeat(np.arange(len(a)), pieces)
+    first = np.repeat(np.cumsum(pieces) - pieces, pieces)
+    t = (np.arange(len(segment)) - first + 0.5) / pieces[segment]
+    theta = length[segment]
+    # Slerp; segments too short for a stable sin(theta) fall back to normalized lerp
+    safe = theta > 1e-9
+    sin_theta = np.where(safe, np.sin(theta), 1.0)
+    wa = np.where(safe, np.sin((1 - t) * theta) / sin_theta, 1 - t)
+    wb = np.where(safe, np.sin(t * theta) / sin_theta, t)
+    points = wa[:, None] * a[segment] + wb[:, None] * b[segment]
+    return points / np.linalg.norm(points, axis=1, keepdims=True), segment, theta / pieces[segment] / 2
+
+
+def route_pieces(lon: np.ndarray, lat: np.ndarray, buffer_km: float) -> float:
+    """
+    Number of route pieces corridor() samples for buffer_km. Its memory grows
+    with this count (route length / buffer), so callers cap it before running
+    """
+    vertices = to_vectors(lon, lat)
+    if len(vertices) == 1:
+        return 1.0
+    length = _angle(vertices[:-1], vertices[1:])
+    # Float sum so a tiny buffer cannot overflow an integer count; step kept above 0 so 0 / step is not NaN
+    step = max(2 * buffer_km / EARTH_RADIUS_KM, np.finfo(np.float64).tiny)
+    return float(np.maximum(np.ceil(length / step), 1).sum())
+
+
+def corridor(index: SpatialIndex, lon: np.ndarray, lat: np.ndarray,
+             buffer_km: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+    """
+    Index entries within buffer_km of the route through (lon, lat).
+
+    Returns (entry, along_km, cross_km, length_km) sorted by along-track
+    distance. cross_km is signed: negative left of the direction of travel,
+    positive right. Past a route end it is the distance to that vertex.
+    """
+    vertices = to_vectors(lon, lat)
+    if len(vertices) == 1:
+        vertices = np.vstack([vertices, vertices])
+    a, b = vertices[:-1], vertices[1:]
+    length = _angle(a, b)
+    offsets = np.concatenate(([0.0], np.cumsum(length)))
+    buffer = buffer_km / EARTH_RADIUS_KM
+
+    # Prune: a point within `buffer` of a piece is within buffer + half its
+    # length of the piece midpoint. Pieces are at most 2 * buffer long, so one
+    # candidate scan of radius 2 * buffer finds them all; the per-piece bound
+    # then drops the excess around short segments. Unsorted candidates are
+    # enough here, so this skips SpatialIndex.within's ordering.
+    samples, segment, half = _sample_segments(a, b, length, 2 * buffer)
+    sample_lon, sample_lat = to_lonlat(samples)
+    owner, entry = index.candidates(sample_lon, sample_lat, 2 * buffer_km)
+    dist = haversine_km(sample_lon[owner], sample_lat[owner], index.lon[entry], index.lat[entry])
+    keep = dist <= (buffer + half[owner]) * EARTH_RADIUS_KM * (1 + 1e-9)
+    keys = np.unique(segment[owner[keep]] * len(index.lon) + entry[keep])
+    if len(keys) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, np.empty(0), np.empty(0), float(offsets[-1] * EARTH_RADIUS_KM)
+    seg, entry = np.divmod(keys, len(index.lon))
+
+    # Exact distance from each candidate to its segment's great circle arc
+    p = to_vectors(index.lon[entry], index.lat[entry])
+    sa, sb = a[seg], b[seg]
+    normal = np.cross(sa, sb)
+    norm = np.linalg.norm(normal, axis=1)
+    degenerate = norm < 1e-12
+    normal = normal / np.where(degenerate, 1.0, norm)[:, None]
+    side = np.einsum('ij,ij->i', p, normal)
+    foot = p - side[:, None] * normal
+    foot_norm = np.linalg.norm(foot, axis=1)
+    foot = foot / np.where(foot_norm > 0, foot_norm, 1.0)[:, None]
+    inside = (
+        ~degenerate
+        & (np.einsum('ij,ij->i', np.cross(sa, foot), normal) >= 0)
+        & (np.einsum('ij,ij->i', np.cross(foot, sb), normal) >= 0)
+    )
+    to_a, to_b = _angle(p, sa), _angle(p, sb)
+    nearer_a = to_a <= to_b
+    dist = np.where(inside, np.abs(np.arcsin(np.clip(side, -1.0, 1.0))), np.minimum(to_a, to_b))
+    along = offsets[seg] + np.where(inside, _angle(sa, foot), np.where(nearer_a, 0.0, length[seg]))
+    sign = np.where(side > 0, -1.0, 1.0)  # Normal A x B points to the left of travel
+
+    # Keep each entry's nearest segment, then drop anything beyond the buffer
+    order = np.lexsort((dist, entry))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = entry[order][1:] != entry[order][:-1]
+    best = order[first]
+    best = best[dist[best] <= buffer]
+    best = best[np.argsort(along[best], kind='stable')]
+    return (
+        entry[best],
+        along[best] * EARTH_RADIUS_KM,
+        sign[best] * dist[best] * EARTH_RADIUS_KM,
+        float(offsets[-1] * EARTH_RADIUS_KM),
+    )
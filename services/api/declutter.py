@@ -0,0 +1,108 @@
+"""
+Label thinning - greedy screen-space collision per zoom level, precomputed so a
+decluttered view is a prefix lookup plus a bbox mask
+"""
+
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from spatial import lonlat_to_mercator, poi_columns
+
+TILE_SIZE = 256
+MAX_LABEL_ZOOM = 18
+NEVER = np.iinfo(np.int16).max  # min_zoom of POIs that collide even at MAX_LABEL_ZOOM
+_NEIGHBOURS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+
+def _isolated(x: np.ndarray, y: np.ndarray, spacing: float) -> np.ndarray:
+    """
+    Points with no other point in their own or any adjacent spacing-sized grid
+    cell, so they cannot collide with anything and need no greedy check
+    """
+    cx, cy = np.floor(x / spacing).astype(np.int64), np.floor(y / spacing).astype(np.int64)
+    # Pixel coordinates stay far below 2^31 up to MAX_LABEL_ZOOM, so keys need no masking
+    cells, inverse, counts = np.unique((cx << 32) + cy, return_inverse=True, return_counts=True)
+    empty_around = counts == 1
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            if dx or dy:
+                # Both sides sorted, so this is a cache-friendly merge rather than random probes
+                neighbour = cells + ((dx << 32) + dy)
+                found = np.minimum(np.searchsorted(cells, neighbour), len(cells) - 1)
+                empty_around &= cells[found] != neighbour
+    alone = empty_around[inverse.ravel()]
+    return alone
+
+
+def _greedy(x: np.ndarray, y: np.ndarray, spacing: float) -> np.ndarray:
+    """
+    Greedy placement in the given (priority) order: a point is kept unless an
+    already kept point lies within `spacing` pixels on both axes
+    """
+    keep = _isolated(x, y, spacing)
+    rows = np.flatnonzero(~keep)
+    cx = np.floor(x[rows] / spacing).astype(np.int64).tolist()
+    cy = np.floor(y[rows] / spacing).astype(np.int64).tolist()
+    # Two kept points can never share a spacing-sized cell, so each cell holds at most one
+    grid = {}
+    for i, px, py, gx, gy in zip(rows.tolist(), x[rows].tolist(), y[rows].tolist(), cx, cy):
+        if (gx, gy) in grid:
+            continue
+        for dx, dy in _NEIGHBOURS:
+            other = grid.get((gx + dx, gy + dy))
+            if other is not None and abs(px - other[0]) < spacing and abs(py - other[1]) < spacing:
+                break
+        else:
+            keep[i] = True
+            grid[gx, gy] = (px, py)
+    return keep
+
+
+class LabelIndex:
+    """
+    Lowest zoom at which each POI is drawn without colliding.
+
+    Placement runs from MAX_LABEL_ZOOM down, each level only over the POIs
+    kept at the level above, so a POI never disappears when zooming in.
+    POIs are stored sorted by that zoom: the drawable set for zoom z is a
+    prefix of the arrays.
+    """
+
+    def __init__(self, order: np.ndarray, min_zoom: np.ndarray, lon: np.ndarray, lat: np.ndarray,
+                 ids: np.ndarray, spacing_px: float, max_zoom: int = MAX_LABEL_ZOOM):
+        self.order = order
+        self.min_zoom = min_zoom
+        self.lon, self.lat = lon, lat
+        self.ids = ids
+        self.spacing_px = spacing_px
+        self.max_zoom = max_zoom
+
+    @classmethod
+    def from_pois(cls, pois: List[Any], rank: np.ndarray, spacing_px: float,
+                  max_zoom: int = MAX_LABEL_ZOOM) -> 'LabelIndex':
+        lon, lat = poi_columns(pois)
+        mx, my = lonlat_to_mercator(lon, lat)
+        priority = np.argsort(rank, kind='stable')  # Most important first
+
+        min_zoom = np.full(len(pois), NEVER, dtype=np.int16)
+        candidates = priority
+        for zoom in range(max_zoom, -1, -1):
+            scale = TILE_SIZE * 2 ** zoom
+            kept = candidates[_greedy(mx[candidates] * scale, my[candidates] * scale, spacing_px)]
+            min_zoom[kept] = zoom
+            candidates = kept
+
+        order = np.argsort(min_zoom, kind='stable')
+        ids = np.array([poi.id for poi in pois], dtype=object)[order]
+        return cls(order, min_zoom[order], lon[order], lat[order], ids, spacing_px, max_zoom)
+
+    def visible(self, zoom: float, bbox: Optional[Tuple[float, float, float, float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, min_zoom) of POIs drawn at zoom inside bbox (min_lon, min_lat, max_lon, max_lat)"""
+        end = np.searchsorted(self.min_zoom, min(int(zoom), self.max_zoom), side='right')
+        rows = np.arange(end)
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            lon, lat = self.lon[:end], self.lat[:end]
+            rows = np.flatnonzero((lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat))
+        return self.ids[rows], self.min_zoom[rows]
@@ -0,0 +1,139 @@
+"""
+Hexagonal density aggregation for zoomed-out heatmap layers
+Bins are precomputed per zoom level so a query only scans bins, never POIs
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import math
+
+import numpy as np
+
+from spatial import encode_labels, lonlat_to_mercator, mercator_to_lonlat, poi_columns
+
+# Hex radius (center to corner) in screen pixels at the bin's own zoom level
+HEX_RADIUS_PX = 24
+TILE_SIZE = 256
+MAX_DENSITY_ZOOM = 8
+
+SQRT3 = math.sqrt(3)
+# Pointy-top hexagon corners as (dx, dy) multiples of the radius
+_CORNERS = [(math.cos(math.radians(60 * i - 30)), math.sin(math.radians(60 * i - 30))) for i in range(6)]
+
+
+@dataclass
+class HexLevel:
+    """Occupied hex bins for one zoom level"""
+    zoom: int
+    size: float  # Hex radius in normalized mercator units
+    x: np.ndarray  # Bin centers, normalized mercator
+    y: np.ndarray
+    counts: np.ndarray  # uint32 [bins, countries * categories]
+
+
+def _hex_round(qf: np.ndarray, rf: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Round fractional axial coordinates to the containing hex (cube rounding)"""
+    sf = -qf - rf
+    q, r, s = np.rint(qf), np.rint(rf), np.rint(sf)
+    dq, dr, ds = np.abs(q - qf), np.abs(r - rf), np.abs(s - sf)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    q = np.where(fix_q, -r - s, q)
+    r = np.where(fix_r, -q - s, r)
+    return q.astype(np.int64), r.astype(np.int64)
+
+
+def _bin(x: np.ndarray, y: np.ndarray, columns: np.ndarray, width: int, zoom: int) -> HexLevel:
+    """Hex bins of one zoom level with per-column (country x category) counts"""
+    size = HEX_RADIUS_PX / (TILE_SIZE * 2 ** zoom)
+    q, r = _hex_round((SQRT3 / 3 * x - y / 3) / size, (2 / 3 * y) / size)
+    keys, inverse = np.unique((q << 32) | (r & 0xFFFFFFFF), return_inverse=True)
+    counts = np.zeros((len(keys), width), dtype=np.uint32)
+    np.add.at(counts, (inverse.ravel(), columns), 1)
+    bq = keys >> 32
+    br = (keys << 32) >> 32  # sign-extend the low half
+    return HexLevel(
+        zoom=zoom,
+        size=size,
+        x=size * SQRT3 * (bq + br / 2),
+        y=size * 1.5 * br,
+        counts=counts,
+    )
+
+
+def _label_counts(labels: List[str], counts: np.ndarray) -> Dict[str, int]:
+    """Non-zero counts by label; labels that collide after lowercasing are summed"""
+    totals: Dict[str, int] = {}
+    for label, n in zip(labels, counts.tolist()):
+        if n:
+            totals[label] = totals.get(label, 0) + n
+    return totals
+
+
+class DensityIndex:
+    """
+    Per-zoom hex bin counts broken down by country and category. Labels are
+    lowercase, matching the lowercased ?country=/?category= filters
+    """
+
+    def __init__(self, countries: List[str], categories: List[str], levels: List[HexLevel]):
+        # Lowercased here too, so snapshots stored with mixed-case labels still match
+        self.countries = [c.lower() for c in countries]
+        self.categories = [c.lower() for c in categories]
+        self.levels = levels
+        self.max_zoom = len(levels) - 1
+
+    @classmethod
+    def from_pois(cls, pois: List[Any], max_zoom: int = MAX_DENSITY_ZOOM) -> 'DensityIndex':
+        countries, country_codes = encode_labels([poi.country_code.lower() for poi in pois])
+        categories, category_codes = encode_labels([poi.category.lower() for poi in pois])
+        columns = country_codes * len(categories) + category_codes
+        x, y = lonlat_to_mercator(*poi_columns(pois))
+        width = len(countries) * len(categories)
+        return cls(countries, categories, [_bin(x, y, columns, width, zoom) for zoom in range(max_zoom + 1)])
+
+    def _column_mask(self, countries: Optional[Iterable[str]], categories: Optional[Iterable[str]]) -> np.ndarray:
+        country_ok = np.array([countries is None or c in countries for c in self.countries], dtype=bool)
+        category_ok = np.array([categories is None or c in categories for c in self.categories], dtype=bool)
+        return np.outer(country_ok, category_ok).ravel()
+
+    def query(self, zoom: float, bbox: Tuple[float, float, float, float],
+              countries: Optional[Iterable[str]] = None,
+              categories: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """Hex bins touching bbox (min_lon, min_lat, max_lon, max_lat) as a GeoJSON FeatureCollection"""
+        level = self.levels[int(min(max(zoom, 0), self.max_zoom))]
+        (x0, x1), (y1, y0) = lonlat_to_mercator(np.array(bbox[0::2]), np.array(bbox[1::2]))
+        pad = level.size
+        in_view = (
+            (level.x >= x0 - pad) & (level.x <= x1 + pad)
+            & (level.y >= y0 - pad) & (level.y <= y1 + pad)
+        )
+        counts = level.counts[in_view] * self._column_mask(countries, categories)
+        totals = counts.sum(axis=1)
+        keep = totals > 0
+        counts, totals = counts[keep], totals[keep]
+        cx, cy = level.x[in_view][keep], level.y[in_view][keep]
+
+        per_cell = counts.reshape(len(counts), len(self.countries), len(self.categories))
+        by_country = per_cell.sum(axis=2)
+        by_category = per_cell.sum(axis=1)
+
+        ring_x = cx[:, None] + level.size * np.array([dx for dx, _ in _CORNERS])
+        ring_y = cy[:, None] + level.size * np.array([dy for _, dy in _CORNERS])
+        ring_lon, ring_lat = mercator_to_lonlat(ring_x, ring_y)
+        ring_lon, ring_lat = np.round(ring_lon, 5).tolist(), np.round(ring_lat, 5).tolist()
+
+        features = []
+        for i in range(len(totals)):
+            ring = [[ring_lon[i][k], ring_lat[i][k]] for k in range(6)]
+            ring.append(ring[0])
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+                'properties': {
+                    'count': int(totals[i]),
+                    'countries': _label_counts(self.countries, by_country[i]),
+                    'categories': _label_counts(self.categories, by_category[i]),
+                },
+            })
+        return {'type': 'FeatureCollection', 'zoom': level.zoom, 'features': features}
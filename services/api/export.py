@@ -0,0 +1,162 @@
+"""
+Static export - renders the dataset-only pages and API responses into a
+directory tree a CDN or nginx can serve without Python
+
+    python export.py <output-dir> [--min-zoom 0] [--max-zoom 12]
+
+Each URL is written to <url>.json (index.html for /) next to precompressed
+.gz and .br copies, plus manifest.json with content hashes. Unchanged files
+are left untouched so syncs to object storage only upload what changed.
+"""
+
+from typing import Dict, Iterator, List, Tuple
+from urllib.parse import quote
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # In requirements.txt; without it only .gz copies are written, with a warning
+    brotli = None
+
+from spatial import lonlat_to_mercator, poi_columns
+
+MANIFEST = 'manifest.json'
+# Smaller bodies are not worth a compressed copy
+MIN_COMPRESS_BYTES = 256
+
+
+def tile_coords(lon: np.ndarray, lat: np.ndarray, zoom: int) -> np.ndarray:
+    """Distinct (x, y) of the XYZ tiles holding the points at zoom"""
+    x, y = lonlat_to_mercator(lon, lat)
+    n = 2 ** zoom
+    tiles = np.stack([np.clip(np.floor(x * n), 0, n - 1), np.clip(np.floor(y * n), 0, n - 1)], axis=1)
+    return np.unique(tiles.astype(np.int64), axis=0)
+
+
+def export_urls(app_module, min_zoom: int, max_zoom: int) -> Iterator[str]:
+    """Every URL whose response depends only on the dataset"""
+    yield '/'
+    yield '/sw.js'
+    yield '/api/pois'
+    for country in app_module.attribute_index().labels['country']:
+        yield f'/api/pois/{quote(country)}'
+    for region in app_module.REGIONS:
+        yield f'/api/pois/region/{region}'
+    # Tiles without POIs are not written; the front end answers them with []
+    lon, lat = poi_columns(app_module.POI_STORE.all())
+    for zoom in range(min_zoom, max_zoom + 1):
+        for x, y in tile_coords(lon, lat, zoom).tolist():
+            yield f'/api/pois/tile/{zoom}/{x}/{y}'
+
+
+def file_for(url: str) -> str:
+    """Relative output path for a URL"""
+    if url == '/':
+        return 'index.html'
+    path = url.lstrip('/')
+    return path if os.path.splitext(path)[1] else f'{path}.json'
+
+
+def _write(path: str, body: bytes) -> None:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+def write_file(root: str, relative: str, body: bytes, previous: Dict[str, dict]) -> Tuple[dict, bool]:
+    """Write body and its compressed copies unless unchanged since `previous`; returns (entry, written)"""
+    digest = hashlib.sha256(body).hexdigest()
+    entry = {'file': relative, 'sha256': digest, 'bytes': len(body), 'encodings': []}
+    compress = len(body) >= MIN_COMPRESS_BYTES
+    if compress:
+        entry['encodings'] = ['gzip'] + (['br'] if brotli is not None else [])
+    path = os.path.join(root, relative)
+    old = previous.get(relative)
+    if old is not None and old['sha256'] == digest and old['encodings'] == entry['encodings'] \
+            and all(os.path.exists(p) for p in [path] + [f'{path}.{_SUFFIX[e]}' for e in entry['encodings']]):
+        return entry, False
+    _write(path, body)
+    for encoding, suffix in _SUFFIX.items():
+        if encoding in entry['encodings']:
+            _write(f'{path}.{suffix}', _COMPRESS[encoding](body))
+        elif os.path.exists(f'{path}.{suffix}'):
+            os.remove(f'{path}.{suffix}')  # Stale copy would be served instead of the new body
+    return entry, True
+
+
+_SUFFIX = {'gzip': 'gz', 'br': 'br'}
+_COMPRESS = {
+    # mtime=0 keeps the output byte-identical between runs
+    'gzip': lambda body: gzip.compress(body, compresslevel=9, mtime=0),
+    'br': lambda body: brotli.compress(body, quality=11),
+}
+
+
+def export(app_module, root: str, min_zoom: int = 0, max_zoom: int = 12) -> dict:
+    """Render every static URL through the app into root, returns the manifest"""
+    manifest_path = os.path.join(root, MANIFEST)
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            previous = {entry['file']: entry for entry in json.load(f)['files'].values()}
+
+    # Requests are rendered in-process; admission limits are for network clients
+    app_module.ADMISSION_ENABLED = False
+    client = app_module.app.test_client()
+    version = app_module.POI_STORE.version
+    files, written = {}, 0
+    for url in export_urls(app_module, min_zoom, max_zoom):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url}: HTTP {response.status_code}')
+        entry, changed = write_file(root, file_for(url), response.get_data(), previous)
+        entry['content_type'] = response.mimetype
+        files[url] = entry
+        written += changed
+
+    # Files from an earlier export that this one no longer produces
+    current = {entry['file'] for entry in files.values()}
+    for relative in set(previous) - current:
+        for suffix in ('', '.gz', '.br'):
+            if os.path.exists(os.path.join(root, relative + suffix)):
+                os.remove(os.path.join(root, relative + suffix))
+
+    manifest = {'dataset_version': version, 'min_zoom': min_zoom, 'max_zoom': max_zoom, 'files': files}
+    _write(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8'))
+    manifest['written'] = written
+    return manifest
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export static POI pages, responses and tiles")
+    parser.add_argument('output')
+    parser.add_argument('--min-zoom', type=int, default=0)
+    parser.add_argument('--max-zoom', type=int, default=12)
+    args = parser.parse_args(argv)
+    if not 0 <= args.min_zoom <= args.max_zoom <= 24:
+        parser.error("zooms must satisfy 0 <= --min-zoom <= --max-zoom <= 24")
+
+    if brotli is None:
+        print("WARNING: brotli is not installed (pip install -r requirements.txt); "
+              "writing .gz copies only, no .br", file=sys.stderr)
+    import app
+    manifest = export(app, args.output, args.min_zoom, args.max_zoom)
+    total = sum(entry['bytes'] for entry in manifest['files'].values())
+    print(f"Exported {len(manifest['files'])} files ({total:,} bytes, {manifest['written']} changed) "
+          f"to {args.output}")
+    if brotli is None:
+        print("WARNING: brotli is not installed: no .br copies were written", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+Footprints - installation outlines simplified once per zoom level, quantized
+and encoded as polylines, so a viewport or tile response only carries the
+detail that zoom can show
+"""
+
+from typing import Any, Dict, List, Optional
+import json
+import math
+
+import numpy as np
+
+from corridor import encode_polyline
+from hilbert import hilbert_keys
+from spatial import lonlat_to_mercator, poi_columns
+
+TILE_SIZE = 256
+# Zoom from which footprints are sent at full (quantized) detail
+FOOTPRINT_MAX_ZOOM = 16
+# Simplification tolerance in screen pixels at each level
+TOLERANCE_PX = 0.5
+# Footprints smaller than this on screen are left to the marker
+MIN_FOOTPRINT_PX = 3
+# Tolerance halvings tried before a level falls back to the unsimplified outline
+MAX_REFINE = 8
+# Segment pairs tested per block in the self-intersection check
+CROSSING_BLOCK = 256
+
+
+def geometry_polygons(geometry: Any) -> List[List[np.ndarray]]:
+    """
+    Polygons of a GeoJSON Polygon or MultiPolygon as lists of closed [n, 2]
+    (lon, lat) rings, outer ring first. ValueError for anything else.
+    """
+    if not isinstance(geometry, dict) or geometry.get('type') not in ('Polygon', 'MultiPolygon'):
+        raise ValueError("footprint must be a GeoJSON Polygon or MultiPolygon")
+    coordinates = geometry.get('coordinates')
+    polygons = [coordinates] if geometry['type'] == 'Polygon' else coordinates
+    if not isinstance(polygons, list) or not polygons:
+        raise ValueError("footprint has no coordinates")
+    result = []
+    for polygon in polygons:
+        if not isinstance(polygon, list) or not polygon:
+            raise ValueError("footprint polygon has no rings")
+        rings = []
+        for ring in polygon:
+            try:
+                ring = np.array(ring, dtype=np.float64)
+            except (TypeError, ValueError):
+                raise ValueError("footprint positions must be [lon, lat] numbers") from None
+            if ring.ndim != 2 or ring.shape[1] < 2 or not np.isfinite(ring).all():
+                raise ValueError("footprint positions must be [lon, lat] numbers")
+            ring = ring[:, :2]
+            if ((np.abs(ring[:, 0]) > 180) | (np.abs(ring[:, 1]) > 90)).any():
+                raise ValueError("footprint coordinates out of range")
+            if not (ring[0] == ring[-1]).all():
+                ring = np.vstack([ring, ring[:1]])
+            if len(ring) < 4:
+                raise ValueError("footprint rings need at least 3 distinct positions")
+            rings.append(ring)
+        result.append(rings)
+    return result
+
+
+def _douglas_peucker(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    """Keep-mask of a closed ring simplified to within `tolerance` (same units as x, y)"""
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    # Split at the vertex farthest from the start so both halves are open chains
+    far = int(np.argmax(np.hypot(x - x[0], y - y[0])))
+    keep[[0, far, n - 1]] = True
+    stack = [(0, far), (far, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b <= a + 1:
+            continue
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        px, py = x[a + 1:b] - x[a], y[a + 1:b] - y[a]
+        length = math.hypot(dx, dy)
+        dist = np.abs(px * dy - py * dx) / length if length > 0 else np.hypot(px, py)
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            keep[a + 1 + i] = True
+            stack += [(a, a + 1 + i), (a + 1 + i, b)]
+    return keep
+
+
+def _crosses(rings: List[np.ndarray]) -> bool:
+    """True if any two non-adjacent segments of the rings properly intersect"""
+    starts = np.concatenate([ring[:-1] for ring in rings])
+    ends = np.concatenate([ring[1:] for ring in rings])
+    ring_of = np.concatenate([np.full(len(ring) - 1, k) for k, ring in enumerate(rings)])
+    index = np.concatenate([np.arange(len(ring) - 1) for ring in rings])
+    sizes = np.array([len(ring) - 1 for ring in rings])[ring_of]
+
+    def orient(a, b, c):
+        return np.sign((b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1])
+                       - (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0]))
+
+    for lo in range(0, len(starts), CROSSING_BLOCK):
+        a, b = starts[lo:lo + CROSSING_BLOCK, None], ends[lo:lo + CROSSING_BLOCK, None]
+        c, d = starts[None], ends[None]
+        proper = (orient(a, b, c) * orient(a, b, d) < 0) & (orient(c, d, a) * orient(c, d, b) < 0)
+        # Neighbouring segments of one ring share a vertex and never count
+        gap = np.abs(index[lo:lo + CROSSING_BLOCK, None] - index[None])
+        same_ring = ring_of[lo:lo + CROSSING_BLOCK, None] == ring_of[None]
+        adjacent = same_ring & ((gap <= 1) | (gap == sizes[None] - 1))
+        if (proper & ~adjacent).any():
+            return True
+    return False
+
+
+def _quantized(ring: np.ndarray, precision: int) -> np.ndarray:
+    """Ring rounded to `precision` decimals with repeated positions removed"""
+    ring = np.round(ring, precision)
+    moved = np.r_[True, (np.diff(ring, axis=0) != 0).any(axis=1)]
+    return ring[moved]
+
+
+def precision_for_zoom(zoom: int) -> int:
+    """Decimal places that resolve half a pixel at zoom (1..6)"""
+    pixel_deg = 360.0 / (TILE_SIZE * 2 ** zoom)
+    return min(max(math.ceil(math.log10(2 / pixel_deg)), 1), 6)
+
+
+def _extent(pixels: np.ndarray) -> float:
+    return float((pixels.max(axis=0) - pixels.min(axis=0)).max())
+
+
+def simplify_polygons(polygons: List[List[np.ndarray]], zoom: int) -> Optional[List[List[np.ndarray]]]:
+    """
+    Outline for one zoom level: rings simplified to TOLERANCE_PX and quantized
+    to the zoom's precision, or None when it is too small to draw.
+
+    Parts and holes under MIN_FOOTPRINT_PX are dropped first, holes that
+    collapse after. Topology is kept: if simplifying makes rings cross
+    themselves or each other, or collapses an outer ring, the tolerance is
+    halved and the level redone.
+    """
+    scale = TILE_SIZE * 2 ** zoom
+    visible = []
+    for rings in polygons:
+        pixels = [np.stack(lonlat_to_mercator(ring[:, 0], ring[:, 1]), axis=1) * scale for ring in rings]
+        if _extent(pixels[0]) < MIN_FOOTPRINT_PX:
+            continue
+        visible.append([(ring, px) for k, (ring, px) in enumerate(zip(rings, pixels))
+                        if k == 0 or _extent(px) >= MIN_FOOTPRINT_PX])
+    if not visible:
+        return None
+    precision = precision_for_zoom(zoom)
+    tolerance = TOLERANCE_PX
+    for attempt in range(MAX_REFINE + 1):
+        result = []
+        for rings in visible:
+            simplified = [
+                _quantized(ring if attempt == MAX_REFINE else ring[_douglas_peucker(px[:, 0], px[:, 1], tolerance)],
+                           precision)
+                for ring, px in rings
+            ]
+            # A hole that collapses to a line has nothing to show at this zoom
+            result.append(simplified[:1] + [ring for ring in simplified[1:] if len(ring) >= 4])
+        flat = [ring for rings in result for ring in rings]
+        if all(len(rings[0]) >= 4 for rings in result) and not _crosses(flat):
+            return result
+        tolerance /= 2
+    return result  # Invalid even unsimplified; sent as given
+
+
+def encode_level(geometry_type: str, polygons: List[List[np.ndarray]], precision: int) -> bytes:
+    """JSON fragment for one level, each ring an encoded polyline at `precision`"""
+    encoded = [[encode_polyline(ring[:, 0], ring[:, 1], precision) for ring in rings] for rings in polygons]
+    coordinates = encoded[0] if geometry_type == 'Polygon' else encoded
+    return json.dumps(
+        {'type': geometry_type, 'precision': precision, 'coordinates': coordinates}, separators=(',', ':'),
+    ).encode('utf-8')
+
+
+def footprint_levels(geometry: dict, max_zoom: int = FOOTPRINT_MAX_ZOOM) -> List[Optional[bytes]]:
+    """Encoded outline per zoom 0..max_zoom (None where it is too small to draw)"""
+    polygons = geometry_polygons(geometry)
+    levels: List[Optional[bytes]] = []
+    for zoom in range(max_zoom + 1):
+        simplified = simplify_polygons(polygons, zoom)
+        level = None if simplified is None else encode_level(geometry['type'], simplified, precision_for_zoom(zoom))
+        # Consecutive identical levels share one bytes object
+        levels.append(levels[-1] if levels and level == levels[-1] else level)
+    return levels
+
+
+def geometry_key(geometry: dict) -> str:
+    """Canonical JSON of a footprint, identifying outlines whose levels can be reused"""
+    return json.dumps(geometry, sort_keys=True, separators=(',', ':'))
+
+
+class FootprintIndex:
+    """
+    Precomputed footprint levels for the POIs that have one, addressed by
+    their position along the Hilbert curve so they can be spliced into
+    HilbertIndex.json_array output.
+
+    Levels of outlines unchanged since `previous` (the index of an earlier
+    dataset version) are reused, so an edit does not re-simplify every outline.
+    """
+
+    def __init__(self, curve: np.ndarray, levels: List[List[Optional[bytes]]], max_zoom: int,
+                 by_geometry: Dict[str, List[Optional[bytes]]]):
+        self.curve = curve
+        self.levels = levels
+        self.max_zoom = max_zoom
+        self.by_geometry = by_geometry
+
+    @classmethod
+    def from_pois(cls, pois: List[Any], max_zoom: int = FOOTPRINT_MAX_ZOOM,
+                  previous: Optional['FootprintIndex'] = None) -> 'FootprintIndex':
+        reusable = previous.by_geometry if previous is not None and previous.max_zoom == max_zoom else {}
+        by_geometry: Dict[str, List[Optional[bytes]]] = {}
+        rows, levels = [], []
+        for i, poi in enumerate(pois):
+            geometry = getattr(poi, 'footprint', None)
+            if not geometry:
+                continue
+            key = geometry_key(geometry)
+            found = by_geometry.get(key) or reusable.get(key)
+            if found is None:
+                try:
+                    found = footprint_levels(geometry, max_zoom)
+                except ValueError:
+                    continue  # Malformed outlines are skipped; the POI is still served as a point
+            by_geometry[key] = found
+            levels.append(found)
+            rows.append(i)
+        curve = np.empty(0, dtype=np.int64)
+        if rows:
+            # Same stable key sort as HilbertIndex.from_pois, so positions line up
+            lon, lat = poi_columns(pois)
+            perm = np.argsort(hilbert_keys(lon, lat), kind='stable')
+            position = np.empty(len(pois), dtype=np.int64)
+            position[perm] = np.arange(len(pois))
+            curve = position[rows]
+        order = np.argsort(curve, kind='stable')
+        return cls(curve[order], [levels[i] for i in order], max_zoom, by_geometry)
+
+    def __len__(self) -> int:
+        return len(self.curve)
+
+    def fragments(self, lo: np.ndarray, hi: np.ndarray, zoom: float) -> Dict[int, bytes]:
+        """Curve position -> `"footprint":{...}` for footprints drawn at zoom within the [lo, hi) slices"""
+        if not len(self.curve):
+            return {}
+        level = min(max(int(zoom), 0), self.max_zoom)
+        first = np.searchsorted(self.curve, lo, side='left')
+        last = np.searchsorted(self.curve, hi, side='left')
+        found = {}
+        for a, b in zip(first.tolist(), last.tolist()):
+            for k in range(a, b):
+                if self.levels[k][level] is not None:
+                    found[int(self.curve[k])] = b'"footprint":' + self.levels[k][level]
+        return found
@@ -0,0 +1,210 @@
+"""
+Hilbert-curve ordering - POIs sorted along a space-filling curve so that a bbox
+or tile query becomes a handful of contiguous slices of the sorted arrays
+"""
+
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
+
+import numpy as np
+
+from spatial import poi_columns
+
+# Curve order: a 2^16 x 2^16 grid over lon/lat (~0.0055 x 0.0027 degree cells)
+HILBERT_ORDER = 16
+# Partially covered cells are subdivided until there are this many; the rest are filtered
+MAX_PARTIAL_CELLS = 256
+
+
+def hilbert_d(order: int, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Distance along an order-`order` Hilbert curve for integer cell coordinates"""
+    x, y = x.astype(np.int64), y.astype(np.int64)
+    n = 1 << order
+    d = np.zeros(len(x), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the sub-curve has the canonical orientation
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s >>= 1
+    return d
+
+
+def hilbert_keys(lon: np.ndarray, lat: np.ndarray, order: int = HILBERT_ORDER) -> np.ndarray:
+    n = 1 << order
+    x = np.clip(np.floor((np.asarray(lon) + 180.0) / 360.0 * n), 0, n - 1)
+    y = np.clip(np.floor((np.asarray(lat) + 90.0) / 180.0 * n), 0, n - 1)
+    return hilbert_d(order, x, y)
+
+
+# Bulky geometry is served per zoom (see footprints.py), never inside the record
+OMITTED_FIELDS = ('footprint',)
+
+
+def record_json(record: Any) -> bytes:
+    """Compact JSON for one record, matching the API's poi_to_dict() serialization"""
+    data = {k: v for k, v in asdict(record).items() if k not in OMITTED_FIELDS}
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _runs(positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted positions grouped into [lo, hi) runs of consecutive values"""
+    if not len(positions):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    return positions[np.r_[0, breaks]], positions[np.r_[breaks - 1, len(positions) - 1]] + 1
+
+
+class HilbertIndex:
+    """
+    POI positions sorted by Hilbert key, with the sorted keys as a range index.
+
+    `perm[i]` is the dataset position of the i-th POI along the curve. When
+    built with an encoder, `blob` holds every POI's JSON in curve order (each
+    followed by a comma) and `offsets` its byte offsets, so a run of POIs is
+    a single slice of the blob.
+    """
+
+    def __init__(self, perm: np.ndarray, keys: np.ndarray, lon: np.ndarray, lat: np.ndarray,
+                 order: int = HILBERT_ORDER, blob: Optional[memoryview] = None,
+                 offsets: Optional[np.ndarray] = None):
+        self.perm, self.keys, self.lon, self.lat = perm, keys, lon, lat
+        self.order = order
+        self.blob, self.offsets = blob, offsets
+
+    @classmethod
+    def from_pois(cls, pois: List[Any], encode: Optional[Callable[[Any], bytes]] = None,
+                  order: int = HILBERT_ORDER) -> 'HilbertIndex':
+        lon, lat = poi_columns(pois)
+        keys = hilbert_keys(lon, lat, order)
+        perm = np.argsort(keys, kind='stable')
+        blob = offsets = None
+        if encode is not None:
+            blob, offsets = encode_fragments([pois[i] for i in perm], encode)
+        return cls(perm, keys[perm], lon[perm], lat[perm], order, blob, offsets)
+
+    def ranges(self, bbox: Tuple[float, float, float, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact [lo, hi) slices of the curve-ordered arrays holding the POIs in
+        bbox (min_lon, min_lat, max_lon, max_lat), in curve order.
+
+        Quadtree cells are classified level by level: cells inside the bbox
+        become whole key ranges without looking at any POI, partially covered
+        cells are subdivided, and only the last partial cells are filtered
+        point by point.
+        """
+        min_lon, min_lat, max_lon, max_lat = bbox
+        full_lo, full_hi, part_lo, part_hi = [], [], [], []
+        cx, cy, start = self._start_cells(bbox)
+        for level in range(start, self.order + 1):
+            width, height = 360.0 / (1 << level), 180.0 / (1 << level)
+            lon0, lat0 = cx * width - 180.0, cy * height - 90.0
+            lon1, lat1 = lon0 + width, lat0 + height
+            overlaps = (lon1 >= min_lon) & (lon0 <= max_lon) & (lat1 >= min_lat) & (lat0 <= max_lat)
+            # The grid's last row/column also holds points on the 180 / 90 edge
+            inside = (
+                (lon0 >= min_lon) & ((lon1 <= max_lon) & (lon1 < 180.0) | (max_lon >= 180.0))
+                & (lat0 >= min_lat) & ((lat1 <= max_lat) & (lat1 < 90.0) | (max_lat >= 90.0))
+            )
+            span = 1 << (2 * (self.order - level))
+            d = hilbert_d(level, cx, cy) * span
+            full_lo.append(d[inside])
+            full_hi.append(d[inside] + span)
+            partial = overlaps & ~inside
+            cx, cy, d = cx[partial], cy[partial], d[partial]
+            if level == self.order or len(cx) * 4 > MAX_PARTIAL_CELLS:
+                part_lo.append(d)
+                part_hi.append(d + span)
+                break
+            cx = (np.repeat(cx * 2, 4) + np.tile([0, 1, 0, 1], len(cx)))
+            cy = (np.repeat(cy * 2, 4) + np.tile([0, 0, 1, 1], len(cy)))
+
+        lo = np.searchsorted(self.keys, np.concatenate(full_lo), side='left')
+        hi = np.searchsorted(self.keys, np.concatenate(full_hi), side='left')
+        keep = hi > lo
+        lo, hi = lo[keep], hi[keep]
+
+        # Partial cells: test their points and turn the survivors into runs
+        p_lo = np.searchsorted(self.keys, np.concatenate(part_lo), side='left')
+        p_hi = np.searchsorted(self.keys, np.concatenate(part_hi), side='left')
+        counts = np.maximum(p_hi - p_lo, 0)
+        rows = np.repeat(p_lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        hit = (
+            (self.lon[rows] >= min_lon) & (self.lon[rows] <= max_lon)
+            & (self.lat[rows] >= min_lat) & (self.lat[rows] <= max_lat)
+        )
+        run_lo, run_hi = _runs(np.sort(rows[hit]))
+
+        lo, hi = np.concatenate([lo, run_lo]), np.concatenate([hi, run_hi])
+        order = np.argsort(lo, kind='stable')
+        lo, hi = lo[order], hi[order]
+        # Merge slices that touch
+        if len(lo) > 1:
+            starts = np.r_[True, lo[1:] != hi[:-1]]
+            lo, hi = lo[starts], hi[np.r_[np.flatnonzero(starts)[1:] - 1, len(hi) - 1]]
+        return lo, hi
+
+    def _start_cells(self, bbox: Tuple[float, float, float, float]) -> Tuple[np.ndarray, np.ndarray, int]:
+        """
+        Cells overlapping bbox at the deepest level where they number at most
+        MAX_PARTIAL_CELLS / 4, so the descent skips levels that only ever
+        hold a few partial cells
+        """
+        min_lon, min_lat, max_lon, max_lat = bbox
+        level, x0, x1, y0, y1 = 0, 0, 0, 0, 0
+        for candidate in range(self.order + 1):
+            n = 1 << candidate
+            cells = [
+                min(max(int(np.floor((v + offset) / extent * n)), 0), n - 1)
+                for v, offset, extent in ((min_lon, 180.0, 360.0), (max_lon, 180.0, 360.0),
+                                          (min_lat, 90.0, 180.0), (max_lat, 90.0, 180.0))
+            ]
+            if (cells[1] - cells[0] + 1) * (cells[3] - cells[2] + 1) * 4 > MAX_PARTIAL_CELLS:
+                break
+            level, (x0, x1, y0, y1) = candidate, cells
+        cx, cy = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1))
+        return cx.ravel().astype(np.int64), cy.ravel().astype(np.int64), level
+
+    def positions(self, bbox: Tuple[float, float, float, float]) -> np.ndarray:
+        """Dataset positions of the POIs in bbox, in dataset order"""
+        lo, hi = self.ranges(bbox)
+        counts = hi - lo
+        rows = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return np.sort(self.perm[rows])
+
+    def json_array(self, lo: np.ndarray, hi: np.ndarray, extra: Optional[Dict[int, bytes]] = None) -> bytes:
+        """
+        JSON array of the POIs in the given slices, assembled from blob views.
+        `extra` maps curve positions to `"key":value` bytes added to those records.
+        """
+        parts = []
+        cuts = sorted(extra) if extra else []
+        k = 0
+        for a, b in zip(lo.tolist(), hi.tolist()):
+            start = int(self.offsets[a])
+            while k < len(cuts) and cuts[k] < a:
+                k += 1
+            while k < len(cuts) and cuts[k] < b:
+                # Each fragment ends in "},": cut before the brace, insert, resume at the comma
+                end = int(self.offsets[cuts[k] + 1])
+                parts += [self.blob[start:end - 2], b',', extra[cuts[k]], b'}']
+                start = end - 1
+                k += 1
+            parts.append(self.blob[start:self.offsets[b]])
+        body = b''.join(parts)
+        return b'[' + body[:-1] + b']' if body else b'[]'
+
+
+def encode_fragments(records: List[Any], encode: Callable[[Any], bytes]) -> Tuple[memoryview, np.ndarray]:
+    """Concatenate encode(record) + b',' for each record, with int64 offsets (n + 1 entries)"""
+    fragments = [encode(record) + b',' for record in records]
+    offsets = np.zeros(len(fragments) + 1, dtype=np.int64)
+    np.cumsum([len(f) for f in fragments], out=offsets[1:])
+    return memoryview(b''.join(fragments)), offsets
@@ -0,0 +1,181 @@
+"""
+Layer registry - independently loaded POI layers (bases, airfields, ports, ...)
+Each layer has its own PoiStore, so indexes and cached aggregates are per layer
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import sys
+import threading
+import time
+
+import numpy as np
+
+from poi_store import PoiStore
+
+# POIs sampled to estimate a layer's per-record footprint
+SIZE_SAMPLE = 1000
+# Minimum seconds between idle/budget sweeps triggered by layer access, and
+# the period of the background sweeper
+SWEEP_INTERVAL = 30.0
+
+
+def estimate_bytes(store: PoiStore) -> int:
+    """
+    Rough memory footprint of a store: sampled record size times the record
+    count, plus the arrays held by its cached indexes.
+    """
+    sample = store.sample(SIZE_SAMPLE)
+    per_poi = 0
+    if sample:
+        per_poi = sum(
+            sys.getsizeof(poi) + sys.getsizeof(vars(poi)) + sum(sys.getsizeof(v) for v in vars(poi).values())
+            for poi in sample
+        ) / len(sample)
+    return int(per_poi * len(store)) + sum(_array_bytes(value) for value in store.cached().values())
+
+
+def _array_bytes(value: Any) -> int:
+    """Bytes of numpy arrays reachable from an index object's attributes (one level deep)"""
+    total = 0
+    attrs = vars(value).values() if hasattr(value, '__dict__') else [value]
+    for attr in attrs:
+        items = attr.values() if isinstance(attr, dict) else [attr]
+        total += sum(item.nbytes for item in items if isinstance(item, np.ndarray))
+    return total
+
+
+class Layer:
+    """A named POI source and, while loaded, its store"""
+
+    def __init__(self, name: str, loader: Callable[[], PoiStore], title: str = '', pinned: bool = False):
+        self.name = name
+        self.title = title or name
+        self.loader = loader
+        self.pinned = pinned
+        self.store: Optional[PoiStore] = None
+        self.last_used = 0.0
+        self.loads = 0
+        self.lock = threading.Lock()
+
+
+class LayerRegistry:
+    """
+    Registry of lazily loaded layers.
+
+    A layer is loaded on first access and dropped again once it has been idle
+    for `idle_seconds`, or earlier (least recently used first) when the loaded
+    layers exceed `budget_bytes`. Pinned layers are never evicted.
+    """
+
+    def __init__(self, budget_bytes: int, idle_seconds: float = 900.0, workers: int = 4):
+        self.budget_bytes = budget_bytes
+        self.idle_seconds = idle_seconds
+        self._layers: Dict[str, Layer] = {}
+        self._sizes: Dict[str, int] = {}
+        self._last_sweep = 0.0
+        self._guard = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='layer')
+        self._sweeper: Optional[threading.Thread] = None
+
+    def register(self, name: str, loader: Callable[[], PoiStore], title: str = '', pinned: bool = False) -> None:
+        with self._guard:
+            self._layers[name] = Layer(name, loader, title, pinned)
+
+    def names(self) -> List[str]:
+        return list(self._layers)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._layers
+
+    def store(self, name: str) -> PoiStore:
+        """The layer's store, loading it on first access (KeyError for unknown layers)"""
+        layer = self._layers[name]
+        now = layer.last_used = time.monotonic()
+        store = layer.store
+        if store is None:
+            with layer.lock:  # One load per layer, concurrent callers wait for it
+                store = layer.store
+                if store is None:
+                    store = layer.loader()
+                    layer.store = store
+                    layer.loads += 1
+            self.sweep(keep=name)
+        elif now - self._last_sweep >= SWEEP_INTERVAL:
+            self.sweep(keep=name)
+        return store
+
+    def fan_out(self, names: Iterable[str], query: Callable[[str, PoiStore], Any]) -> Dict[str, Any]:
+        """Run query(name, store) for each layer in parallel, results keyed by layer name"""
+        names = list(names)
+        futures = {name: self._pool.submit(lambda n: query(n, self.store(n)), name) for name in names}
+        return {name: futures[name].result() for name in names}
+
+    def evict(self, name: str) -> bool:
+        """Drop a loaded layer's store; it reloads on next access"""
+        layer = self._layers[name]
+        with layer.lock:
+            if layer.store is None:
+                return False
+            layer.store = None
+        with self._guard:
+            self._sizes.pop(name, None)
+        return True
+
+    def sweep(self, keep: str = '') -> None:
+        """
+        Evict idle layers, then least recently used ones while over budget.
+        Sizes are re-estimated each sweep since indexes are built lazily.
+        """
+        now = self._last_sweep = time.monotonic()
+        sizes = {}
+        for layer in list(self._layers.values()):
+            store = layer.store
+            if store is not None:
+                sizes[layer.name] = estimate_bytes(store)
+        with self._guard:
+            self._sizes = dict(sizes)
+        total = sum(sizes.values())
+        candidates = sorted(
+            (self._layers[name] for name in sizes if not self._layers[name].pinned and name != keep),
+            key=lambda layer: layer.last_used,
+        )
+        for layer in candidates:
+            if total <= self.budget_bytes and now - layer.last_used < self.idle_seconds:
+                continue
+            if self.evict(layer.name):
+                total -= sizes[layer.name]
+
+    def start_sweeper(self, interval: float = SWEEP_INTERVAL) -> None:
+        """
+        Sweep from a daemon thread every `interval` seconds, so idle layers are
+        released even when no layer endpoint is being hit
+        """
+        if self._sweeper is not None:
+            return
+
+        def run() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except Exception as exc:  # Keep sweeping; a failed estimate is retried next period
+                    print(f'WARNING: layer sweep failed: {exc}', file=sys.stderr)
+
+        self._sweeper = threading.Thread(target=run, name='layer-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        return [
+            {
+                'name': layer.name,
+                'title': layer.title,
+                'loaded': layer.store is not None,
+                'pinned': layer.pinned,
+                'loads': layer.loads,
+                'bytes': self._sizes.get(layer.name),
+                'idle_seconds': round(now - layer.last_used, 1) if layer.last_used else None,
+            }
+            for layer in self._layers.values()
+        ]
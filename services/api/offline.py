@@ -0,0 +1,73 @@
+"""
+Region packs - tile and asset lists a client can prefetch for offline use
+"""
+
+from typing import Any, Dict, Iterator, List, Tuple
+import math
+
+import numpy as np
+
+from spatial import lonlat_to_mercator
+
+# Latin glyph range; enough for labels in the bundled styles
+GLYPH_RANGES = ('0-255',)
+
+
+def tile_ranges(bounds: Dict[str, float], zoom: int) -> Tuple[int, int, int, int]:
+    """Inclusive (x0, y0, x1, y1) XYZ tile range covering bounds at zoom"""
+    (x0, x1), (y1, y0) = lonlat_to_mercator(
+        np.array([bounds['min_lon'], bounds['max_lon']]),
+        np.array([bounds['min_lat'], bounds['max_lat']]),
+    )
+    scale, last = 2 ** zoom, 2 ** zoom - 1
+    x0, y0, x1, y1 = (min(max(int(math.floor(v * scale)), 0), last) for v in (x0, y0, x1, y1))
+    return x0, y0, x1, y1
+
+
+def tile_count(bounds: Dict[str, float], min_zoom: int, max_zoom: int) -> int:
+    total = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        x0, y0, x1, y1 = tile_ranges(bounds, zoom)
+        total += (x1 - x0 + 1) * (y1 - y0 + 1)
+    return total
+
+
+def fit_max_zoom(bounds: Dict[str, float], min_zoom: int, max_zoom: int, max_tiles: int) -> int:
+    """Highest zoom <= max_zoom whose pack stays within max_tiles (at least min_zoom)"""
+    for zoom in range(max_zoom, min_zoom, -1):
+        if tile_count(bounds, min_zoom, zoom) <= max_tiles:
+            return zoom
+    return min_zoom
+
+
+def tile_urls(template: str, bounds: Dict[str, float], min_zoom: int, max_zoom: int) -> Iterator[str]:
+    """Tile URLs from a {z}/{x}/{y} template, coarsest zoom first"""
+    for zoom in range(min_zoom, max_zoom + 1):
+        x0, y0, x1, y1 = tile_ranges(bounds, zoom)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                yield template.replace('{z}', str(zoom)).replace('{x}', str(x)).replace('{y}', str(y))
+
+
+def style_assets(style: Dict[str, Any]) -> List[str]:
+    """TileJSON documents, sprite sheets and glyph ranges referenced by a style document"""
+    assets = [
+        source['url'] for source in style.get('sources', {}).values()
+        if str(source.get('url', '')).startswith(('http://', 'https://'))
+    ]
+    sprite = style.get('sprite')
+    if isinstance(sprite, str) and sprite:
+        assets += [f'{sprite}{scale}.{ext}' for scale in ('', '@2x') for ext in ('json', 'png')]
+    glyphs = style.get('glyphs')
+    if isinstance(glyphs, str) and glyphs:
+        stacks = set()
+        for layer in style.get('layers', []):
+            font = layer.get('layout', {}).get('text-font')
+            # Only literal font lists; expressions are resolved at render time
+            if isinstance(font, list) and font and all(isinstance(f, str) for f in font):
+                stacks.add(','.join(font))
+        assets += [
+            glyphs.replace('{fontstack}', stack).replace('{range}', glyph_range)
+            for stack in sorted(stacks) for glyph_range in GLYPH_RANGES
+        ]
+    return assets
@@ -0,0 +1,250 @@
+"""
+POI Store - versioned POI dataset with a change log
+Backs delta sync (/api/pois/changes) and live updates (/api/pois/stream)
+"""
+
+from collections import deque
+from dataclasses import asdict, fields
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class PoiStore:
+    """
+    Holds the POI dataset behind a monotonic version number.
+
+    Every add, update or delete bumps the version and appends an entry to a
+    bounded change log, so clients that know the version they last saw can
+    fetch just the delta instead of the whole list.
+
+    Versions count from 0 in every process, so clients get them as tokens
+    prefixed with a per-process epoch (see token/parse_token): a token from
+    an earlier run never passes for a version of this one.
+
+    With `ids` given, `pois` may be a lazily decoding sequence (see
+    snapshot.LazyRecords): single lookups decode one row, and the rest are
+    only decoded when the whole list is first needed. Change log entries
+    hold `serialize(poi)` (asdict by default).
+    """
+
+    def __init__(self, pois: Sequence[Any], max_changes: int = 10000, ids: Optional[List[str]] = None,
+                 serialize: Callable[[Any], dict] = asdict):
+        self._cond = threading.Condition()
+        self._serialize = serialize
+        self.epoch = os.urandom(4).hex()
+        # Values are POIs, or row numbers into self._rows for records not decoded yet
+        self._rows = pois if ids is not None else None
+        self._pois: Dict[str, Any] = (
+            dict(zip(ids, range(len(ids)))) if ids is not None else {poi.id: poi for poi in pois}
+        )
+        self._changes: deque = deque(maxlen=max_changes)
+        self._derived: Dict[str, Tuple[int, Any]] = {}
+        self.version = 0
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._pois)
+
+    def _resolve(self, value: Any) -> Any:
+        return self._rows[value] if isinstance(value, int) else value
+
+    def _values(self) -> List[Any]:
+        """All POIs (caller holds the lock), decoding any rows not read yet"""
+        if self._rows is not None:
+            rows = self._rows.materialize() if hasattr(self._rows, 'materialize') else self._rows
+            self._pois = {k: rows[v] if isinstance(v, int) else v for k, v in self._pois.items()}
+            self._rows = None
+        return list(self._pois.values())
+
+    def all(self) -> List[Any]:
+        """Snapshot of all POIs in insertion order"""
+        with self._cond:
+            return self._values()
+
+    def snapshot(self) -> Tuple[int, List[Any]]:
+        """Version and POI list read under the same lock"""
+        with self._cond:
+            return self.version, self._values()
+
+    def sample(self, n: int) -> List[Any]:
+        """First n POIs, without decoding the rest of a lazily loaded dataset"""
+        with self._cond:
+            return [self._resolve(v) for v in islice(self._pois.values(), n)]
+
+    def get(self, poi_id: str) -> Optional[Any]:
+        with self._cond:
+            return self._resolve(self._pois.get(poi_id))
+
+    def get_many(self, poi_ids: Sequence[str]) -> List[Optional[Any]]:
+        """get() for each id, decoding rows not read yet in one batch"""
+        with self._cond:
+            values = [self._pois.get(poi_id) for poi_id in poi_ids]
+            rows = [v for v in values if isinstance(v, int)]
+            if rows and hasattr(self._rows, 'take'):
+                decoded = dict(zip(rows, self._rows.take(rows)))
+                return [decoded[v] if isinstance(v, int) else v for v in values]
+            return [self._resolve(v) for v in values]
+
+    def upsert(self, poi: Any) -> int:
+        """Add or replace a POI, returns the new dataset version"""
+        with self._cond:
+            op = 'update' if poi.id in self._pois else 'add'
+            self._pois[poi.id] = poi
+            return self._record(op, poi.id, self._serialize(poi))
+
+    def delete(self, poi_id: str) -> Optional[int]:
+        """Remove a POI, returns the new version or None if it did not exist"""
+        with self._cond:
+            if self._pois.pop(poi_id, None) is None:
+                return None
+            return self._record('delete', poi_id, None)
+
+    def _record(self, op: str, poi_id: str, data: Optional[dict]) -> int:
+        self.version += 1
+        self._changes.append({'version': self.version, 'op': op, 'id': poi_id, 'poi': data})
+        self._cond.notify_all()
+        return self.version
+
+    def token(self, version: int) -> str:
+        """Client-facing form of a version: `<epoch>-<version>`"""
+        return f'{self.epoch}-{version}'
+
+    def parse_token(self, token: Optional[str]) -> Optional[int]:
+        """Version in a token from this process, or None (other epoch, plain number, malformed)"""
+        epoch, _, number = (token or '').rpartition('-')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        return int(number)
+
+    def changes_since(self, since: Optional[int]) -> Tuple[int, bool, List[dict]]:
+        """
+        Changes after `since`, collapsed to the latest state per POI.
+
+        Returns (version, reset, changes). `reset` is True when the client is
+        too far behind the retained log, ahead of the server, or holds no
+        version of this process (`since` is None), and must re-fetch the full
+        list.
+        """
+        with self._cond:
+            version = self.version
+            if since is None:
+                return version, True, []
+            if since == version:
+                return version, False, []
+            oldest = self._changes[0]['version'] if self._changes else version + 1
+            if since > version or since < oldest - 1:
+                return version, True, []
+            pending = [c for c in self._changes if c['version'] > since]
+
+        # Collapse repeated edits so each POI appears once with its final state
+        collapsed: Dict[str, dict] = {}
+        for change in pending:
+            previous = collapsed.pop(change['id'], None)
+            if previous is not None and previous['op'] == 'add':
+                if change['op'] == 'delete':
+                    continue  # added and removed inside the window
+                change = dict(change, op='add')
+            collapsed[change['id']] = change
+        return version, False, sorted(collapsed.values(), key=lambda c: c['version'])
+
+    def wait_for_change(self, since: int, timeout: float) -> bool:
+        """Block until the version moves past `since` or the timeout elapses"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.version != since, timeout=timeout)
+
+    def seed(self, name: str, value: Any) -> None:
+        """Install a prebuilt derived value (e.g. from a snapshot) for the current version"""
+        with self._cond:
+            self._derived[name] = (self.version, value)
+
+    def cached(self) -> Dict[str, Any]:
+        """Derived values currently held, whether or not they match the current version"""
+        with self._cond:
+            return {name: value for name, (_, value) in self._derived.items()}
+
+    def derived(self, name: str, build: Callable[[List[Any]], Any]) -> Any:
+        """
+        Cache a value computed from the POI list, rebuilt when the version changes.
+
+        Used for indexes and aggregates so they are computed once per dataset
+        version rather than on every request.
+        """
+        with self._cond:
+            cached = self._derived.get(name)
+            if cached is not None and cached[0] == self.version:
+                return cached[1]
+            version, pois = self.version, self._values()
+        value = build(pois)
+        with self._cond:
+            if self.version == version:
+                self._derived[name] = (version, value)
+        return value
+
+
+class AttributeIndex:
+    """
+    Posting lists of POI positions per attribute value (case-insensitive).
+
+    Positions refer to the POI list the index was built from, so it is cached
+    per dataset version alongside the other derived indexes.
+    """
+
+    FIELDS = ('country', 'category', 'country_code')
+
+    def __init__(self, labels: Dict[str, List[str]], order: Dict[str, np.ndarray],
+                 offsets: Dict[str, np.ndarray], pois: List[Any]):
+        self.labels = labels
+        self.order = order
+        self.offsets = offsets
+        self.pois = pois
+        self._lookup = {field: {v: i for i, v in enumerate(values)} for field, values in labels.items()}
+
+    @classmethod
+    def from_pois(cls, pois: List[Any]) -> 'AttributeIndex':
+        labels, order, offsets = {}, {}, {}
+        for field in cls.FIELDS:
+            values = [str(getattr(poi, field)).lower() for poi in pois]
+            labels[field] = sorted(set(values))
+            lookup = {v: i for i, v in enumerate(labels[field])}
+            codes = np.fromiter((lookup[v] for v in values), dtype=np.int64, count=len(values))
+            order[field] = np.argsort(codes, kind='stable')
+            offsets[field] = np.searchsorted(codes[order[field]], np.arange(len(labels[field]) + 1))
+        return cls(labels, order, offsets, pois)
+
+    def positions(self, field: str, value: str) -> np.ndarray:
+        """Positions of POIs whose `field` equals `value`, in dataset order"""
+        i = self._lookup[field].get(value.lower())
+        if i is None:
+            return self.order[field][:0]
+        return self.order[field][self.offsets[field][i]:self.offsets[field][i + 1]]
+
+    def select(self, field: str, value: str) -> List[Any]:
+        """POIs whose `field` equals `value`, in dataset order"""
+        positions = self.positions(field, value)
+        if hasattr(self.pois, 'take'):  # Lazily decoded snapshot rows, read in one batch
+            return self.pois.take(positions)
+        return [self.pois[i] for i in positions]
+
+
+def read_pois_json(path: str, factory: Any) -> List[Any]:
+    """POIs from a JSON file in /api/pois format; unknown keys are ignored"""
+    known = {field.name for field in fields(factory)}
+    with open(path, encoding='utf-8') as f:
+        return [factory(**{k: v for k, v in record.items() if k in known}) for record in json.load(f)]
+
+
+def load_pois(path: str = '') -> List[Any]:
+    """
+    POIs from a JSON file in /api/pois format, or the app's dataset when no path
+    is given. Used by the command-line tools.
+    """
+    if not path:
+        from app import POI_STORE
+        return POI_STORE.all()
+    from app import POI
+    return read_pois_json(path, POI)
@@ -0,0 +1,97 @@
+"""
+Profiling - an on-demand statistical sampling profiler and a bounded log of
+slow requests with per-phase timings
+"""
+
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+import os
+import sys
+import threading
+import time
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+
+def sample_stacks(duration: float, interval: float = 0.005) -> Dict[str, int]:
+    """
+    Sample every thread's stack for `duration` seconds.
+
+    Returns collapsed stacks ("thread;outer;...;inner" -> samples), the
+    input format of flamegraph.pl and speedscope. Only frame objects are
+    read on each tick, so overhead stays proportional to the sample rate.
+    """
+    me = threading.get_ident()
+    names = {}
+    counts: Counter = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if ident not in names:
+                names = {t.ident: t.name for t in threading.enumerate()}
+            stack.append(names.get(ident, str(ident)))
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return dict(counts)
+
+
+def collapsed_text(counts: Dict[str, int]) -> str:
+    return ''.join(f'{stack} {n}\n' for stack, n in sorted(counts.items(), key=lambda item: -item[1]))
+
+
+class PhaseTimer:
+    """Accumulates wall time per named phase for one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+
+class SlowRequestLog:
+    """Ring buffer of requests slower than `threshold_ms`"""
+
+    def __init__(self, threshold_ms: float, size: int = 200):
+        self.threshold_ms = threshold_ms
+        self._entries: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, method: str, path: str, status: int, timer: PhaseTimer) -> Optional[dict]:
+        total = timer.elapsed_ms()
+        if total < self.threshold_ms:
+            return None
+        entry = {
+            'time': time.time(),
+            'method': method,
+            'path': path,
+            'status': status,
+            'total_ms': round(total, 2),
+            'phases_ms': {name: round(seconds * 1000, 2) for name, seconds in timer.phases.items()},
+        }
+        with self._lock:
+            self._entries.append(entry)
+        return entry
+
+    def entries(self) -> List[dict]:
+        with self._lock:
+            return list(self._entries)
@@ -0,0 +1,373 @@
+"""
+Shared cache - byte values sharded across API replicas (or Redis-protocol
+servers) by consistent hashing, with a local L1 in front and per-key fill
+leases so a cold key is fetched upstream once rather than once per replica
+"""
+
+from bisect import bisect
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlparse
+import hashlib
+import queue
+import socket
+import threading
+import time
+
+import requests
+
+# Points per node on the hash ring; more points spread keys more evenly
+RING_REPLICAS = 128
+# Seconds a shard that failed a request is skipped before being tried again
+SHARD_RETRY_SECONDS = 5.0
+# Poll interval while another replica holds the fill lease for a key
+LEASE_POLL_SECONDS = 0.05
+
+
+class ShardError(Exception):
+    """A cache shard could not be reached or answered with an error"""
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring: each node owns the keys hashing just before its
+    points, so adding or removing a node only moves that node's share
+    """
+
+    def __init__(self, nodes: List[str], replicas: int = RING_REPLICAS):
+        points = sorted((_hash(f'{node}#{i}'), node) for node in nodes for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+        self.size = len(set(nodes))
+
+    def nodes_for(self, key: str) -> Iterator[str]:
+        """Distinct nodes clockwise from the key's position; the first is its owner"""
+        if not self._hashes:
+            return
+        start = bisect(self._hashes, _hash(key))
+        seen = set()
+        for i in range(len(self._nodes)):
+            node = self._nodes[(start + i) % len(self._nodes)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == self.size:
+                    return
+
+
+class MemoryStore:
+    """
+    In-process LRU of byte values with per-entry TTLs and fill leases.
+    Serves as the L1 and as this replica's own shard.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._leases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self.bytes += len(value)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def lease(self, key: str, ttl: float) -> bool:
+        """Take the fill lease for key unless another holder's is still live"""
+        now = time.monotonic()
+        with self._lock:
+            if self._leases.get(key, 0.0) > now:
+                return False
+            self._leases[key] = now + ttl
+            if len(self._leases) > 1024:  # Drop expired leases now and then
+                self._leases = {k: t for k, t in self._leases.items() if t > now}
+            return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._leases.pop(key, None)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[1])
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes}
+
+
+class RedisStore:
+    """
+    Shard on a Redis-protocol server (redis://host:port/db), spoken over
+    plain sockets. Leases are `SET lease:<key> 1 NX PX`.
+    """
+
+    def __init__(self, url: str, timeout: float = 0.5, pool_size: int = 8):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or 'localhost', parsed.port or 6379)
+        self.db = int(parsed.path.strip('/') or 0)
+        self.password = parsed.password
+        self.timeout = timeout
+        self._pool: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command(b'GET', key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._command(b'SET', key, value, b'PX', str(max(1, int(ttl * 1000))))
+
+    def lease(self, key: str, ttl: float) -> bool:
+        return self._command(b'SET', 'lease:' + key, b'1', b'NX', b'PX', str(max(1, int(ttl * 1000)))) is not None
+
+    def release(self, key: str) -> None:
+        self._command(b'DEL', 'lease:' + key)
+
+    def _connect(self) -> Tuple[socket.socket, 'socket.SocketIO']:
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile('rb'))
+        if self.password:
+            self._roundtrip(conn, (b'AUTH', self.password))
+        if self.db:
+            self._roundtrip(conn, (b'SELECT', str(self.db)))
+        return conn
+
+    def _command(self, *args):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = None
+        try:
+            if conn is None:
+                conn = self._connect()
+            reply = self._roundtrip(conn, args)
+        except (OSError, ShardError) as e:
+            if conn is not None:
+                conn[0].close()
+            raise ShardError(f'redis {self.address[0]}:{self.address[1]}: {e}') from e
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn[0].close()
+        return reply
+
+    @staticmethod
+    def _roundtrip(conn, args):
+        sock, reader = conn
+        parts = [a if isinstance(a, bytes) else str(a).encode('utf-8') for a in args]
+        sock.sendall(b''.join(
+            [b'*%d\r\n' % len(parts)] + [b'$%d\r\n%s\r\n' % (len(p), p) for p in parts]
+        ))
+        return RedisStore._read_reply(reader)
+
+    @staticmethod
+    def _read_reply(reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ShardError('connection closed')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise ShardError(rest.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ShardError('connection closed')
+            return data[:-2]
+        if kind == b'*':
+            count = int(rest)
+            return None if count < 0 else [RedisStore._read_reply(reader) for _ in range(count)]
+        raise ShardError(f'unexpected reply {line[:20]!r}')
+
+
+class PeerStore:
+    """Shard held in another API replica's MemoryStore, reached over its internal cache routes"""
+
+    def __init__(self, base_url: str, session: requests.Session, token: str = '', timeout: float = 0.5):
+        self.base_url = base_url.rstrip('/')
+        self.session = session
+        self.headers = {'Authorization': f'Bearer {token}'} if token else {}
+        self.timeout = timeout
+
+    def get(self, key: str) -> Optional[bytes]:
+        resp = self._request('GET', 'entries', key)
+        return resp.content if resp.status_code == 200 else None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._request('PUT', 'entries', key, data=value, params={'ttl': ttl})
+
+    def lease(self, key: str, ttl: float) -> bool:
+        return self._request('POST', 'leases', key, params={'ttl': ttl}).status_code == 200
+
+    def release(self, key: str) -> None:
+        self._request('DELETE', 'leases', key)
+
+    def _request(self, method: str, kind: str, key: str, **kwargs) -> requests.Response:
+        url = f'{self.base_url}/api/internal/cache/{kind}/{quote(key, safe="")}'
+        try:
+            resp = self.session.request(method, url, headers=self.headers, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise ShardError(f'peer {self.base_url}: {e.__class__.__name__}') from e
+        if resp.status_code >= 500 or resp.status_code in (401, 403):
+            raise ShardError(f'peer {self.base_url}: HTTP {resp.status_code}')
+        return resp
+
+
+def open_shard(url: str, session: requests.Session, token: str = ''):
+    """Shard client for a redis:// or http(s):// URL"""
+    scheme = urlparse(url).scheme
+    if scheme == 'redis':
+        return RedisStore(url)
+    if scheme in ('http', 'https'):
+        return PeerStore(url, session, token)
+    raise ValueError(f'Unsupported cache shard URL: {url}')
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Optional[bytes] = None
+
+
+class SharedCache:
+    """
+    Two-tier read-through cache for byte values.
+
+    A key is looked up in the local L1, then in the shard that owns it on the
+    hash ring (its own share is this replica's MemoryStore). On a miss one
+    thread per replica asks the shard for the key's fill lease; the holder
+    runs `fill` and stores the result, others poll the shard until it lands.
+    Unreachable shards are skipped for SHARD_RETRY_SECONDS and their keys
+    fall to the next node on the ring; with no shard left, `fill` runs locally.
+    """
+
+    def __init__(self, shards: Dict[str, object], l1: Optional[MemoryStore] = None,
+                 l1_ttl: float = 30.0, lease_seconds: float = 10.0):
+        self.shards = shards
+        self.ring = HashRing(list(shards))
+        self.l1 = l1
+        self.l1_ttl = l1_ttl
+        self.lease_seconds = lease_seconds
+        self._down: Dict[str, float] = {}
+        self._flights: Dict[str, _Flight] = {}
+        self._guard = threading.Lock()
+        self.counts = dict.fromkeys(('l1_hits', 'shard_hits', 'fills', 'lease_waits', 'shard_errors'), 0)
+
+    def get_or_fill(self, key: str, fill: Callable[[], Optional[bytes]], ttl: float) -> Optional[bytes]:
+        """Cached value for key, else fill() (None results are returned but not cached)"""
+        if self.l1 is not None:
+            value = self.l1.get(key)
+            if value is not None:
+                self._count('l1_hits')
+                return value
+        with self._guard:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:  # Another thread of this replica is already on it
+            if flight.done.wait(self.lease_seconds) and flight.value is not None:
+                return flight.value
+            return fill()
+        try:
+            flight.value = self._shared(key, fill, ttl)
+            if flight.value is not None and self.l1 is not None:
+                self.l1.set(key, flight.value, min(ttl, self.l1_ttl))
+            return flight.value
+        finally:
+            with self._guard:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _shared(self, key: str, fill: Callable[[], Optional[bytes]], ttl: float) -> Optional[bytes]:
+        for node in self.ring.nodes_for(key):
+            if self._down.get(node, 0.0) > time.monotonic():
+                continue
+            shard = self.shards[node]
+            try:
+                return self._through(shard, key, fill, ttl)
+            except ShardError:
+                self._count('shard_errors')
+                self._down[node] = time.monotonic() + SHARD_RETRY_SECONDS
+        self._count('fills')
+        return fill()
+
+    def _through(self, shard, key: str, fill: Callable[[], Optional[bytes]], ttl: float) -> Optional[bytes]:
+        value = shard.get(key)
+        if value is not None:
+            self._count('shard_hits')
+            return value
+        deadline = time.monotonic() + self.lease_seconds
+        leased = shard.lease(key, self.lease_seconds)
+        while not leased and time.monotonic() < deadline:
+            self._count('lease_waits')
+            time.sleep(LEASE_POLL_SECONDS)
+            value = shard.get(key)
+            if value is None:
+                leased = shard.lease(key, self.lease_seconds)
+                # The holder may have stored the value and released between the get and the lease
+                value = shard.get(key) if leased else None
+            if value is not None:
+                if leased:
+                    shard.release(key)
+                self._count('shard_hits')
+                return value
+        # Past the deadline without a lease the holder is stuck or gone; fill anyway
+        self._count('fills')
+        try:
+            value = fill()
+            if value is not None:
+                try:
+                    shard.set(key, value, ttl)
+                except ShardError:
+                    self._count('shard_errors')  # The value is still good
+            return value
+        finally:
+            # Also when fill() raises, so waiters on other replicas retry now instead of at lease expiry
+            if leased:
+                try:
+                    shard.release(key)
+                except ShardError:
+                    self._count('shard_errors')  # The lease expires on its own
+
+    def _count(self, name: str) -> None:
+        with self._guard:
+            self.counts[name] += 1
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._guard:
+            counts = dict(self.counts)
+        return {
+            **counts,
+            'shards': {node: 'down' if self._down.get(node, 0.0) > now else 'up' for node in self.shards},
+            'l1': self.l1.stats() if self.l1 is not None else None,
+        }
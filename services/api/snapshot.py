@@ -0,0 +1,397 @@
+"""
+Binary POI snapshot - columnar arrays, string tables and prebuilt indexes in one
+memory-mapped file, so workers start without parsing or re-indexing the dataset
+
+    python snapshot.py build-snapshot pois.snap [--input pois.json]
+    python snapshot.py inspect pois.snap
+
+Layout: magic, format version, header length, SHA-256 of the payload, a JSON
+header describing every array, then 64-byte aligned little-endian arrays.
+
+Opening only maps the file and reads the header: records are decoded on first
+access and the SHA-256 is checked by `inspect` (or open_snapshot(verify=True)),
+not on every worker start. Indexes derived from app settings (density bins,
+co-location, label placements, footprint levels) are stored with the settings
+they were built with, and only reused when those still match.
+"""
+
+from collections.abc import Sequence
+from dataclasses import fields
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+from declutter import LabelIndex
+from density import DensityIndex, HexLevel
+from footprints import FootprintIndex
+from hilbert import HilbertIndex, record_json
+from poi_store import AttributeIndex, load_pois
+from spatial import SpatialIndex
+
+MAGIC = b'POISNAP\x00'
+FORMAT_VERSION = 1
+ALIGN = 64
+# magic, format version, header length, payload sha256
+PREAMBLE = struct.Struct('<8sII32s')
+
+
+def _align(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _string_table(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """UTF-8 blob plus int64 byte offsets (n + 1 entries)"""
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def _decode_strings(offsets: np.ndarray, blob: bytes, rows: Optional[np.ndarray] = None) -> List[str]:
+    """Entries of a string table (those at `rows` if given)"""
+    starts, ends = (offsets[:-1], offsets[1:]) if rows is None else (offsets[rows], offsets[rows + 1])
+    text = blob.decode('utf-8')
+    if len(text) == len(blob):  # ASCII: byte offsets are character offsets, one decode for the whole table
+        return [text[a:b] for a, b in zip(starts.tolist(), ends.tolist())]
+    return [blob[a:b].decode('utf-8') for a, b in zip(starts.tolist(), ends.tolist())]
+
+
+def _derived_arrays(derived: Dict[str, Any], pois: List[Any]) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """Arrays and header entries for the derived indexes (see app.derived_indexes)"""
+    arrays: Dict[str, np.ndarray] = {}
+    header: Dict[str, Any] = {}
+    for name, value in derived.items():
+        if isinstance(value, DensityIndex):
+            header['density'] = {'countries': value.countries, 'categories': value.categories,
+                                 'sizes': [level.size for level in value.levels]}
+            for level in value.levels:
+                arrays[f'density.{level.zoom}.x'] = level.x.astype('<f8')
+                arrays[f'density.{level.zoom}.y'] = level.y.astype('<f8')
+                arrays[f'density.{level.zoom}.counts'] = level.counts.astype('<u4')
+        elif isinstance(value, LabelIndex):
+            header.setdefault('labels', {})[str(value.spacing_px)] = value.max_zoom
+            arrays[f'labels.{value.spacing_px}.order'] = value.order.astype('<i8')
+            arrays[f'labels.{value.spacing_px}.min_zoom'] = value.min_zoom.astype('<i2')
+        elif isinstance(value, FootprintIndex):
+            # Levels aligned with curve, max_zoom + 1 per footprint; '' where too small to draw
+            keys = {id(levels): key for key, levels in value.by_geometry.items()}
+            header['footprint_max_zoom'] = value.max_zoom
+            arrays['footprints.curve'] = value.curve.astype('<i8')
+            arrays['footprints.keys.offsets'], arrays['footprints.keys.data'] = _string_table(
+                [keys[id(levels)] for levels in value.levels])
+            arrays['footprints.levels.offsets'], arrays['footprints.levels.data'] = _string_table(
+                [(level or b'').decode('utf-8') for levels in value.levels for level in levels])
+        elif name == 'colocation':
+            row = {poi.id: i for i, poi in enumerate(pois)}
+            arrays['colocation.child'] = np.array([row[c] for c in value], dtype='<i8')
+            arrays['colocation.parent'] = np.array([row[p] for p in value.values()], dtype='<i8')
+        else:
+            raise ValueError(f'cannot store derived index {name!r}')
+    return arrays, header
+
+
+def build_snapshot(pois: List[Any], path: str, dataset_version: int = 0,
+                   derived: Optional[Dict[str, Any]] = None, settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Write POIs and their prebuilt indexes to `path` atomically, returns the header.
+    `derived` indexes are stored alongside and reused by readers whose
+    `settings` match.
+    """
+    arrays: Dict[str, np.ndarray] = {}
+    columns = []
+    for field in fields(pois[0]) if pois else []:
+        values = [getattr(poi, field.name) for poi in pois]
+        if field.type in (float, 'float'):
+            arrays[f'col.{field.name}'] = np.asarray(values, dtype='<f8')
+            columns.append([field.name, 'f8'])
+        elif field.type not in (str, 'str'):  # Structured values (e.g. footprints) as JSON text
+            arrays[f'col.{field.name}.offsets'], arrays[f'col.{field.name}.data'] = _string_table(
+                ['' if v is None else json.dumps(v, separators=(',', ':')) for v in values])
+            columns.append([field.name, 'json'])
+        else:
+            arrays[f'col.{field.name}.offsets'], arrays[f'col.{field.name}.data'] = _string_table(
+                ['' if v is None else str(v) for v in values])
+            columns.append([field.name, 'str'])
+
+    spatial = SpatialIndex.from_pois(pois)
+    arrays.update({
+        'spatial.order': spatial.order.astype('<i8'),
+        'spatial.keys': spatial.keys.astype('<f8'),
+        'spatial.lon': spatial.lon.astype('<f8'),
+        'spatial.lat': spatial.lat.astype('<f8'),
+    })
+    attributes = AttributeIndex.from_pois(pois)
+    for field in AttributeIndex.FIELDS:
+        arrays[f'attr.{field}.order'] = attributes.order[field].astype('<i8')
+        arrays[f'attr.{field}.offsets'] = attributes.offsets[field].astype('<i8')
+    # Curve-ordered copy with pre-encoded JSON, so viewport queries slice the mapped file
+    hilbert = HilbertIndex.from_pois(pois, encode=record_json)
+    arrays.update({
+        'hilbert.perm': hilbert.perm.astype('<i8'),
+        'hilbert.keys': hilbert.keys.astype('<i8'),
+        'hilbert.lon': hilbert.lon.astype('<f8'),
+        'hilbert.lat': hilbert.lat.astype('<f8'),
+        'hilbert.json.offsets': hilbert.offsets.astype('<i8'),
+        'hilbert.json.data': np.frombuffer(hilbert.blob, dtype=np.uint8),
+    })
+    derived_arrays, derived_header = _derived_arrays(derived or {}, pois)
+    arrays.update(derived_arrays)
+
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = [offset, array.dtype.str, list(array.shape)]
+        offset = _align(offset + array.nbytes)
+    header = {
+        'format': FORMAT_VERSION,
+        'dataset_version': dataset_version,
+        'count': len(pois),
+        'columns': columns,
+        'band_deg': spatial.band_deg,
+        'attributes': attributes.labels,
+        'hilbert_order': hilbert.order,
+        'derived': derived_header,
+        'derived_settings': settings if derived else None,
+        'arrays': layout,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    header_bytes += b' ' * (_align(PREAMBLE.size + len(header_bytes)) - PREAMBLE.size - len(header_bytes))
+
+    payload = bytearray(offset)
+    for name, array in arrays.items():
+        start = layout[name][0]
+        payload[start:start + array.nbytes] = array.tobytes()
+    digest = hashlib.sha256(payload).digest()
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes), digest))
+        f.write(header_bytes)
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return header
+
+
+class Snapshot:
+    """Read-only view of a snapshot file; arrays are zero-copy views into the mmap"""
+
+    def __init__(self, path: str, verify: bool = False):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < PREAMBLE.size:
+            raise ValueError(f'{path}: not a POI snapshot')
+        magic, version, header_len, digest = PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: not a POI snapshot')
+        if version != FORMAT_VERSION:
+            raise ValueError(f'{path}: snapshot format {version}, expected {FORMAT_VERSION}')
+        self.header = json.loads(bytes(self._mmap[PREAMBLE.size:PREAMBLE.size + header_len]))
+        self._payload = PREAMBLE.size + header_len
+        # A truncated copy is caught cheaply; corrupted bytes need the full checksum
+        end = max((offset + int(np.prod(shape)) * np.dtype(dtype).itemsize
+                   for offset, dtype, shape in self.header['arrays'].values()), default=0)
+        if len(self._mmap) < self._payload + end:
+            raise ValueError(f'{path}: snapshot is truncated')
+        if verify and hashlib.sha256(memoryview(self._mmap)[self._payload:]).digest() != digest:
+            raise ValueError(f'{path}: snapshot checksum mismatch')
+        self.count = self.header['count']
+
+    def array(self, name: str) -> np.ndarray:
+        offset, dtype, shape = self.header['arrays'][name]
+        count = int(np.prod(shape)) if shape else 1
+        return np.frombuffer(self._mmap, dtype=dtype, count=count, offset=self._payload + offset).reshape(shape)
+
+    def strings(self, name: str) -> List[str]:
+        return _decode_strings(self.array(f'col.{name}.offsets'), self.array(f'col.{name}.data').tobytes())
+
+    def records(self, factory: Callable[..., Any]) -> List[Any]:
+        """Decode rows into `factory(**fields)` objects (e.g. the POI dataclass)"""
+        columns = {}
+        for name, kind in self.header['columns']:
+            if kind == 'f8':
+                columns[name] = self.array(f'col.{name}').tolist()
+            elif kind == 'json':
+                columns[name] = [json.loads(v) if v else None for v in self.strings(name)]
+            else:
+                columns[name] = self.strings(name)
+        names = list(columns)
+        return [factory(**dict(zip(names, row))) for row in zip(*columns.values())]
+
+    def lazy_records(self, factory: Callable[..., Any]) -> 'LazyRecords':
+        """Rows as `factory(**fields)` objects decoded on first access"""
+        return LazyRecords(self, factory)
+
+    def spatial_index(self, ids: List[str]) -> SpatialIndex:
+        order = self.array('spatial.order')
+        return SpatialIndex.from_arrays(
+            order, self.array('spatial.keys'), self.array('spatial.lon'), self.array('spatial.lat'),
+            np.array(ids, dtype=object)[order], self.header['band_deg'],
+        )
+
+    def attribute_index(self, pois: List[Any]) -> AttributeIndex:
+        labels = self.header['attributes']
+        return AttributeIndex(
+            labels,
+            {field: self.array(f'attr.{field}.order') for field in labels},
+            {field: self.array(f'attr.{field}.offsets') for field in labels},
+            pois,
+        )
+
+    def hilbert_index(self) -> Optional[HilbertIndex]:
+        """Curve-ordered view, or None for snapshots built before it was added"""
+        if 'hilbert.keys' not in self.header['arrays']:
+            return None
+        return HilbertIndex(
+            self.array('hilbert.perm'), self.array('hilbert.keys'),
+            self.array('hilbert.lon'), self.array('hilbert.lat'), self.header['hilbert_order'],
+            blob=self.array('hilbert.json.data').data, offsets=self.array('hilbert.json.offsets'),
+        )
+
+    def derived_indexes(self, ids: List[str]) -> Dict[str, Any]:
+        """Stored derived indexes by their app cache name (empty for snapshots built without them)"""
+        header = self.header.get('derived') or {}
+        found: Dict[str, Any] = {}
+        if 'density' in header:
+            density = header['density']
+            found['density'] = DensityIndex(density['countries'], density['categories'], [
+                HexLevel(zoom, size, self.array(f'density.{zoom}.x'), self.array(f'density.{zoom}.y'),
+                         self.array(f'density.{zoom}.counts'))
+                for zoom, size in enumerate(density['sizes'])
+            ])
+        if 'colocation.child' in self.header['arrays']:
+            child, parent = self.array('colocation.child').tolist(), self.array('colocation.parent').tolist()
+            found['colocation'] = {ids[c]: ids[p] for c, p in zip(child, parent)}
+        ids_array = np.array(ids, dtype=object)
+        lon, lat = self.array('col.longitude'), self.array('col.latitude')
+        for spacing, max_zoom in header.get('labels', {}).items():
+            order = self.array(f'labels.{spacing}.order')
+            found[f'labels:{spacing}'] = LabelIndex(
+                order, self.array(f'labels.{spacing}.min_zoom'), lon[order], lat[order], ids_array[order],
+                int(spacing), max_zoom,
+            )
+        if 'footprint_max_zoom' in header:
+            max_zoom = header['footprint_max_zoom']
+            keys = _decode_strings(self.array('footprints.keys.offsets'), self.array('footprints.keys.data').tobytes())
+            flat = _decode_strings(self.array('footprints.levels.offsets'),
+                                   self.array('footprints.levels.data').tobytes())
+            levels, by_geometry = [], {}
+            for k, key in enumerate(keys):
+                if key not in by_geometry:
+                    row: List[Optional[bytes]] = []
+                    for text in flat[k * (max_zoom + 1):(k + 1) * (max_zoom + 1)]:
+                        level = text.encode('utf-8') if text else None
+                        # Consecutive identical levels share one bytes object, as in footprint_levels
+                        row.append(row[-1] if row and level == row[-1] else level)
+                    by_geometry[key] = row
+                levels.append(by_geometry[key])
+            found['footprints'] = FootprintIndex(self.array('footprints.curve'), levels, max_zoom, by_geometry)
+        return found
+
+
+class LazyRecords(Sequence):
+    """
+    Snapshot rows as `factory(**fields)` objects, each decoded from the mapped
+    columns on first access, so opening a large snapshot does not build every
+    record up front
+    """
+
+    def __init__(self, snapshot: Snapshot, factory: Callable[..., Any]):
+        self._snapshot = snapshot
+        self._factory = factory
+        self._columns = [
+            (name, kind, snapshot.array(f'col.{name}') if kind == 'f8'
+             else (snapshot.array(f'col.{name}.offsets'), memoryview(snapshot.array(f'col.{name}.data'))))
+            for name, kind in snapshot.header['columns']
+        ]
+        self._rows: List[Any] = [None] * snapshot.count
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        row = self._rows[i]
+        if row is None:
+            row = self._rows[i] = self._decode(np.array([i % len(self._rows)]))[0]
+        return row
+
+    def _decode(self, rows: np.ndarray) -> List[Any]:
+        columns = {}
+        for name, kind, column in self._columns:
+            if kind == 'f8':
+                columns[name] = column[rows].tolist()
+                continue
+            offsets, data = column
+            if len(rows) * 16 >= len(self._rows):  # Decoding the whole column once beats per-value copies
+                texts = _decode_strings(offsets, data.tobytes(), rows)
+            else:
+                texts = [bytes(data[a:b]).decode('utf-8') for a, b in zip(offsets[rows].tolist(),
+                                                                          offsets[rows + 1].tolist())]
+            columns[name] = [json.loads(t) if t else None for t in texts] if kind == 'json' else texts
+        names = list(columns)
+        return [self._factory(**dict(zip(names, row))) for row in zip(*columns.values())]
+
+    def take(self, positions) -> List[Any]:
+        """Rows at `positions`, decoding the ones not read yet a column at a time"""
+        positions = np.asarray(positions, dtype=np.int64)
+        rows = self._rows
+        missing = np.unique(positions[np.fromiter((rows[i] is None for i in positions.tolist()), dtype=bool,
+                                                  count=len(positions))])
+        for i, row in zip(missing.tolist(), self._decode(missing)):
+            rows[i] = row
+        return [rows[i] for i in positions.tolist()]
+
+    def materialize(self) -> List[Any]:
+        """Every row, decoding the ones not read yet"""
+        self.take(np.arange(len(self._rows)))
+        return self._rows
+
+
+def is_snapshot(path: str) -> bool:
+    """True if the file starts with the snapshot magic"""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def open_snapshot(path: str, verify: bool = False) -> Snapshot:
+    """Open a snapshot file; `verify` also checks the payload SHA-256 (reads the whole file)"""
+    return Snapshot(path, verify=verify)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build or inspect POI snapshots")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build-snapshot', help="Compile the POI dataset into a snapshot file")
+    build.add_argument('output')
+    build.add_argument('--input', default='', help="POI JSON file in /api/pois format (default: built-in dataset)")
+    build.add_argument('--no-derived', action='store_true',
+                       help="Skip the density, co-location, label and footprint indexes (workers build them at startup)")
+    inspect = commands.add_parser('inspect', help="Validate a snapshot and print its header")
+    inspect.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build-snapshot':
+        pois = load_pois(args.input)
+        derived, settings = None, None
+        if not args.no_derived:
+            from app import DERIVED_SETTINGS, derived_indexes
+            derived, settings = derived_indexes(pois), DERIVED_SETTINGS
+        header = build_snapshot(pois, args.output, derived=derived, settings=settings)
+        print(f"Wrote {header['count']} POIs to {args.output} ({os.path.getsize(args.output):,} bytes)")
+    else:
+        snapshot = open_snapshot(args.path, verify=True)
+        header = dict(snapshot.header, arrays=len(snapshot.header['arrays']))
+        print(json.dumps(header, ensure_ascii=False, indent=2))
+        print("Checksum OK", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
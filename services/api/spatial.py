@@ -0,0 +1,152 @@
+"""
+Spatial helpers - projections and column arrays shared by the POI indexes
+"""
+
+from typing import Any, List, Tuple
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Web Mercator latitude limit; points beyond it are clamped before projecting
+MAX_MERCATOR_LAT = 85.0511287798
+
+
+def lonlat_to_mercator(lon: np.ndarray, lat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Project degrees to normalized Web Mercator (x, y in 0..1, y down)"""
+    lat = np.clip(lat, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+    sin_lat = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def mercator_to_lonlat(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Inverse of lonlat_to_mercator"""
+    lon = np.asarray(x, dtype=np.float64) * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * np.asarray(y, dtype=np.float64)))))
+    return lon, lat
+
+
+def poi_columns(pois: List[Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Longitude and latitude columns for a POI list"""
+    lon = np.fromiter((poi.longitude for poi in pois), dtype=np.float64, count=len(pois))
+    lat = np.fromiter((poi.latitude for poi in pois), dtype=np.float64, count=len(pois))
+    return lon, lat
+
+
+def encode_labels(values: List[str]) -> Tuple[List[str], np.ndarray]:
+    """Dictionary-encode strings into a sorted label table and int codes"""
+    labels = sorted(set(values))
+    lookup = {label: i for i, label in enumerate(labels)}
+    codes = np.fromiter((lookup[v] for v in values), dtype=np.int32, count=len(values))
+    return labels, codes
+
+
+def haversine_km(lon1: np.ndarray, lat1: np.ndarray, lon2: np.ndarray, lat2: np.ndarray) -> np.ndarray:
+    """Great-circle distance in km, vectorized over broadcastable arrays"""
+    lon1, lat1, lon2, lat2 = (np.radians(a) for a in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _expand_ranges(lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Flatten [lo, hi) ranges into (owner, position) pairs without a Python loop"""
+    counts = np.maximum(hi - lo, 0)
+    owner = np.repeat(np.arange(len(lo)), counts)
+    starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+    return owner, starts + np.arange(counts.sum())
+
+
+class SpatialIndex:
+    """
+    Latitude-band index for radius queries.
+
+    Points are bucketed into bands of `band_deg` latitude and sorted by
+    longitude inside each band, so one band lookup is a pair of binary
+    searches. Queries run vectorized over whole batches of query points.
+    """
+
+    # Keys are band * _BAND_STRIDE + (lon + 180); the stride just has to exceed 360
+    _BAND_STRIDE = 1000.0
+
+    def __init__(self, lon: np.ndarray, lat: np.ndarray, band_deg: float = 1.0):
+        self.band_deg = band_deg
+        band = np.floor((lat + 90.0) / band_deg)
+        keys = band * self._BAND_STRIDE + (lon + 180.0)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+        self.lon = lon[self.order]
+        self.lat = lat[self.order]
+        self.ids = None
+
+    @classmethod
+    def from_pois(cls, pois: List[Any], band_deg: float = 1.0) -> 'SpatialIndex':
+        index = cls(*poi_columns(pois), band_deg=band_deg)
+        index.ids = np.array([poi.id for poi in pois], dtype=object)[index.order]
+        return index
+
+    @classmethod
+    def from_arrays(cls, order: np.ndarray, keys: np.ndarray, lon: np.ndarray, lat: np.ndarray,
+                    ids: np.ndarray, band_deg: float) -> 'SpatialIndex':
+        """Wrap prebuilt (e.g. memory-mapped) arrays without re-sorting"""
+        index = cls.__new__(cls)
+        index.band_deg = band_deg
+        index.order, index.keys, index.lon, index.lat, index.ids = order, keys, lon, lat, ids
+        return index
+
+    def candidates(self, lon: np.ndarray, lat: np.ndarray, radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(query, entry) pairs whose bounding envelope may lie within radius_km"""
+        angle = radius_km / EARTH_RADIUS_KM
+        dlat = np.degrees(angle)
+        # Exact longitude half-width of a spherical cap; 180 when it covers a pole
+        cos_lat = np.cos(np.radians(lat))
+        ratio = np.sin(min(angle, np.pi / 2)) / np.maximum(cos_lat, 1e-12)
+        dlon = np.where((ratio < 1.0) & (angle < np.pi / 2), np.degrees(np.arcsin(np.minimum(ratio, 1.0))), 180.0)
+        full = dlon >= 180.0
+
+        first = np.floor((np.maximum(lat - dlat, -90.0) + 90.0) / self.band_deg)
+        last = np.floor((np.minimum(lat + dlat, 90.0) + 90.0) / self.band_deg)
+        owners, entries = [], []
+        for offset in range(int((last - first).max(initial=-1)) + 1):
+            band = first + offset
+            active = band <= last
+            for shift in (0.0, -360.0, 360.0):
+                west = lon - dlon + shift
+                east = lon + dlon + shift
+                if shift:
+                    # Only points whose window wraps the antimeridian need a second pass
+                    wraps = (lon - dlon < -180.0) if shift > 0 else (lon + dlon > 180.0)
+                    active_shift = active & wraps & ~full
+                else:
+                    active_shift = active
+                    west = np.where(full, -180.0, west)
+                    east = np.where(full, 180.0, east)
+                rows = np.nonzero(active_shift)[0]
+                if not len(rows):
+                    continue
+                base = band[rows] * self._BAND_STRIDE + 180.0
+                lo = np.searchsorted(self.keys, base + np.maximum(west[rows], -180.0), side='left')
+                hi = np.searchsorted(self.keys, base + np.minimum(east[rows], 180.0), side='right')
+                owner, entry = _expand_ranges(lo, hi)
+                owners.append(rows[owner])
+                entries.append(entry)
+        if not owners:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        return np.concatenate(owners), np.concatenate(entries)
+
+    def within(self, lon: np.ndarray, lat: np.ndarray, radius_km: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        All (query, entry, distance_km) matches within radius_km.
+
+        Entries are positions in the index's sorted order (see `ids`/`order`).
+        Results are sorted by query and then by distance.
+        """
+        owner, entry = self.candidates(lon, lat, radius_km)
+        dist = haversine_km(lon[owner], lat[owner], self.lon[entry], self.lat[entry])
+        hit = dist <= radius_km
+        owner, entry, dist = owner[hit], entry[hit], dist[hit]
+        order = np.lexsort((dist, owner))
+        return owner[order], entry[order], dist[order]
@@ -0,0 +1,88 @@
+"""
+Style proxy - fetches TileServer GL styles once, rewrites their URLs to the
+public tileserver endpoint and serves them from memory with content-hash ETags
+"""
+
+from typing import Any, Dict, Optional, Tuple
+import hashlib
+import json
+import threading
+import time
+
+import requests
+
+from shared_cache import SharedCache
+
+
+def rewrite_urls(value: Any, internal: str, public: str) -> Any:
+    """Replace the internal tileserver base URL with the public one in every string"""
+    if isinstance(value, str):
+        return public + value[len(internal):] if value.startswith(internal) else value
+    if isinstance(value, list):
+        return [rewrite_urls(v, internal, public) for v in value]
+    if isinstance(value, dict):
+        return {k: rewrite_urls(v, internal, public) for k, v in value.items()}
+    return value
+
+
+class StyleProxy:
+    """In-memory cache of rewritten style documents, refreshed after `ttl` seconds"""
+
+    def __init__(self, session: requests.Session, internal_url: str, public_url: str, ttl: float = 300.0,
+                 shared: Optional[SharedCache] = None):
+        self.session = session
+        self.shared = shared
+        self.internal_url = internal_url.rstrip('/')
+        self.public_url = public_url.rstrip('/')
+        self.ttl = ttl
+        self._cache: Dict[str, Tuple[float, bytes, str]] = {}
+        self._locks: Dict[str, threading.Lock] = {}  # Only for styles the tileserver has served
+        self._guard = threading.Lock()
+
+    def get(self, name: str) -> Optional[Tuple[bytes, str]]:
+        """(body, etag) for a style, or None if the tileserver does not have it"""
+        cached = self._cache.get(name)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            return cached[1], cached[2]
+        with self._guard:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:  # One upstream fetch per style, concurrent callers wait for it
+            cached = self._cache.get(name)
+            if cached and time.monotonic() - cached[0] < self.ttl:
+                return cached[1], cached[2]
+            try:
+                fetched = self._fetch(name)
+            except requests.RequestException:
+                if cached:  # Serve stale rather than fail while the tileserver is down
+                    return cached[1], cached[2]
+                self._forget(name)
+                raise
+            if fetched is None:
+                self._cache.pop(name, None)
+                self._forget(name)
+                return None
+            self._cache[name] = (time.monotonic(), *fetched)
+            return fetched
+
+    def _forget(self, name: str) -> None:
+        """Drop the lock of a name the tileserver did not serve, so unknown names do not accumulate"""
+        with self._guard:
+            self._locks.pop(name, None)
+
+    def _fetch(self, name: str) -> Optional[Tuple[bytes, str]]:
+        if self.shared is None:
+            body = self._download(name)
+        else:  # Replicas share one upstream fetch per style
+            body = self.shared.get_or_fill(f'style:{name}', lambda: self._download(name), self.ttl)
+        if body is None:
+            return None
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        return body, etag
+
+    def _download(self, name: str) -> Optional[bytes]:
+        resp = self.session.get(f'{self.internal_url}/styles/{name}/style.json', timeout=10)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        style = rewrite_urls(resp.json(), self.internal_url, self.public_url)
+        return json.dumps(style, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
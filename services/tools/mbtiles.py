@@ -0,0 +1,158 @@
+"""
+MBTiles helpers shared by the tile tools - connections, tile coordinates,
+metadata and a minimal vector tile (protobuf) reader
+"""
+
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import gzip
+import math
+import sqlite3
+import zlib
+
+COLUMNS_PER_TASK = 64  # Tile columns per worker task in the parallel tools
+TASKS_IN_FLIGHT = 2  # Pending worker tasks per worker; bounds results held in memory
+
+
+def connect(path: str, readonly: bool = True) -> sqlite3.Connection:
+    """Open an MBTiles file; read-only connections never create or lock for writing"""
+    if readonly:
+        return sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    return sqlite3.connect(path)
+
+
+def read_metadata(conn: sqlite3.Connection) -> Dict[str, str]:
+    return dict(conn.execute('SELECT name, value FROM metadata'))
+
+
+def tms_to_xyz(z: int, row: int) -> int:
+    """MBTiles stores TMS rows (origin bottom-left); XYZ rows start at the top"""
+    return (1 << z) - 1 - row
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(west, south, east, north) in degrees for an XYZ tile"""
+    n = 1 << z
+
+    def lat(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def lonlat_to_tile(lon: float, lat: float, z: int) -> Tuple[int, int]:
+    """XYZ tile containing a point, clamped to the tile grid"""
+    n = 1 << z
+    lat = max(min(lat, 85.0511287798), -85.0511287798)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def decompress(data: bytes) -> bytes:
+    """Undo gzip/zlib tile compression; other data is returned unchanged"""
+    if data[:2] == b'\x1f\x8b':
+        return gzip.decompress(data)
+    if data[:1] == b'\x78':
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            pass
+    return data
+
+
+def _varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def iter_fields(buf: bytes) -> Iterator[Tuple[int, int, object]]:
+    """
+    Yield (field number, wire type, value) for a protobuf message.
+
+    Length-delimited values are returned as memoryview slices, so walking a
+    tile does not copy layer payloads.
+    """
+    view = memoryview(buf)
+    pos, end = 0, len(buf)
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(buf, pos)
+        elif wire == 1:
+            value, pos = view[pos:pos + 8], pos + 8
+        elif wire == 2:
+            length, pos = _varint(buf, pos)
+            value, pos = view[pos:pos + length], pos + length
+        elif wire == 5:
+            value, pos = view[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f'Unsupported protobuf wire type {wire}')
+        yield field, wire, value
+
+
+# Mapbox Vector Tile field numbers
+TILE_LAYERS = 3
+LAYER_NAME = 1
+LAYER_FEATURES = 2
+
+
+def layer_sizes(tile: bytes) -> Dict[str, Tuple[int, int]]:
+    """Per-layer (uncompressed bytes, feature count) for a decoded vector tile"""
+    sizes: Dict[str, Tuple[int, int]] = {}
+    for field, _, layer in iter_fields(tile):
+        if field != TILE_LAYERS:
+            continue
+        name: Optional[str] = None
+        features = 0
+        for layer_field, _, value in iter_fields(layer):
+            if layer_field == LAYER_NAME:
+                name = bytes(value).decode('utf-8')
+            elif layer_field == LAYER_FEATURES:
+                features += 1
+        size, count = sizes.get(name or '', (0, 0))
+        sizes[name or ''] = (size + len(layer), count + features)
+    return sizes
+
+
+def zoom_levels(conn: sqlite3.Connection) -> List[int]:
+    return [z for (z,) in conn.execute('SELECT DISTINCT zoom_level FROM tiles ORDER BY zoom_level')]
+
+
+def plan_tasks(zooms: List[int], bbox: Optional[Sequence[float]] = None) -> List[Tuple[int, int, int, int, int]]:
+    """Split each zoom's tile window into (z, x0, x1, row0, row1) column ranges for workers"""
+    tasks = []
+    for z in zooms:
+        n = 1 << z
+        if bbox:
+            x0, y0 = lonlat_to_tile(bbox[0], bbox[3], z)
+            x1, y1 = lonlat_to_tile(bbox[2], bbox[1], z)
+        else:
+            x0, y0, x1, y1 = 0, 0, n - 1, n - 1
+        row0, row1 = tms_to_xyz(z, y1), tms_to_xyz(z, y0)
+        for start in range(x0, x1 + 1, COLUMNS_PER_TASK):
+            tasks.append((z, start, min(start + COLUMNS_PER_TASK - 1, x1), row0, row1))
+    return tasks
+
+
+def bounded_map(pool: Executor, fn: Callable, tasks: Iterable, window: int) -> Iterator:
+    """Ordered results of fn(task) with at most `window` tasks submitted at once
+
+    Executor.map submits every task up front, so finished results queue up in
+    memory whenever the consumer (the sqlite writer) falls behind the workers
+    """
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(fn, task))
+    while pending:
+        yield pending.popleft().result()
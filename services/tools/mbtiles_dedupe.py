@@ -0,0 +1,124 @@
+"""
+MBTiles deduplication - rewrite a flat `tiles` table into the map/images schema
+so byte-identical tiles (open ocean, tundra, empty ice) are stored once
+
+    python mbtiles_dedupe.py data/canada.mbtiles data/canada-dedup.mbtiles
+
+The output keeps a `tiles` view over map JOIN images, which TileServer GL and
+other MBTiles readers query exactly like the original table.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Tuple
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+from mbtiles import TASKS_IN_FLIGHT, bounded_map, connect, plan_tasks, read_metadata, zoom_levels
+
+# Same table/column names as the common map/images layout, but with integer
+# tile ids: images is keyed by its rowid and map is a clustered WITHOUT ROWID
+# table, so neither needs a separate index
+SCHEMA = '''
+    CREATE TABLE metadata (name TEXT, value TEXT);
+    CREATE TABLE map (
+        zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id INTEGER,
+        PRIMARY KEY (zoom_level, tile_column, tile_row)
+    ) WITHOUT ROWID;
+    CREATE TABLE images (tile_id INTEGER PRIMARY KEY, tile_data BLOB);
+    CREATE VIEW tiles AS
+        SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+               map.tile_row AS tile_row, images.tile_data AS tile_data
+        FROM map JOIN images ON images.tile_id = map.tile_id;
+'''
+
+
+def hash_task(path: str, task: Tuple[int, int, int, int, int]) -> Tuple[list, Dict[bytes, bytes], int]:
+    """
+    Worker: hash one column range.
+
+    Returns map rows, the distinct images seen in this range (so repeated
+    tiles cross the process boundary once per task) and the raw byte total.
+    """
+    z, x0, x1, row0, row1 = task
+    conn = connect(path)
+    rows = conn.execute(
+        'SELECT tile_column, tile_row, tile_data FROM tiles '
+        'WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?',
+        (z, x0, x1, row0, row1),
+    )
+    entries, images, total = [], {}, 0
+    for x, row, data in rows:
+        digest = hashlib.md5(data, usedforsecurity=False).digest()
+        entries.append((z, x, row, digest))
+        images.setdefault(digest, data)
+        total += len(data)
+    conn.close()
+    return entries, images, total
+
+
+def dedupe(source: str, target: str, workers: int = 0) -> Dict[str, int]:
+    """Write the deduplicated copy, returns tile/image/byte statistics"""
+    src = connect(source)
+    metadata = read_metadata(src)
+    zooms = zoom_levels(src)
+    src.close()
+
+    if os.path.exists(target):
+        os.remove(target)
+    dst = connect(target, readonly=False)
+    dst.executescript('PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;' + SCHEMA)
+
+    tasks = plan_tasks(zooms)
+    stats = {'tiles': 0, 'images': 0, 'tile_bytes': 0, 'image_bytes': 0}
+    ids: Dict[bytes, int] = {}  # Content digest -> images.tile_id
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = bounded_map(pool, partial(hash_task, source), tasks, window=workers * TASKS_IN_FLIGHT)
+        for entries, images, total in results:
+            fresh = []
+            for digest, data in images.items():
+                if digest not in ids:
+                    ids[digest] = len(ids) + 1
+                    fresh.append((ids[digest], data))
+            with dst:
+                dst.executemany('INSERT INTO images VALUES (?, ?)', fresh)
+                dst.executemany('INSERT INTO map VALUES (?, ?, ?, ?)',
+                                ((z, x, row, ids[digest]) for z, x, row, digest in entries))
+            stats['tiles'] += len(entries)
+            stats['images'] += len(fresh)
+            stats['tile_bytes'] += total
+            stats['image_bytes'] += sum(len(data) for _, data in fresh)
+
+    with dst:
+        dst.executemany('INSERT INTO metadata VALUES (?, ?)', metadata.items())
+    dst.execute('VACUUM')
+    dst.close()
+    return stats
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Deduplicate identical tiles in an MBTiles file")
+    parser.add_argument('source')
+    parser.add_argument('target')
+    parser.add_argument('--workers', type=int, default=0, help="Hashing processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    stats = dedupe(args.source, args.target, args.workers)
+    before, after = os.path.getsize(args.source), os.path.getsize(args.target)
+    mb = 1024 * 1024
+    print(f"{stats['tiles']:,} tiles -> {stats['images']:,} unique images "
+          f"({100 * (1 - stats['images'] / max(stats['tiles'], 1)):.1f}% duplicates)")
+    print(f"Tile data: {stats['tile_bytes'] / mb:.1f} MB -> {stats['image_bytes'] / mb:.1f} MB")
+    print(f"File size: {before / mb:.1f} MB -> {after / mb:.1f} MB "
+          f"(saved {(before - after) / mb:.1f} MB, {100 * (1 - after / max(before, 1)):.1f}%) "
+          f"in {time.time() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
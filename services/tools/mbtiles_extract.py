@@ -0,0 +1,215 @@
+"""
+MBTiles extraction - copy a bbox, polygon and/or zoom range of an existing
+MBTiles file into a new, smaller one (e.g. a regional image instead of all Canada)
+
+    python mbtiles_extract.py data/canada.mbtiles data/ontario.mbtiles --bbox=-95,41,-74,57
+    python mbtiles_extract.py data/canada.mbtiles data/bc.mbtiles --polygon bc.geojson --maxzoom 10
+    python mbtiles_extract.py data/canada.mbtiles data/overview.mbtiles --maxzoom 6
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterator, List, Optional, Sequence, Tuple
+import argparse
+import json
+import os
+import sys
+import time
+
+from mbtiles import TASKS_IN_FLIGHT, bounded_map, connect, plan_tasks, read_metadata, tile_bounds, tms_to_xyz, zoom_levels
+
+Ring = List[Tuple[float, float]]
+Polygon = List[Ring]  # Outer ring followed by holes
+
+INSERT_BATCH = 5000
+
+
+def load_polygons(path: str) -> List[Polygon]:
+    """Polygons from a GeoJSON Polygon/MultiPolygon, Feature or FeatureCollection"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    geometries = []
+    if data.get('type') == 'FeatureCollection':
+        geometries = [feature['geometry'] for feature in data['features']]
+    elif data.get('type') == 'Feature':
+        geometries = [data['geometry']]
+    else:
+        geometries = [data]
+    polygons = []
+    for geometry in geometries:
+        if geometry['type'] == 'Polygon':
+            polygons.append([[tuple(p[:2]) for p in ring] for ring in geometry['coordinates']])
+        elif geometry['type'] == 'MultiPolygon':
+            polygons.extend([[tuple(p[:2]) for p in ring] for ring in polygon] for polygon in geometry['coordinates'])
+        else:
+            raise ValueError(f"Unsupported geometry type {geometry['type']}")
+    return polygons
+
+
+def _point_in_ring(x: float, y: float, ring: Ring) -> bool:
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+    return inside
+
+
+def _segment_hits_box(x1: float, y1: float, x2: float, y2: float, box: Sequence[float]) -> bool:
+    """Liang-Barsky clip test of a segment against (west, south, east, north)"""
+    west, south, east, north = box
+    t0, t1 = 0.0, 1.0
+    dx, dy = x2 - x1, y2 - y1
+    for p, q in ((-dx, x1 - west), (dx, east - x1), (-dy, y1 - south), (dy, north - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                return False
+    return True
+
+
+def tile_intersects(box: Sequence[float], polygons: List[Polygon]) -> bool:
+    """True when a tile's bounds touch any polygon (edge crossing or containment)"""
+    cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+    for polygon in polygons:
+        for ring in polygon:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+                if _segment_hits_box(x1, y1, x2, y2, box):
+                    return True
+        if _point_in_ring(cx, cy, polygon[0]) and not any(_point_in_ring(cx, cy, hole) for hole in polygon[1:]):
+            return True
+    return False
+
+
+def read_task(path: str, task: Tuple[int, int, int, int, int], polygons: Optional[List[Polygon]]) -> list:
+    """Worker: read one column range, dropping tiles outside the polygons"""
+    z, x0, x1, row0, row1 = task
+    conn = connect(path)
+    rows = conn.execute(
+        'SELECT tile_column, tile_row, tile_data FROM tiles '
+        'WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?',
+        (z, x0, x1, row0, row1),
+    )
+    tiles = [
+        (z, x, row, data) for x, row, data in rows
+        if polygons is None or tile_intersects(tile_bounds(z, x, tms_to_xyz(z, row)), polygons)
+    ]
+    conn.close()
+    return tiles
+
+
+def _polygon_bbox(polygons: List[Polygon]) -> Tuple[float, float, float, float]:
+    points = [p for polygon in polygons for p in polygon[0]]
+    return (min(p[0] for p in points), min(p[1] for p in points),
+            max(p[0] for p in points), max(p[1] for p in points))
+
+
+def _batches(results: Iterator[list]) -> Iterator[list]:
+    batch = []
+    for tiles in results:
+        batch.extend(tiles)
+        if len(batch) >= INSERT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def extract(source: str, target: str, bbox: Optional[Sequence[float]] = None,
+            polygons: Optional[List[Polygon]] = None, minzoom: Optional[int] = None,
+            maxzoom: Optional[int] = None, workers: int = 0) -> int:
+    """Copy the selected tiles into a new MBTiles file, returns the tile count"""
+    if polygons:
+        poly_box = _polygon_bbox(polygons)
+        bbox = poly_box if not bbox else (max(bbox[0], poly_box[0]), max(bbox[1], poly_box[1]),
+                                          min(bbox[2], poly_box[2]), min(bbox[3], poly_box[3]))
+    src = connect(source)
+    metadata = read_metadata(src)
+    zooms = [z for z in zoom_levels(src)
+             if (minzoom is None or z >= minzoom) and (maxzoom is None or z <= maxzoom)]
+    src.close()
+    if not zooms:
+        raise ValueError('No zoom levels selected')
+
+    if os.path.exists(target):
+        os.remove(target)
+    dst = connect(target, readonly=False)
+    dst.executescript('''
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+    ''')
+
+    tasks = plan_tasks(zooms, bbox)
+    count = 0
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = bounded_map(pool, partial(read_task, source, polygons=polygons), tasks,
+                              window=workers * TASKS_IN_FLIGHT)
+        for batch in _batches(results):
+            with dst:  # One transaction per batch
+                dst.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)', batch)
+            count += len(batch)
+
+    # Index after the bulk load; building it once is cheaper than maintaining it per insert
+    dst.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+    metadata.update(_rewrite_metadata(metadata, bbox, zooms))
+    with dst:
+        dst.executemany('INSERT INTO metadata VALUES (?, ?)', metadata.items())
+    dst.execute('VACUUM')
+    dst.close()
+    return count
+
+
+def _rewrite_metadata(metadata: dict, bbox: Optional[Sequence[float]], zooms: List[int]) -> dict:
+    """bounds/center/minzoom/maxzoom (and vector_layers zooms) for the extract"""
+    updated = {'minzoom': str(zooms[0]), 'maxzoom': str(zooms[-1])}
+    if bbox:
+        if 'bounds' in metadata:
+            old = [float(v) for v in metadata['bounds'].split(',')]
+            bbox = (max(bbox[0], old[0]), max(bbox[1], old[1]), min(bbox[2], old[2]), min(bbox[3], old[3]))
+        updated['bounds'] = ','.join(f'{v:.6f}' for v in bbox)
+        updated['center'] = f'{(bbox[0] + bbox[2]) / 2:.6f},{(bbox[1] + bbox[3]) / 2:.6f},{zooms[0]}'
+    if 'json' in metadata:
+        info = json.loads(metadata['json'])
+        for layer in info.get('vector_layers', []):
+            layer['minzoom'] = max(layer.get('minzoom', zooms[0]), zooms[0])
+            layer['maxzoom'] = min(layer.get('maxzoom', zooms[-1]), zooms[-1])
+        updated['json'] = json.dumps(info, separators=(',', ':'))
+    return updated
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Extract a region/zoom range from an MBTiles file")
+    parser.add_argument('source')
+    parser.add_argument('target')
+    parser.add_argument('--bbox', help="west,south,east,north in degrees (use --bbox=-95,41,... for negative values)")
+    parser.add_argument('--polygon', help="GeoJSON file with the (Multi)Polygon to keep")
+    parser.add_argument('--minzoom', type=int)
+    parser.add_argument('--maxzoom', type=int)
+    parser.add_argument('--workers', type=int, default=0, help="Reader processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    bbox = None
+    if args.bbox:
+        bbox = tuple(float(v) for v in args.bbox.split(','))
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            parser.error('--bbox must be west,south,east,north')
+    polygons = load_polygons(args.polygon) if args.polygon else None
+
+    started = time.time()
+    count = extract(args.source, args.target, bbox, polygons, args.minzoom, args.maxzoom, args.workers)
+    size = os.path.getsize(args.target)
+    print(f"Wrote {count:,} tiles to {args.target} ({size / 1024 / 1024:.1f} MB) in {time.time() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
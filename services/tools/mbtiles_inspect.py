@@ -0,0 +1,175 @@
+"""
+MBTiles inspection - per-zoom tile counts, size histograms, the largest tiles
+and per-layer byte attribution, to trace slow map areas back to their data
+
+    python mbtiles_inspect.py data/canada.mbtiles
+    python mbtiles_inspect.py data/canada.mbtiles --top 50 --json > report.json
+    python mbtiles_inspect.py data/canada.mbtiles --no-decode   # sizes only, much faster
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List
+import argparse
+import heapq
+import json
+import os
+import sys
+
+from mbtiles import connect, decompress, layer_sizes, read_metadata, tile_bounds, tms_to_xyz, zoom_levels
+
+# Histogram buckets are powers of two: bucket k holds sizes in [2^(k-1), 2^k)
+HISTOGRAM_BUCKETS = 24
+
+
+def scan_zoom(path: str, zoom: int, top: int, decode: bool) -> Dict[str, Any]:
+    """Single streaming pass over one zoom level"""
+    conn = connect(path)
+    count = compressed = uncompressed = 0
+    histogram = [0] * HISTOGRAM_BUCKETS
+    largest: List[tuple] = []
+    layers: Dict[str, List[int]] = {}
+    column = 'tile_data' if decode else 'length(tile_data)'
+    rows = conn.execute(f'SELECT tile_column, tile_row, {column} FROM tiles WHERE zoom_level = ?', (zoom,))
+    for x, row, data in rows:
+        size = len(data) if decode else data
+        count += 1
+        compressed += size
+        histogram[min(size.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        entry = (size, x, row)
+        if len(largest) < top:
+            heapq.heappush(largest, entry)
+        elif largest and entry > largest[0]:  # top=0 keeps no largest tiles
+            heapq.heapreplace(largest, entry)
+        if decode:
+            raw = decompress(data)
+            uncompressed += len(raw)
+            try:
+                sizes = layer_sizes(raw)
+            except (ValueError, IndexError):
+                sizes = {'<undecodable>': (len(raw), 0)}
+            for name, (nbytes, features) in sizes.items():
+                totals = layers.setdefault(name, [0, 0, 0])
+                totals[0] += nbytes
+                totals[1] += features
+                totals[2] += 1
+    conn.close()
+    return {
+        'zoom': zoom,
+        'count': count,
+        'bytes': compressed,
+        'uncompressed_bytes': uncompressed if decode else None,
+        'histogram': histogram,
+        'largest': sorted(largest, reverse=True),
+        'layers': layers,
+    }
+
+
+def inspect(path: str, top: int = 20, decode: bool = True, workers: int = 0) -> Dict[str, Any]:
+    """Scan every zoom level (in parallel when workers > 1) and merge the results"""
+    conn = connect(path)
+    metadata = read_metadata(conn)
+    zooms = zoom_levels(conn)
+    conn.close()
+
+    workers = workers or min(len(zooms), os.cpu_count() or 1) or 1
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            per_zoom = list(pool.map(scan_zoom, [path] * len(zooms), zooms, [top] * len(zooms), [decode] * len(zooms)))
+    else:
+        per_zoom = [scan_zoom(path, zoom, top, decode) for zoom in zooms]
+
+    largest = heapq.nlargest(top, (
+        (size, zoom['zoom'], x, row) for zoom in per_zoom for size, x, row in zoom['largest']
+    ))
+    layers: Dict[str, Dict[str, int]] = {}
+    for zoom in per_zoom:
+        for name, (nbytes, features, tiles) in zoom['layers'].items():
+            totals = layers.setdefault(name, {'bytes': 0, 'features': 0, 'tiles': 0})
+            totals['bytes'] += nbytes
+            totals['features'] += features
+            totals['tiles'] += tiles
+
+    def tile_entry(size: int, z: int, x: int, row: int) -> Dict[str, Any]:
+        y = tms_to_xyz(z, row)
+        return {'z': z, 'x': x, 'y': y, 'bytes': size, 'bounds': [round(v, 5) for v in tile_bounds(z, x, y)]}
+
+    return {
+        'file': path,
+        'file_bytes': os.path.getsize(path),
+        'metadata': {k: v for k, v in metadata.items() if k != 'json'},
+        'zooms': [
+            {
+                'zoom': zoom['zoom'],
+                'count': zoom['count'],
+                'bytes': zoom['bytes'],
+                'uncompressed_bytes': zoom['uncompressed_bytes'],
+                'avg_bytes': zoom['bytes'] // zoom['count'] if zoom['count'] else 0,
+                'histogram': {f'<{1 << k}': n for k, n in enumerate(zoom['histogram']) if n},
+                'largest': [tile_entry(size, zoom['zoom'], x, row) for size, x, row in zoom['largest']],
+            }
+            for zoom in per_zoom
+        ],
+        'largest': [tile_entry(*entry) for entry in largest],
+        'layers': dict(sorted(layers.items(), key=lambda item: -item[1]['bytes'])),
+    }
+
+
+def _human(n: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return f'{n:.0f} {unit}' if unit == 'B' else f'{n:.1f} {unit}'
+        n /= 1024
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{report['file']} ({_human(report['file_bytes'])})")
+    print(f"\n{'zoom':>4} {'tiles':>10} {'total':>10} {'raw':>10} {'avg':>9} {'max':>9}")
+    for zoom in report['zooms']:
+        raw = _human(zoom['uncompressed_bytes']) if zoom['uncompressed_bytes'] is not None else '-'
+        biggest = _human(zoom['largest'][0]['bytes']) if zoom['largest'] else '-'
+        print(f"{zoom['zoom']:>4} {zoom['count']:>10,} {_human(zoom['bytes']):>10} {raw:>10} "
+              f"{_human(zoom['avg_bytes']):>9} {biggest:>9}")
+
+    print("\nSize histogram (tiles per size bucket)")
+    for zoom in report['zooms']:
+        buckets = ', '.join(f'{k}: {n}' for k, n in zoom['histogram'].items())
+        print(f"  z{zoom['zoom']}: {buckets}")
+
+    if report['largest']:
+        print(f"\nLargest {len(report['largest'])} tiles")
+        for tile in report['largest']:
+            west, south, east, north = tile['bounds']
+            coords = f"{tile['z']}/{tile['x']}/{tile['y']}"
+            print(f"  {coords:<16} {_human(tile['bytes']):>9}  "
+                  f"[{west:.3f}, {south:.3f}, {east:.3f}, {north:.3f}]")
+
+    if report['layers']:
+        total = sum(layer['bytes'] for layer in report['layers'].values()) or 1
+        print("\nUncompressed bytes by layer")
+        for name, layer in report['layers'].items():
+            print(f"  {name:<24} {_human(layer['bytes']):>10} {100 * layer['bytes'] / total:5.1f}%  "
+                  f"{layer['features']:>12,} features in {layer['tiles']:,} tiles")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Profile tile sizes in an MBTiles file")
+    parser.add_argument('mbtiles')
+    parser.add_argument('--top', type=int, default=20, help="Number of largest tiles to report (default 20, 0 for none)")
+    parser.add_argument('--no-decode', action='store_true', help="Skip decompression and layer attribution")
+    parser.add_argument('--workers', type=int, default=0, help="Parallel zoom scans (default: one per CPU)")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args(argv)
+    if args.top < 0:
+        parser.error('--top must be 0 or more')
+
+    report = inspect(args.mbtiles, top=args.top, decode=not args.no_decode, workers=args.workers)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Style pruning - check MapLibre styles against the MBTiles `vector_layers`,
+drop layers that can never draw, clamp zoom ranges, fold constant expressions
+and write minified output
+
+    python style_prune.py ../../data/canada.mbtiles ../tileserver/styles --out-dir ../tileserver/styles-dist
+    python style_prune.py ../../data/canada.mbtiles ../tileserver/styles/basic/style.json --out-dir /tmp/styles
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import glob
+import json
+import os
+import sys
+
+from mbtiles import connect, read_metadata
+
+# MapLibre GL JS default maximum zoom; layers starting beyond it never show
+DEFAULT_MAX_VIEW_ZOOM = 22
+
+
+def tileset_layers(path: str) -> Tuple[Dict[str, Tuple[float, float]], int]:
+    """{source-layer: (minzoom, maxzoom)} and the tileset maxzoom from MBTiles metadata"""
+    conn = connect(path)
+    metadata = read_metadata(conn)
+    conn.close()
+    maxzoom = int(metadata.get('maxzoom', 14))
+    layers = {}
+    for layer in json.loads(metadata.get('json', '{}')).get('vector_layers', []):
+        layers[layer['id']] = (layer.get('minzoom', 0), layer.get('maxzoom', maxzoom))
+    return layers, maxzoom
+
+
+def fold(value: Any) -> Any:
+    """Fold expressions whose result does not depend on zoom or feature data"""
+    if isinstance(value, dict):
+        if set(value) == {'stops'} or set(value) == {'stops', 'base'}:
+            outputs = [fold(stop[1]) for stop in value['stops']]
+            if outputs and all(o == outputs[0] for o in outputs):
+                return outputs[0]
+        return {k: fold(v) for k, v in value.items()}
+    if not isinstance(value, list) or not value or not isinstance(value[0], str):
+        return value
+
+    op, args = value[0], [fold(arg) for arg in value[1:]]
+    if op == 'literal' and len(args) == 1 and not isinstance(args[0], (list, dict)):
+        return args[0]
+    if op in ('interpolate', 'interpolate-hcl', 'interpolate-lab') and len(args) >= 4:
+        outputs = args[3::2]
+        if all(o == outputs[0] for o in outputs):
+            return outputs[0]
+    if op == 'step' and len(args) >= 2:
+        outputs = [args[1]] + args[3::2]
+        if all(o == outputs[0] for o in outputs):
+            return outputs[0]
+    if op in ('all', 'any'):
+        identity = op == 'all'
+        args = [arg for arg in args if arg is not identity]
+        if any(arg is (not identity) for arg in args):
+            return not identity
+        if not args:
+            return identity
+        if len(args) == 1:
+            return args[0]
+    if op == 'case' and len(args) >= 3 and args[0] is True:
+        return args[1]
+    return [op] + args
+
+
+def prune_style(style: Dict[str, Any], layers: Dict[str, Tuple[float, float]], tileset_maxzoom: int,
+                max_view_zoom: float = DEFAULT_MAX_VIEW_ZOOM) -> Tuple[Dict[str, Any], List[str]]:
+    """Return the pruned style and a log of what changed"""
+    log = []
+    vector_sources = {name for name, source in style.get('sources', {}).items() if source.get('type') == 'vector'}
+    kept = []
+    for layer in style.get('layers', []):
+        layer_id = layer.get('id')
+        if layer.get('layout', {}).get('visibility') == 'none':
+            log.append(f'drop {layer_id}: visibility none')
+            continue
+        original = (layer.get('minzoom', 0), layer.get('maxzoom', 24))
+        minzoom, maxzoom = original
+
+        if layer.get('source') in vector_sources and 'source-layer' in layer:
+            source_layer = layer['source-layer']
+            if source_layer not in layers:
+                log.append(f'drop {layer_id}: source-layer "{source_layer}" not in tileset')
+                continue
+            data_min, data_max = layers[source_layer]
+            minzoom = max(minzoom, data_min)
+            # Tiles at the tileset maxzoom are overzoomed, so only shorter layers end early
+            if data_max < tileset_maxzoom:
+                maxzoom = min(maxzoom, data_max + 1)
+
+        if minzoom >= maxzoom or minzoom > max_view_zoom:
+            log.append(f'drop {layer_id}: empty zoom range [{minzoom}, {maxzoom})')
+            continue
+
+        layer = {k: v for k, v in layer.items() if k != 'metadata'}
+        if minzoom > 0:
+            layer['minzoom'] = minzoom
+        if maxzoom < 24:
+            layer['maxzoom'] = maxzoom
+        if (minzoom, maxzoom) != original:
+            log.append(f'clamp {layer_id}: [{minzoom}, {maxzoom})')
+        for section in ('paint', 'layout'):
+            if section in layer:
+                layer[section] = {k: fold(v) for k, v in layer[section].items()}
+        if 'filter' in layer:
+            layer['filter'] = fold(layer['filter'])
+            if layer['filter'] is True:
+                del layer['filter']
+            elif layer['filter'] is False:
+                log.append(f'drop {layer_id}: filter is always false')
+                continue
+        kept.append(layer)
+
+    pruned = {k: v for k, v in style.items() if k not in ('layers', 'metadata')}
+    pruned['layers'] = kept
+    return pruned, log
+
+
+def style_paths(inputs: List[str]) -> List[Tuple[str, str]]:
+    """(path, output name) for style files or directories of <name>/style.json"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for path in sorted(glob.glob(os.path.join(item, '*', 'style.json'))):
+                paths.append((path, os.path.join(os.path.basename(os.path.dirname(path)), 'style.json')))
+        else:
+            paths.append((item, os.path.join(os.path.basename(os.path.dirname(os.path.abspath(item))), 'style.json')))
+    return paths
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Prune and minify MapLibre styles against an MBTiles file")
+    parser.add_argument('mbtiles')
+    parser.add_argument('styles', nargs='+', help="style.json files or directories of <name>/style.json")
+    parser.add_argument('--out-dir', required=True, help="Directory for the pruned <name>/style.json files")
+    parser.add_argument('--max-view-zoom', type=float, default=DEFAULT_MAX_VIEW_ZOOM,
+                        help=f"Highest zoom the map allows (default {DEFAULT_MAX_VIEW_ZOOM})")
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    layers, tileset_maxzoom = tileset_layers(args.mbtiles)
+    if not layers:
+        parser.error(f'{args.mbtiles} has no vector_layers metadata')
+
+    for path, name in style_paths(args.styles):
+        with open(path, encoding='utf-8-sig') as f:
+            raw = f.read()
+        style, log = prune_style(json.loads(raw), layers, tileset_maxzoom, args.max_view_zoom)
+        out = json.dumps(style, ensure_ascii=False, separators=(',', ':'))
+        target = os.path.join(args.out_dir, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(out)
+        before = len(json.loads(raw).get('layers', []))
+        print(f"{path}: {before} -> {len(style['layers'])} layers, "
+              f"{len(raw.encode('utf-8')):,} -> {len(out.encode('utf-8')):,} bytes -> {target}")
+        if not args.quiet:
+            for line in log:
+                print(f'  {line}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())